@@ -1,5 +1,74 @@
-from .glwindow import *
-from .matmath import *
-from .model import *
-from .robot import *
-from .scene import *
\ No newline at end of file
+import os
+import importlib
+
+# Submodules are imported the first time one of their names is used, so
+# tools that only need e.g. Matrix4 or the OBJ parser do not pay for (or
+# require) PyOpenGL and PySDL2. "from etgg2801 import *" still imports
+# everything.
+SUBMODULES = {
+    "glcalls": ("configureProduction", "isProduction", "getByteSize",
+                "getBufferDataBytes", "getBufferSubDataBytes",
+                "getTextureBytes", "getTexSubImageBytes", "GLCallCounter"),
+    "profiler": ("FrameProfiler",),
+    "sampling": ("StackSampler",),
+    "snapshot": ("SnapshotBuffer", "InputState"),
+    "framecapture": ("encodePNG", "FrameCapture"),
+    "glwindow": ("GLWindow", "GLWindowRenderDelegate"),
+    "shader": ("compileShader", "ShaderProgram", "ShaderManager"),
+    "dynamicbuffer": ("DynamicBuffer",),
+    "matmath": ("Matrix4", "Vector4"),
+    "kinematics": ("REVOLUTE", "PRISMATIC", "getRotationArray", "toMatrix4",
+                   "KinematicChain"),
+    "collision": ("OrientedBox", "ConvexHull", "getBoxSupport",
+                  "getDirections", "fitOBB", "fitConvexHull", "getLinkBoxes",
+                  "getSeparatedBoxes", "gjk", "CollisionWorld"),
+    "assets": ("Material", "parseMTL", "parseOBJ", "Image", "decodeImage",
+               "buildMipmaps", "AssetPreloader"),
+    "quantize": ("quantizePositions", "dequantizePositions",
+                 "getPositionErrorBound", "quantizeUVs", "dequantizeUVs",
+                 "packNormals", "unpackNormals", "getNormalError"),
+    "meshopt": ("indexVertices", "analyzeVertexCache", "getAdjacency",
+                "optimizeVertexCache", "getSoftClusters", "optimizeOverdraw",
+                "optimizeVertexFetch", "optimizeMesh"),
+    "model": ("getMipmappedBytes", "getObjectBytes", "createTexture",
+              "createTextureSteps", "TextureCache", "Model", "HUDModel", "ModelPart", "OBJReader"),
+    "hud": ("AtlasRegion", "TextureAtlas", "SpriteBatch", "HUDSprite",
+            "HUDLayer"),
+    "robot": ("Joint", "RevoluteJoint", "PrismaticJoint", "Robot", "Scara",
+              "Viper"),
+    "recording": ("HEADER", "CHUNK", "INDEX_ENTRY", "FOOTER", "MAGIC",
+                  "INDEX_MAGIC", "VERSION", "FLAG_DELTA",
+                  "TrajectoryRecorder", "TrajectoryPlayer"),
+    "ik": ("IKSolver", "ScaraIKSolver", "DLSIKSolver"),
+    "simulation": ("FleetSimulation",),
+    "inputrecording": ("INPUT_HEADER", "INPUT_TICK", "INPUT_MAGIC",
+                       "INPUT_VERSION", "InputRecorder", "InputPlayer",
+                       "createFlythrough"),
+    "streaming": ("ModelHandle", "AssetStreamer"),
+    "occlusion": ("getTriangles", "selectOccluderTriangles", "clipTriangles",
+                  "rasterizeTriangles", "buildPyramid", "OcclusionCuller"),
+    "staticbatch": ("readTextureLayer", "StaticBatch"),
+    "scene": ("Scene", "SceneSnapshot", "Camera"),
+    "flythrough": ("createBoxModel", "FlythroughDelegate", "runFlythrough",
+                   "printResults", "compareResults"),
+}
+
+EXPORTS = {name: module for module, names in SUBMODULES.items() for name in names}
+__all__ = list(EXPORTS)
+
+def __getattr__(name):
+    if name not in EXPORTS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    
+    value = getattr(importlib.import_module("." + EXPORTS[name], __name__), name)
+    globals()[name] = value
+    
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(EXPORTS))
+
+# must happen before OpenGL.GL is imported by any submodule
+if os.environ.get("ETGG2801_PRODUCTION"):
+    from .glcalls import configureProduction
+    configureProduction()
@@ -0,0 +1,301 @@
+import os
+import time
+import json
+import ctypes
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+
+# Nothing here needs OpenGL, and SDL is only imported once an image is
+# decoded, so files can be parsed and decoded off the GL thread (or in other
+# processes) and the results uploaded afterwards.
+
+class Material(object):
+    """A material from a Wavefront .mtl file: its diffuse color (Kd),
+    opacity (d), and diffuse texture file (map_Kd, relative to the working
+    directory), if any. textureObject is set once the texture is loaded (see
+    TextureCache).
+    """
+    def __init__(self, name):
+        self.name = name
+        self.diffuse = (0.8, 0.8, 0.8)
+        self.opacity = 1.0
+        self.diffuseTexture = None
+        self.textureObject = None
+
+    def getColor(self):
+        """Returns the RGBA color to multiply the texture by: white for
+        textured materials (as most exporters write Kd alongside map_Kd for
+        other renderers), otherwise the diffuse color, with the opacity.
+        """
+        if self.diffuseTexture:
+            return (1.0, 1.0, 1.0, self.opacity)
+
+        return tuple(self.diffuse) + (self.opacity,)
+
+def parseMTL(file):
+    """Parses a Wavefront .mtl file into a dictionary of Materials by name.
+    """
+    materials = {}
+    material = None
+    directory = os.path.dirname(file)
+
+    with open(file) as fp:
+        for line in fp:
+            words = line.split()
+            if not words:
+                continue
+
+            if words[0] == 'newmtl':
+                material = Material(" ".join(words[1:]))
+                materials[material.name] = material
+            elif material is None:
+                continue
+            elif words[0] == 'Kd':
+                material.diffuse = tuple(float(c) for c in words[1:4])
+            elif words[0] == 'd':
+                material.opacity = float(words[1])
+            elif words[0] == 'Tr':
+                material.opacity = 1.0 - float(words[1])
+            elif words[0] == 'map_Kd':
+                # options such as -s or -o come before the file name
+                material.diffuseTexture = os.path.join(directory, words[-1])
+
+    return materials
+
+def parseOBJ(file):
+    """Parses the objects ('o') of a Wavefront .obj file into a list of
+    (name, vertices, uvs, indices, uvIndices, materials) tuples, as used by
+    ModelPart. materials lists (Material, first index) for every usemtl in
+    the object, the Material being None where no material was set (or it is
+    not in the mtllib files, which are ignored if missing). See
+    OBJReader.buildModel.
+    """
+    parts = []
+    vertices, uvs, indices, uvIndices, materials = None, None, None, None, None
+    library = {}
+    material = None
+
+    with open(file) as fp:
+        for line in fp:
+            if line[0:2] == 'v ':
+                vertices.extend(float(v) for v in line.split()[1:])
+            elif line[0:2] == 'vt':
+                uvs.extend(float(uv) for uv in line.split()[1:])
+            elif line[0] == 'f':
+                for index in line.split()[1:]:
+                    tmpIndex = index.split('/')
+                    indices.append(int(tmpIndex[0]) - 1)
+                    if len(tmpIndex) > 1:
+                        uvIndices.append(int(tmpIndex[1]) - 1)
+            elif line[0] == 'o':
+                vertices, uvs, indices, uvIndices = [], [], [], []
+                materials = [(material, 0)] if material else []
+                parts.append((line.split()[1], vertices, uvs, indices, uvIndices,
+                              materials))
+            elif line.startswith('usemtl'):
+                material = library.get(line[6:].strip())
+                if materials is not None:
+                    materials.append((material, len(indices)))
+            elif line.startswith('mtllib'):
+                for name in line.split()[1:]:
+                    libraryFile = os.path.join(os.path.dirname(file), name)
+                    if os.path.exists(libraryFile):
+                        library.update(parseMTL(libraryFile))
+
+    return parts
+
+class Image(object):
+    """Decoded pixels of an image, tightly packed rows from the top, ready to
+    be passed to glTexImage2D. format is 'RGB', 'BGR', 'RGBA' or 'BGRA'.
+    """
+    def __init__(self, width, height, format, pixels):
+        self.width = width
+        self.height = height
+        self.format = format
+        self.pixels = pixels
+
+def decodeImage(file):
+    """Decodes an image file with SDL_image and returns an Image. The
+    decoding itself runs without holding the GIL, so images decode in
+    parallel on worker threads.
+    """
+    import sdl2
+    from sdl2 import sdlimage
+
+    surface = sdlimage.IMG_Load(bytes(file, 'UTF-8'))
+    if not surface:
+        raise Exception("Unable to load image: " + file)
+
+    try:
+        width = surface.contents.w
+        height = surface.contents.h
+        pitch = surface.contents.pitch
+        bmask = surface.contents.format.contents.Bmask
+        bytesPerPixel = surface.contents.format.contents.BytesPerPixel
+
+        if bytesPerPixel == 3:
+            imgFormat = 'BGR' if bmask == 255 else 'RGB'
+        elif bytesPerPixel == 4:
+            imgFormat = 'BGRA' if bmask == 255 else 'RGBA'
+        else:
+            raise Exception("Unsupported image format: " + file)
+
+        pixels = ctypes.string_at(surface.contents.pixels, pitch * height)
+        if pitch != width * bytesPerPixel:
+            rows = np.frombuffer(pixels, dtype=np.uint8).reshape(height, pitch)
+            pixels = rows[:, :width * bytesPerPixel].tobytes()
+    finally:
+        sdl2.SDL_FreeSurface(surface)
+
+    return Image(width, height, imgFormat, pixels)
+
+def buildMipmaps(image):
+    """Returns the full mipmap chain of an Image, down to 1x1, each level the
+    2x2 box filtered average of the one before (odd rows and columns are
+    dropped, as in GL's level sizes). Like decodeImage, this can run on a
+    worker thread.
+    """
+    levels = [image]
+    pixels = np.frombuffer(image.pixels, dtype=np.uint8).reshape(image.height,
+        image.width, len(image.format))
+
+    while pixels.shape[0] > 1 or pixels.shape[1] > 1:
+        height = max(1, pixels.shape[0] // 2)
+        width = max(1, pixels.shape[1] // 2)
+
+        summed = pixels.astype(np.uint16)
+        if pixels.shape[0] > 1:
+            summed = summed[0 : 2 * height : 2] + summed[1 : 2 * height : 2]
+        else:
+            summed = summed * 2
+        if pixels.shape[1] > 1:
+            summed = summed[:, 0 : 2 * width : 2] + summed[:, 1 : 2 * width : 2]
+        else:
+            summed = summed * 2
+
+        pixels = ((summed + 2) // 4).astype(np.uint8)
+        levels.append(Image(width, height, image.format, pixels.tobytes()))
+
+    return levels
+
+def runTimed(function, *args):
+    """Returns (function(*args), start, end, worker) for the timeline.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    end = time.perf_counter()
+
+    if threading.current_thread() is threading.main_thread():
+        worker = "process %d" % os.getpid()
+    else:
+        worker = threading.current_thread().name
+
+    return result, start, end, worker
+
+class AssetPreloader(object):
+    """Parses models and decodes images on a pool of worker threads (models
+    optionally in worker processes) while the caller does other start up
+    work, such as creating the window. After wait, the results only need to
+    be uploaded to GL. Every step, including ones recorded by the caller, is
+    kept in a timeline relative to startTime.
+    """
+    def __init__(self, workers=4, processes=False, startTime=None):
+        """With processes, .obj files are parsed in worker processes, which
+        avoids the GIL but pays for starting them; create the preloader
+        before any GL context when using it. startTime (time.perf_counter)
+        defaults to now.
+        """
+        self.startTime = time.perf_counter() if startTime is None else startTime
+        self.threads = ThreadPoolExecutor(workers, thread_name_prefix="preload")
+        self.processes = ProcessPoolExecutor(workers) if processes else None
+
+        self.jobs = {}
+        self.results = {}
+        self.timeline = []
+        self.imagesInitialized = False
+
+    def addModel(self, name, file):
+        """Starts parsing an .obj file; get(name) returns the parseOBJ result.
+        """
+        pool = self.processes or self.threads
+        self.jobs[name] = ("parse " + file, pool.submit(runTimed, parseOBJ, file))
+
+    def addImage(self, name, file):
+        """Starts decoding an image; get(name) returns the Image.
+        """
+        if not self.imagesInitialized:
+            # once, here, rather than lazily and concurrently on the workers
+            from sdl2 import sdlimage
+            sdlimage.IMG_Init(sdlimage.IMG_INIT_PNG | sdlimage.IMG_INIT_JPG)
+            self.imagesInitialized = True
+
+        self.jobs[name] = ("decode " + file, self.threads.submit(runTimed, decodeImage, file))
+
+    def wait(self):
+        """Waits for every job, shuts the workers down, and returns a
+        dictionary of the results by name.
+        """
+        waitStart = time.perf_counter()
+        for name, (label, future) in self.jobs.items():
+            result, start, end, worker = future.result()
+            self.results[name] = result
+            self.record(label, start, end, worker)
+        self.jobs = {}
+
+        self.threads.shutdown()
+        if self.processes:
+            self.processes.shutdown()
+        self.record("wait for workers", waitStart, time.perf_counter())
+
+        return self.results
+
+    def get(self, name):
+        return self.results[name]
+
+    def record(self, label, start, end, worker=None):
+        """Adds a step (perf_counter start and end times) to the timeline.
+        """
+        if worker is None:
+            worker = threading.current_thread().name
+        self.timeline.append((label, worker, start - self.startTime, end - self.startTime))
+
+    @contextlib.contextmanager
+    def track(self, label):
+        """Records the time spent in a with block on the timeline.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(label, start, time.perf_counter())
+
+    def printTimeline(self, width=40):
+        """Prints every step, in order of starting time, with its worker,
+        start and duration in ms, and a bar showing when it ran.
+        """
+        if not self.timeline:
+            return
+
+        steps = sorted(self.timeline, key=lambda step: step[2])
+        total = max(step[3] for step in steps)
+        scale = width / max(total, 1e-9)
+
+        print("Startup timeline: %.1f ms" % (total * 1000.0))
+        for label, worker, start, end in steps:
+            first = int(start * scale)
+            bar = " " * first + "#" * max(1, int(end * scale) - first)
+            print("  %-28s %-12s %8.1f %8.1f  |%-*s|" % (label[:28], worker[:12],
+                start * 1000.0, (end - start) * 1000.0, width, bar))
+
+    def writeTrace(self, file):
+        """Writes the timeline in the Trace Event format, which can be opened
+        in chrome://tracing or Perfetto.
+        """
+        events = [{"name": label, "ph": "X", "pid": 0, "tid": worker,
+                   "ts": start * 1e6, "dur": (end - start) * 1e6}
+                  for label, worker, start, end in self.timeline]
+
+        with open(file, "w") as fp:
+            json.dump({"traceEvents": events}, fp, indent=1)
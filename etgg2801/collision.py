@@ -0,0 +1,571 @@
+import time
+import numpy as np
+
+class OrientedBox(object):
+    """Oriented bounding box in the local space of a part: a center, three
+    axes (the columns of axes), and the half extents along them.
+    """
+    def __init__(self, center, axes, halfExtents):
+        self.center = np.array(center, dtype=np.float64)
+        self.axes = np.array(axes, dtype=np.float64)
+        self.halfExtents = np.array(halfExtents, dtype=np.float64)
+
+    def getBox(self):
+        return self
+
+    def getSupport(self, rotation, translation):
+        """Returns the support function of this box once placed in the world
+        by rotation (3x3) and translation (3,).
+        """
+        center = rotation.dot(self.center) + translation
+        axes = (rotation.dot(self.axes) * self.halfExtents).T
+
+        return getBoxSupport(center.tolist(), axes.tolist())
+
+class ConvexHull(object):
+    """Convex hull in the local space of a part, kept as the extreme points
+    of the part's vertices. A fitted OrientedBox is used for broad phase.
+    """
+    def __init__(self, points):
+        self.points = np.array(points, dtype=np.float64)
+        self.box = fitOBB(self.points)
+
+    def getBox(self):
+        return self.box
+
+    def getSupport(self, rotation, translation):
+        points = self.points.dot(rotation.T) + translation
+
+        def support(d):
+            return points[np.argmax(points.dot(d))].tolist()
+
+        return support
+
+def getBoxSupport(center, axes):
+    """Returns the support function of a world space box given its center and
+    its three axes scaled by the half extents (as lists).
+    """
+    (ax, ay, az), (bx, by, bz), (cx, cy, cz) = axes
+    x, y, z = center
+
+    def support(d):
+        dx, dy, dz = d
+        sa = 1.0 if ax * dx + ay * dy + az * dz >= 0 else -1.0
+        sb = 1.0 if bx * dx + by * dy + bz * dz >= 0 else -1.0
+        sc = 1.0 if cx * dx + cy * dy + cz * dz >= 0 else -1.0
+        return [x + sa * ax + sb * bx + sc * cx,
+                y + sa * ay + sb * by + sc * cy,
+                z + sa * az + sb * bz + sc * cz]
+
+    return support
+
+def getDirections(subdivisions=4):
+    """Returns unit directions spread over the sphere (cube map samples).
+    """
+    steps = np.linspace(-1.0, 1.0, subdivisions + 1)
+    u, v = np.meshgrid(steps, steps)
+    u, v = u.ravel(), v.ravel()
+    ones = np.ones_like(u)
+
+    directions = []
+    for s in (1.0, -1.0):
+        directions.append(np.stack((s * ones, u, v), axis=1))
+        directions.append(np.stack((u, s * ones, v), axis=1))
+        directions.append(np.stack((u, v, s * ones), axis=1))
+    directions = np.unique(np.concatenate(directions), axis=0)
+
+    return directions / np.linalg.norm(directions, axis=1)[:, np.newaxis]
+
+def fitOBB(points):
+    """Fits an OrientedBox to an (N, 3) array of points, using the principal
+    axes of the points unless the axis aligned box is smaller.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+
+    candidates = [np.eye(3)]
+    if len(points) > 3:
+        covariance = np.cov(points.T)
+        candidates.append(np.linalg.eigh(covariance)[1])
+
+    best = None
+    for axes in candidates:
+        projected = points.dot(axes)
+        low = projected.min(axis=0)
+        high = projected.max(axis=0)
+        volume = np.prod(high - low + 1e-9)
+        if best is None or volume < best[0]:
+            best = (volume, axes, low, high)
+
+    volume, axes, low, high = best
+
+    return OrientedBox(axes.dot((low + high) / 2), axes, (high - low) / 2)
+
+def fitConvexHull(points, subdivisions=4):
+    """Returns a ConvexHull made of the points that are extreme along a set
+    of sampled directions. Every returned point is on the true hull.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    extreme = np.unique(np.argmax(points.dot(getDirections(subdivisions).T), axis=0))
+
+    return ConvexHull(points[extreme])
+
+def getLinkBoxes(chain, radius=0.04):
+    """Returns boxes approximating each link of a KinematicChain, spanning
+    from the link's origin to the next joint's offset. Useful when a robot
+    has no model to fit shapes to.
+    """
+    shapes = {}
+    for k, name in enumerate(chain.partNames):
+        if k < chain.getNumJoints():
+            end = chain.offsets[k]
+        else:
+            end = np.zeros(3)
+
+        points = np.array([(0, 0, 0), end])
+        low = points.min(axis=0) - radius
+        high = points.max(axis=0) + radius
+        shapes[name] = OrientedBox((low + high) / 2, np.eye(3), (high - low) / 2)
+
+    return shapes
+
+def getSeparatedBoxes(centerA, axesA, halfA, centerB, axesB, halfB):
+    """Separating axis test for arrays of world space box pairs (centers
+    (P, 3), unit axes as columns (P, 3, 3), half extents (P, 3)). Returns a
+    boolean array, True where the pair does not overlap.
+    """
+    rotation = np.matmul(np.swapaxes(axesA, 1, 2), axesB)
+    absRotation = np.abs(rotation) + 1e-9
+    offset = np.einsum('pam,pa->pm', axesA, centerB - centerA)
+
+    # face normals of A, then of B
+    separated = np.any(np.abs(offset) > halfA +
+        np.einsum('pmk,pk->pm', absRotation, halfB), axis=1)
+    separated |= np.any(np.abs(np.einsum('pmk,pm->pk', rotation, offset)) > halfB +
+        np.einsum('pmk,pm->pk', absRotation, halfA), axis=1)
+
+    # cross products of each pair of edges
+    for m in range(3):
+        m1, m2 = (m + 1) % 3, (m + 2) % 3
+        for k in range(3):
+            k1, k2 = (k + 1) % 3, (k + 2) % 3
+            distance = np.abs(offset[:, m2] * rotation[:, m1, k] - offset[:, m1] * rotation[:, m2, k])
+            radius = (halfA[:, m1] * absRotation[:, m2, k] + halfA[:, m2] * absRotation[:, m1, k] +
+                      halfB[:, k1] * absRotation[:, m, k2] + halfB[:, k2] * absRotation[:, m, k1])
+            separated |= distance > radius
+
+    return separated
+
+def gjk(supportA, supportB, maxIterations=32):
+    """Returns True if the convex shapes given by two support functions
+    intersect (Gilbert-Johnson-Keerthi on the Minkowski difference).
+    """
+    d = [1.0, 0.0, 0.0]
+    a = _sub(supportA(d), supportB(_neg(d)))
+    simplex = [a]
+    d = _neg(a)
+
+    for i in range(maxIterations):
+        if _dot(d, d) < 1e-20:
+            return True
+
+        a = _sub(supportA(d), supportB(_neg(d)))
+        if _dot(a, d) < 0:
+            return False
+
+        simplex.append(a)
+        contains, d = _doSimplex(simplex)
+        if contains:
+            return True
+
+    # did not terminate, treat as touching
+    return True
+
+def _sub(a, b):
+    return [a[0] - b[0], a[1] - b[1], a[2] - b[2]]
+
+def _neg(a):
+    return [-a[0], -a[1], -a[2]]
+
+def _dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+def _cross(a, b):
+    return [a[1] * b[2] - a[2] * b[1],
+            a[2] * b[0] - a[0] * b[2],
+            a[0] * b[1] - a[1] * b[0]]
+
+def _tripleCross(a, b):
+    # direction perpendicular to a, towards b (in the plane of a and b)
+    return _cross(_cross(a, b), a)
+
+def _doSimplex(simplex):
+    """Reduces the simplex (newest point last) to the feature closest to the
+    origin, in place. Returns (containsOrigin, nextDirection).
+    """
+    a = simplex[-1]
+    ao = _neg(a)
+
+    if len(simplex) == 2:
+        b = simplex[0]
+        ab = _sub(b, a)
+        if _dot(ab, ao) > 0:
+            d = _tripleCross(ab, ao)
+            return _dot(d, d) < 1e-20, d
+        simplex[:] = [a]
+        return False, ao
+
+    if len(simplex) == 3:
+        return _doTriangle(simplex, simplex[0], simplex[1], a, ao)
+
+    d, c, b = simplex[0], simplex[1], simplex[2]
+    ab = _sub(b, a)
+    ac = _sub(c, a)
+    ad = _sub(d, a)
+    abc = _cross(ab, ac)
+    acd = _cross(ac, ad)
+    adb = _cross(ad, ab)
+
+    if _dot(abc, ao) > 0:
+        return _doTriangle(simplex, c, b, a, ao)
+    if _dot(acd, ao) > 0:
+        return _doTriangle(simplex, d, c, a, ao)
+    if _dot(adb, ao) > 0:
+        return _doTriangle(simplex, b, d, a, ao)
+
+    return True, ao
+
+def _doTriangle(simplex, c, b, a, ao):
+    ab = _sub(b, a)
+    ac = _sub(c, a)
+    abc = _cross(ab, ac)
+
+    if _dot(_cross(abc, ac), ao) > 0:
+        if _dot(ac, ao) > 0:
+            simplex[:] = [c, a]
+            d = _tripleCross(ac, ao)
+            return _dot(d, d) < 1e-20, d
+        return _doLine(simplex, b, a, ao)
+
+    if _dot(_cross(ab, abc), ao) > 0:
+        return _doLine(simplex, b, a, ao)
+
+    side = _dot(abc, ao)
+    if side > 0:
+        simplex[:] = [c, b, a]
+        return False, abc
+    if side < 0:
+        simplex[:] = [b, c, a]
+        return False, _neg(abc)
+
+    # origin lies in the triangle
+    return True, abc
+
+def _doLine(simplex, b, a, ao):
+    ab = _sub(b, a)
+    if _dot(ab, ao) > 0:
+        simplex[:] = [b, a]
+        d = _tripleCross(ab, ao)
+        return _dot(d, d) < 1e-20, d
+
+    simplex[:] = [a]
+    return False, ao
+
+class CollisionWorld(object):
+    """Collision checking between the links of robots and the parts of scene
+    objects (Model instances). Every check computes the world boxes of all
+    bodies in a few array passes, finds overlapping pairs with sweep and
+    prune, and confirms them with GJK. Self collisions between links closer
+    than selfSkip joints apart (e.g. parent and child) are not reported.
+    """
+    def __init__(self, selfSkip=1):
+        self.selfSkip = selfSkip
+        self.robots = []
+        self.objects = []
+        self.robotShapes = []
+        self.objectShapes = []
+        self.ignored = set()
+        self.dirty = True
+
+        self.numCandidates = 0
+        self.numGJK = 0
+        self.checkTime = 0.0
+
+    def addRobot(self, robot, shapes=None):
+        """Adds a robot whose links are checked each tick. shapes maps part
+        names to collision shapes and defaults to those of the robot's model.
+        """
+        if shapes is None:
+            shapes = robot.model.collisionShapes
+        self.robots.append(robot)
+        self.robotShapes.append(shapes)
+        self.dirty = True
+
+    def removeRobot(self, robot):
+        index = self.robots.index(robot)
+        del self.robots[index]
+        del self.robotShapes[index]
+        self.dirty = True
+
+    def addObject(self, o, shapes=None):
+        """Adds a scene object (anything with a modelMatrix). shapes defaults
+        to the collision shapes of its model parts.
+        """
+        if shapes is None:
+            shapes = o.collisionShapes
+        self.objects.append(o)
+        self.objectShapes.append(shapes)
+        self.dirty = True
+
+    def removeObject(self, o):
+        index = self.objects.index(o)
+        del self.objects[index]
+        del self.objectShapes[index]
+        self.dirty = True
+
+    def ignore(self, a, b):
+        """Stops reporting collisions between two robots/objects (e.g. a robot
+        and the floor it stands on).
+        """
+        self.ignored.add((id(a), id(b)))
+        self.ignored.add((id(b), id(a)))
+
+    def build(self):
+        """Builds the body tables after robots or objects are added/removed.
+        """
+        self.bodies = []
+        owners = []
+        links = []
+        transforms = []
+        shapes = []
+
+        # robots are grouped by type so their links are computed in one pass
+        self.groups = {}
+        numLinks = 0
+        for r, robotShapes in zip(self.robots, self.robotShapes):
+            chain = r.getKinematics()
+            key = (type(r), chain.getNumJoints())
+            self.groups.setdefault(key, ([], []))
+            robots, indices = self.groups[key]
+            robots.append(r)
+            indices.append(np.arange(numLinks, numLinks + chain.getNumLinks()))
+
+            for k, name in enumerate(chain.partNames):
+                if name in robotShapes:
+                    self.bodies.append((r, name))
+                    owners.append(id(r))
+                    links.append(k)
+                    transforms.append(numLinks + k)
+                    shapes.append(robotShapes[name])
+            numLinks += chain.getNumLinks()
+
+        self.numRobotLinks = numLinks
+        for i, (o, objectShapes) in enumerate(zip(self.objects, self.objectShapes)):
+            for name, shape in objectShapes.items():
+                self.bodies.append((o, name))
+                owners.append(id(o))
+                links.append(-1)
+                transforms.append(numLinks + i)
+                shapes.append(shape)
+
+        self.shapes = shapes
+        self.owners = np.array(owners, dtype=np.int64)
+        self.links = np.array(links, dtype=np.int64)
+        self.isRobot = self.links >= 0
+        self.isBox = np.array([isinstance(s, OrientedBox) for s in shapes], dtype=bool)
+        self.transformIndex = np.array(transforms, dtype=np.int64)
+
+        boxes = [s.getBox() for s in shapes]
+        self.centers = np.array([b.center for b in boxes]).reshape(-1, 3)
+        self.axes = np.array([b.axes for b in boxes]).reshape(-1, 3, 3)
+        self.halfExtents = np.array([b.halfExtents for b in boxes]).reshape(-1, 3)
+
+        self.dirty = False
+
+    def getTransforms(self):
+        """Returns the world transformation of every robot link followed by
+        every object.
+        """
+        transforms = np.empty((self.numRobotLinks + len(self.objects), 4, 4))
+
+        for robots, indices in self.groups.values():
+            chain = robots[0].getKinematics()
+            values = [[j.value for j in r.joints] for r in robots]
+            positions = [r.position.getXYZ() for r in robots]
+            orientations = [r.orientation.getXYZ() for r in robots]
+            world = chain.forwardKinematics(values, positions, orientations)
+            transforms[np.concatenate(indices)] = world.reshape(-1, 4, 4)
+
+        for i, o in enumerate(self.objects):
+            transforms[self.numRobotLinks + i] = o.modelMatrix.data
+
+        return transforms
+
+    def getCandidatePairs(self, low, high):
+        """Sweep and prune over world AABBs: returns (i, j) index arrays of the
+        boxes overlapping on all three axes.
+
+        Sweeping along one axis alone pairs every box with all those in the
+        same row of a spread out world (a grid of robots), so the boxes are
+        first split into strips along a second axis, about as wide as a
+        box, and swept strip by strip. A box spanning several strips is in
+        each of them; a pair is kept only in the strip holding the larger of
+        their lows, so it is reported once.
+        """
+        if len(low) < 2:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+        axes = np.argsort(np.var(low, axis=0))
+        axis, stripAxis = axes[2], axes[1]
+
+        origin = low[:, stripAxis].min()
+        size = high[:, stripAxis] - low[:, stripAxis]
+        width = max(float(np.median(size)), 1e-6)
+        numStrips = min(int((high[:, stripAxis].max() - origin) / width) + 1,
+                        int(np.sqrt(len(low))) + 1)
+        width = max(width, (high[:, stripAxis].max() - origin) / numStrips)
+        first = np.minimum(((low[:, stripAxis] - origin) / width).astype(np.intp), numStrips - 1)
+        last = np.minimum(((high[:, stripAxis] - origin) / width).astype(np.intp), numStrips - 1)
+
+        # one entry per (box, strip) it covers
+        spans = last - first + 1
+        boxes = np.repeat(np.arange(len(low)), spans)
+        strips = np.repeat(first, spans) + (np.arange(spans.sum()) -
+            np.repeat(np.cumsum(spans) - spans, spans))
+
+        # strips are laid end to end on the sweep axis, so a search never
+        # runs into the next strip
+        sweepLow = low[:, axis] - low[:, axis].min()
+        stride = (high[:, axis] - low[:, axis].min()).max() + 1.0
+        keys = strips * stride + sweepLow[boxes]
+        order = np.argsort(keys, kind='stable')
+        sortedKeys = keys[order]
+
+        # every entry overlapping entry k on the sweep axis starts before it ends
+        ends = np.searchsorted(sortedKeys, strips[order] * stride +
+            (high[boxes[order], axis] - low[:, axis].min()), side='right')
+        starts = np.arange(len(order)) + 1
+        counts = np.maximum(ends - starts, 0)
+
+        firstEntry = np.repeat(np.arange(len(order)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        secondEntry = np.repeat(starts, counts) + offsets
+
+        i, j = boxes[order[firstEntry]], boxes[order[secondEntry]]
+        strip = strips[order[firstEntry]]
+        home = np.maximum(first[i], first[j])
+        overlap = (strip == home) & np.all((low[i] <= high[j]) & (low[j] <= high[i]), axis=1)
+
+        return i[overlap], j[overlap]
+
+    def check(self):
+        """Returns a list of colliding ((ownerA, partA), (ownerB, partB))
+        pairs: robot self collisions, robot against robot, and robot against
+        scene objects.
+        """
+        startTime = time.perf_counter()
+
+        if self.dirty:
+            self.build()
+
+        contacts = []
+        if len(self.bodies) == 0:
+            self.numCandidates = 0
+            self.numGJK = 0
+            self.checkTime = time.perf_counter() - startTime
+            return contacts
+
+        transforms = self.getTransforms()[self.transformIndex]
+        rotations = transforms[:, :3, :3]
+        translations = transforms[:, :3, 3]
+
+        centers = np.einsum('nab,nb->na', rotations, self.centers) + translations
+        axes = np.matmul(rotations, self.axes)
+        extents = np.einsum('nab,nb->na', np.abs(axes), self.halfExtents)
+
+        i, j = self.getCandidatePairs(centers - extents, centers + extents)
+
+        sameOwner = self.owners[i] == self.owners[j]
+        keep = self.isRobot[i] | self.isRobot[j]
+        keep &= ~sameOwner | (np.abs(self.links[i] - self.links[j]) > self.selfSkip)
+        i, j = i[keep], j[keep]
+        self.numCandidates = len(i)
+
+        # separating axis test between the boxes of every pair; box pairs are
+        # resolved exactly here, pairs involving a hull go on to GJK
+        separated = getSeparatedBoxes(centers[i], axes[i], self.halfExtents[i],
+            centers[j], axes[j], self.halfExtents[j])
+        i, j = i[~separated], j[~separated]
+        solved = self.isBox[i] & self.isBox[j]
+
+        for a, b in zip(i[solved].tolist(), j[solved].tolist()):
+            ownerA = self.bodies[a][0]
+            ownerB = self.bodies[b][0]
+            if not self.ignored or (id(ownerA), id(ownerB)) not in self.ignored:
+                contacts.append((self.bodies[a], self.bodies[b]))
+        i, j = i[~solved], j[~solved]
+
+        self.numGJK = len(i)
+        if len(i) == 0:
+            self.checkTime = time.perf_counter() - startTime
+            return contacts
+
+        # world boxes as lists, so box supports avoid per call array overhead
+        needed = np.unique(np.concatenate((i, j)))
+        boxAxes = np.swapaxes(axes[needed] * self.halfExtents[needed, np.newaxis, :], 1, 2)
+        supports = {}
+        for k, center, boxAxis in zip(needed.tolist(), centers[needed].tolist(), boxAxes.tolist()):
+            if self.isBox[k]:
+                supports[k] = getBoxSupport(center, boxAxis)
+            else:
+                supports[k] = self.shapes[k].getSupport(rotations[k], translations[k])
+
+        for a, b in zip(i.tolist(), j.tolist()):
+            ownerA = self.bodies[a][0]
+            ownerB = self.bodies[b][0]
+            if self.ignored and (id(ownerA), id(ownerB)) in self.ignored:
+                continue
+
+            if gjk(supports[a], supports[b]):
+                contacts.append((self.bodies[a], self.bodies[b]))
+
+        self.checkTime = time.perf_counter() - startTime
+
+        return contacts
+
+def benchmark(numRobots=300, ticks=100, spacing=1.0):
+    """Checks a grid of moving Viper arms, using link boxes built from the
+    joint offsets, and prints the time per check.
+    """
+    from . import Viper, FleetSimulation
+
+    robots = [Viper() for i in range(numRobots)]
+    side = int(np.ceil(np.sqrt(numRobots)))
+    for k, r in enumerate(robots):
+        r.position.setX((k % side) * spacing)
+        r.position.setZ((k // side) * spacing)
+
+    shapes = getLinkBoxes(robots[0].getKinematics())
+    world = CollisionWorld()
+    for r in robots:
+        world.addRobot(r, shapes)
+
+    fleet = FleetSimulation.fromRobots(robots)
+    fleet.values = np.random.default_rng(0).uniform(fleet.chain.valueMin,
+        fleet.chain.valueMax, fleet.values.shape)
+
+    elapsed = 0.0
+    numContacts = 0
+    for t in range(ticks):
+        fleet.update(10)
+        fleet.applyTo(robots)
+        numContacts += len(world.check())
+        elapsed += world.checkTime
+
+    print("Viper x", numRobots)
+    print("  bodies:          ", len(world.bodies))
+    print("  SAT pairs (last): ", world.numCandidates)
+    print("  contacts/tick:    %.1f" % (numContacts / ticks))
+    print("  time/check:       %.2f ms" % (1000.0 * elapsed / ticks))
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,220 @@
+import os
+import time
+import ctypes
+import numpy as np
+from OpenGL import GL
+
+class DynamicBuffer(object):
+    """A GL buffer for geometry that is rewritten every frame (particles,
+    debug lines, deforming meshes) without stalling on draws that still read
+    the previous frames' data. The ring modes split the buffer into regions
+    (3 by default), write one region per frame, and fence each region after
+    the frame is drawn; a region is only rewritten once its fence has
+    passed. ORPHAN instead gives the buffer new storage every frame.
+
+    Each frame: write one or more arrays (each write returns its byte offset
+    in the buffer, for attribute pointers or draw offsets), draw, then call
+    endFrame.
+    """
+    PERSISTENT = 0
+    UNSYNCHRONIZED = 1
+    ORPHAN = 2
+    SUBDATA = 3
+    MODES = ("persistent", "unsynchronized", "orphan", "subdata")
+
+    @staticmethod
+    def getDefaultMode():
+        """PERSISTENT (a ring mapped once, GL 4.4) if the context has it,
+        otherwise UNSYNCHRONIZED (a ring mapped per write).
+        """
+        version = (GL.glGetIntegerv(GL.GL_MAJOR_VERSION), GL.glGetIntegerv(GL.GL_MINOR_VERSION))
+        if version >= (4, 4) and bool(GL.glBufferStorage):
+            return DynamicBuffer.PERSISTENT
+
+        return DynamicBuffer.UNSYNCHRONIZED
+
+    def __init__(self, capacity, target=GL.GL_ARRAY_BUFFER, regions=3, mode=None):
+        """capacity is the most bytes written in one frame. mode is one of
+        PERSISTENT, UNSYNCHRONIZED, ORPHAN, or SUBDATA (plain glBufferSubData
+        into one buffer, which waits for the GPU; for comparison), by default
+        getDefaultMode().
+        """
+        self.capacity = capacity
+        self.target = target
+        self.mode = DynamicBuffer.getDefaultMode() if mode is None else mode
+        self.regions = regions if self.mode <= DynamicBuffer.UNSYNCHRONIZED else 1
+
+        self.buffer = GL.glGenBuffers(1)
+        self.pointer = None
+        GL.glBindBuffer(target, self.buffer)
+        if self.mode == DynamicBuffer.PERSISTENT:
+            flags = GL.GL_MAP_WRITE_BIT | GL.GL_MAP_PERSISTENT_BIT | GL.GL_MAP_COHERENT_BIT
+            GL.glBufferStorage(target, capacity * self.regions, None, flags)
+            self.pointer = GL.glMapBufferRange(target, 0, capacity * self.regions, flags)
+        else:
+            GL.glBufferData(target, capacity * self.regions, None, GL.GL_STREAM_DRAW)
+        GL.glBindBuffer(target, 0)
+
+        self.fences = [None] * self.regions
+        self.region = 0
+        self.used = 0
+        self.ready = False
+
+        self.bytesWritten = 0
+        self.numStalls = 0
+        self.stallTime = 0.0
+
+    def getBaseOffset(self):
+        """Returns the byte offset in the buffer of this frame's region.
+        """
+        return self.region * self.capacity
+
+    def waitForRegion(self):
+        """Waits until the GPU is done with the frame that last used this
+        frame's region, or orphans the buffer's storage.
+        """
+        if self.mode == DynamicBuffer.ORPHAN:
+            GL.glBindBuffer(self.target, self.buffer)
+            GL.glBufferData(self.target, self.capacity, None, GL.GL_STREAM_DRAW)
+            GL.glBindBuffer(self.target, 0)
+
+        fence = self.fences[self.region]
+        if fence is not None:
+            result = GL.glClientWaitSync(fence, 0, 0)
+            if result not in (GL.GL_ALREADY_SIGNALED, GL.GL_CONDITION_SATISFIED):
+                self.numStalls += 1
+                startTime = time.perf_counter()
+                while result == GL.GL_TIMEOUT_EXPIRED:
+                    result = GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, 1000000)
+                self.stallTime += (time.perf_counter() - startTime) * 1000.0
+
+            GL.glDeleteSync(fence)
+            self.fences[self.region] = None
+
+        self.ready = True
+
+    def write(self, data, offset=None):
+        """Writes a NumPy array into this frame's region at offset (bytes
+        into the region), or after the data already written this frame.
+        Returns the byte offset of the data in the buffer.
+        """
+        data = np.ascontiguousarray(data)
+        if offset is None:
+            offset = self.used
+        if offset + data.nbytes > self.capacity:
+            raise Exception("DynamicBuffer overflow: %d bytes at %d, capacity %d" %
+                            (data.nbytes, offset, self.capacity))
+
+        if not self.ready:
+            self.waitForRegion()
+
+        start = self.getBaseOffset() + offset
+        if self.mode == DynamicBuffer.PERSISTENT:
+            ctypes.memmove(self.pointer + start, data.ctypes.data, data.nbytes)
+        elif self.mode == DynamicBuffer.UNSYNCHRONIZED:
+            GL.glBindBuffer(self.target, self.buffer)
+            pointer = GL.glMapBufferRange(self.target, start, data.nbytes,
+                GL.GL_MAP_WRITE_BIT | GL.GL_MAP_UNSYNCHRONIZED_BIT | GL.GL_MAP_INVALIDATE_RANGE_BIT)
+            ctypes.memmove(pointer, data.ctypes.data, data.nbytes)
+            GL.glUnmapBuffer(self.target)
+            GL.glBindBuffer(self.target, 0)
+        else:
+            GL.glBindBuffer(self.target, self.buffer)
+            GL.glBufferSubData(self.target, start, data.nbytes, data)
+            GL.glBindBuffer(self.target, 0)
+
+        self.used = max(self.used, offset + data.nbytes)
+        self.bytesWritten += data.nbytes
+
+        return start
+
+    def endFrame(self):
+        """Fences the region after this frame's draws and moves to the next
+        region. Call after the last draw that reads this frame's data.
+        """
+        if self.mode <= DynamicBuffer.UNSYNCHRONIZED:
+            self.fences[self.region] = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+        self.region = (self.region + 1) % self.regions
+        self.used = 0
+        self.ready = False
+
+    def cleanup(self):
+        for fence in self.fences:
+            if fence is not None:
+                GL.glDeleteSync(fence)
+        self.fences = [None] * self.regions
+
+        if self.pointer is not None:
+            GL.glBindBuffer(self.target, self.buffer)
+            GL.glUnmapBuffer(self.target)
+            GL.glBindBuffer(self.target, 0)
+            self.pointer = None
+        GL.glDeleteBuffers(1, [self.buffer])
+
+point_vsrc = b'''
+#version 400
+layout (location = 0) in vec3 VertexPosition;
+void main() { gl_Position = vec4(VertexPosition, 1.0); }
+'''
+
+point_fsrc = b'''
+#version 400
+out vec4 FragColor;
+void main() { FragColor = vec4(1.0); }
+'''
+
+def benchmark(sizes=(64 * 1024, 1024 * 1024, 4 * 1024 * 1024), frames=200, drawVertices=1024,
+              offscreen=os.environ.get("PYOPENGL_PLATFORM")):
+    """Streams sizes bytes of vertices per frame for frames frames through
+    every mode, drawing drawVertices points from each frame's data so the
+    GPU reads what was written, and prints the throughput in MB/s and the
+    time spent waiting for the GPU (stall ms). Runs offscreen when PYOPENGL_PLATFORM
+    is egl or osmesa.
+    """
+    from . import GLWindow, ShaderProgram
+
+    window = GLWindow((256, 256), offscreen=offscreen)
+    program = ShaderProgram.fromSource(point_vsrc, point_fsrc)
+    program.use()
+    vao = GL.glGenVertexArrays(1)
+    GL.glBindVertexArray(vao)
+    GL.glEnableVertexAttribArray(0)
+
+    modes = [DynamicBuffer.UNSYNCHRONIZED, DynamicBuffer.ORPHAN, DynamicBuffer.SUBDATA]
+    if DynamicBuffer.getDefaultMode() == DynamicBuffer.PERSISTENT:
+        modes.insert(0, DynamicBuffer.PERSISTENT)
+
+    print("%-15s %10s %10s %8s %10s" % ("mode", "KB/frame", "MB/s", "stalls", "stall ms"))
+    for size in sizes:
+        vertices = np.random.uniform(-1, 1, (size // 12, 3)).astype(np.float32)
+        for mode in modes:
+            buffer = DynamicBuffer(size, mode=mode)
+
+            # the first frames (one per region) are not timed
+            for frame in range(-buffer.regions, frames):
+                if frame == 0:
+                    GL.glFinish()
+                    buffer.bytesWritten = 0
+                    startTime = time.perf_counter()
+
+                vertices[0, 0] = frame % 2
+                offset = buffer.write(vertices)
+
+                GL.glBindBuffer(GL.GL_ARRAY_BUFFER, buffer.buffer)
+                GL.glVertexAttribPointer(0, 3, GL.GL_FLOAT, False, 0, ctypes.c_void_p(offset))
+                GL.glDrawArrays(GL.GL_POINTS, 0, min(drawVertices, len(vertices)))
+                buffer.endFrame()
+            GL.glFinish()
+            elapsed = time.perf_counter() - startTime
+
+            print("%-15s %10d %10.1f %8d %10.1f" % (DynamicBuffer.MODES[mode], size // 1024,
+                buffer.bytesWritten / elapsed / 2**20, buffer.numStalls, buffer.stallTime))
+            buffer.cleanup()
+
+    GL.glBindVertexArray(0)
+    GL.glDeleteVertexArrays(1, [vao])
+    program.cleanup()
+
+if __name__ == "__main__":
+    benchmark()
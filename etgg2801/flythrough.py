@@ -0,0 +1,293 @@
+import os
+import json
+import math
+import tempfile
+import numpy as np
+from OpenGL import GL
+from . import (GLWindow, GLWindowRenderDelegate, FrameProfiler, ShaderProgram,
+               Scene, Model, ModelPart, Material, OBJReader, Viper, Vector4, Matrix4,
+               InputPlayer, OcclusionCuller, createFlythrough)
+
+flythrough_vsrc = b'''
+#version 400
+
+layout (location = 0) in vec3 VertexPosition;
+layout (location = 1) in vec2 UV;
+
+out vec2 texCoord;
+uniform mat4 modelview;
+uniform mat4 projection;
+
+void main()
+{
+    texCoord = UV;
+    gl_Position = projection * modelview * vec4(VertexPosition, 1.0);
+}
+'''
+
+flythrough_fsrc = b'''
+#version 400
+
+in vec2 texCoord;
+out vec4 FragColor;
+
+uniform sampler2D sampler;
+uniform vec4 diffuseColor;
+
+void main() {
+    FragColor = texture(sampler, texCoord) * diffuseColor;
+}
+'''
+
+def createBoxModel(names, size=0.06):
+    """Returns a model with a box part of the given size for every name,
+    e.g. the links of a robot, for scenes without the robot's model file.
+    """
+    corners = [(x, y, z) for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)]
+    faces = ((0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3))
+
+    material = Material("box")
+    model = Model()
+    for name in names:
+        part = ModelPart()
+        part.setName(name)
+        part.addMaterial(material, 0)
+        part.addVertices([c * size / 2 for corner in corners for c in corner])
+        part.addUVS([0.5, 0.5])
+        for a, b, c, d in faces:
+            part.addIndices([a, b, c, a, c, d])
+            part.addUVIndices([0] * 6)
+        model.addPart(part)
+
+    return model
+
+class FlythroughDelegate(GLWindowRenderDelegate):
+    """The stress scene: a textured ground, boats in a grid along the flight
+    path (instances of one model), walls across the grid, and robots beside
+    them. With occlusion, the ground and the walls are the occluders of an
+    OcclusionCuller that every boat is tested against. With static, the
+    ground, boats, and walls are drawn as one StaticBatch instead.
+    """
+    def __init__(self, boats=16, robots=0, textures=True, occlusion=False, walls=0,
+                 static=False, modelFile="boat.obj", textureFile="boat_diffuse.png",
+                 groundTextureFile="wood.png"):
+        super().__init__()
+
+        window = GLWindow.getInstance()
+        self.program = ShaderProgram.fromSource(flythrough_vsrc, flythrough_fsrc)
+
+        GL.glClearColor(0.2, 0.2, 0.3, 1.0)
+        GL.glEnable(GL.GL_CULL_FACE)
+        GL.glEnable(GL.GL_DEPTH_TEST)
+        GL.glViewport(0, 0, window.size[0], window.size[1])
+
+        self.scene = Scene()
+        self.scene.camera.setAspect(window.size[0], window.size[1])
+        if static:
+            self.scene.enableStaticBatching()
+
+        columns = max(1, int(math.ceil(math.sqrt(boats))))
+        rows = max(1, int(math.ceil(boats / columns)))
+
+        self.ground = Model()
+        ground = ModelPart()
+        width = columns + 2
+        length = rows + 4
+        ground.addVertices([-width, 0, 2, width, 0, 2, width, 0, -length, -width, 0, -length])
+        ground.addUVS([0, 0, 1, 0, 1, 1, 0, 1])
+        ground.addIndices([0, 1, 2, 3, 0, 2])
+        ground.addUVIndices([0, 1, 2, 3, 0, 2])
+        self.ground.addPart(ground)
+        if textures:
+            self.ground.addDiffuseTexture(groundTextureFile)
+        self.ground.loadToVRAM()
+        self.ground.setStatic(static)
+        self.scene.addObject(self.ground)
+
+        self.boat = None
+        if boats:
+            self.boat = OBJReader.readFile(modelFile)
+            if textures:
+                self.boat.addDiffuseTexture(textureFile)
+            self.boat.setResidency(Model.DROP)
+            self.boat.loadToVRAM()
+            self.boat.setStatic(static)
+
+            for i in range(boats):
+                boat = self.boat.createInstance()
+                boat.setPosition(Vector4((i % columns - (columns - 1) / 2.0, 0,
+                                          -1 - i // columns, 1)))
+                self.scene.addObject(boat)
+
+        # walls evenly spaced between the rows, as tall as the boats are long
+        self.wall = None
+        occluders = [self.ground]
+        if walls:
+            self.wall = createBoxModel(["wall"], size=1.0)
+            self.wall.loadToVRAM()
+            self.wall.setStatic(static)
+            for i in range(walls):
+                wall = self.wall.createInstance()
+                wall.modelMatrix = (Matrix4.getTranslation(0, 0.5, -0.5 - (i + 1) * rows / (walls + 1.0)) *
+                                    Matrix4.getScale(columns + 1, 1.0, 0.1))
+                self.scene.addObject(wall)
+                occluders.append(wall)
+
+        self.culler = None
+        if occlusion:
+            self.culler = OcclusionCuller()
+            for o in occluders:
+                self.culler.addOccluder(o)
+            self.scene.setOcclusionCuller(self.culler)
+
+        self.robots = []
+        self.robotModel = None
+        if robots:
+            self.robotModel = createBoxModel(["L0", "L1", "L2", "L3", "L4", "L5"])
+            self.robotModel.loadToVRAM()
+            for i in range(robots):
+                robot = Viper(self.robotModel)
+                side = 1 if i % 2 else -1
+                robot.position = Vector4((side * (columns / 2.0 + 0.5), 0, -1 - i // 2 * 0.5, 1))
+                self.robots.append(robot)
+
+    def cleanup(self):
+        self.scene.cleanup()
+        if self.boat:
+            self.boat.cleanup()
+        if self.wall:
+            self.wall.cleanup()
+        if self.robotModel:
+            self.robotModel.cleanup()
+        self.program.cleanup()
+
+    def update(self, dtime):
+        self.scene.update(dtime)
+        for robot in self.robots:
+            robot.update(dtime)
+
+    def render(self, alpha=1.0):
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+
+        self.program.use()
+        self.scene.render(alpha)
+
+        view = self.scene.camera.getViewMatrix(alpha)
+        for robot in self.robots:
+            robot.render(alpha, viewMatrix=view)
+
+        GL.glUseProgram(0)
+
+def runFlythrough(inputFile=None, boats=16, robots=0, textures=True, size=(1000, 400),
+                  numTicks=1000, offscreen=os.environ.get("PYOPENGL_PLATFORM"),
+                  occlusion=False, walls=0, static=False):
+    """Flies through the stress scene replaying an input log (recorded with
+    InputRecorder, e.g. by mygame with ETGG2801_RECORD_INPUT), or a scripted
+    flythrough of numTicks ticks, with one update per frame so every run
+    draws the same frames. Returns the results: the configuration, the
+    profiler's statistics, every frame time (ms), and with occlusion the
+    OcclusionCuller's statistics.
+    """
+    scripted = inputFile is None
+    if scripted:
+        handle, inputFile = tempfile.mkstemp(suffix=".input")
+        os.close(handle)
+        createFlythrough(inputFile, numTicks)
+
+    try:
+        player = InputPlayer(inputFile)
+    finally:
+        if scripted:
+            os.remove(inputFile)
+
+    window = GLWindow(size, offscreen=offscreen)
+    window.input = player
+    window.timeStep = player.timeStep
+    window.setRenderDelegate(FlythroughDelegate(boats, robots, textures, occlusion, walls, static))
+    renderer = GL.glGetString(GL.GL_RENDERER).decode()
+
+    profiler = window.enableProfiler(capacity=max(4096, player.numTicks))
+    window.mainLoop(numFrames=player.numTicks, stepsPerFrame=1)
+
+    culler = window.renderDelegate.culler
+    return {"config": {"input": None if scripted else inputFile, "ticks": player.numTicks,
+                       "boats": boats, "robots": robots, "textures": textures,
+                       "occlusion": occlusion, "walls": walls, "static": static,
+                       "size": list(size), "renderer": renderer},
+            "stats": profiler.getStats(),
+            "frames": profiler.getSamples()[:, FrameProfiler.FRAME].tolist(),
+            "occlusion": culler.getStats() if culler else None}
+
+def printResults(results, bins=12):
+    """Prints the frame time percentiles and a histogram of the frame times.
+    """
+    config = results["config"]
+    stats = results["stats"]
+    frame = stats["frame"]
+    print("%d boats, %d robots, %d walls, textures %s, %d frames (%s)" % (config["boats"],
+        config["robots"], config.get("walls", 0), "on" if config["textures"] else "off",
+        stats["frames"], config["input"] or "scripted flythrough"))
+    print("FPS: %.1f  frame p50 %.2f  p95 %.2f  p99 %.2f  max %.2f  mean %.2f ms" %
+          (stats["fps"], frame["p50"], frame["p95"], frame["p99"], frame["max"],
+           frame["mean"]))
+    occlusion = results.get("occlusion")
+    if occlusion:
+        print("Occlusion: %.1f objects tested/frame  occluded %.1f%%  outside %.1f%%  "
+              "cpu %.2f ms/frame" % (occlusion["tested"], 100.0 * occlusion["occludedRatio"],
+              100.0 * occlusion["outsideRatio"], occlusion["cpu"]))
+
+    # the slowest 1% share the last bin, so outliers don't squash the rest
+    times = np.array(results["frames"])
+    edges = np.linspace(times.min(), np.percentile(times, 99), bins)
+    edges = np.append(edges, max(times.max(), edges[-1]) + 1e-9)
+    counts = np.histogram(times, bins=edges)[0]
+    for count, start, end in zip(counts, edges[:-1], edges[1:]):
+        bar = "#" * int(round(50.0 * count / max(counts.max(), 1)))
+        print("  %7.2f - %7.2f ms %6d %s" % (start, end, count, bar))
+
+def compareResults(before, after):
+    """Prints the frame time statistics of two runs (e.g. two branches) side
+    by side, with the change from before to after.
+    """
+    print("%-8s %10s %10s %9s" % ("frame", "before", "after", "change"))
+    for name in ("p50", "p95", "p99", "max", "mean"):
+        a = before["stats"]["frame"][name]
+        b = after["stats"]["frame"][name]
+        print("%-8s %10.2f %10.2f %+8.1f%%" % (name, a, b, 100.0 * (b - a) / max(a, 1e-9)))
+    a = before["stats"]["fps"]
+    b = after["stats"]["fps"]
+    print("%-8s %10.1f %10.1f %+8.1f%%" % ("fps", a, b, 100.0 * (b - a) / max(a, 1e-9)))
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Flythrough benchmark of a stress scene. "
+        "Run with PYOPENGL_PLATFORM=egl (or osmesa) to render offscreen.")
+    parser.add_argument("--input", help="input log to replay (default: scripted flythrough)")
+    parser.add_argument("--ticks", type=int, default=1000, help="length of the scripted flythrough")
+    parser.add_argument("--boats", type=int, default=16)
+    parser.add_argument("--robots", type=int, default=0)
+    parser.add_argument("--no-textures", action="store_true")
+    parser.add_argument("--walls", type=int, default=0, help="walls across the grid")
+    parser.add_argument("--occlusion", action="store_true", help="cull hidden objects")
+    parser.add_argument("--static", action="store_true",
+        help="draw the ground, boats, and walls as one static batch")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+        help="compare two results files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as fp:
+            before = json.load(fp)
+        with open(args.compare[1]) as fp:
+            after = json.load(fp)
+        compareResults(before, after)
+    else:
+        results = runFlythrough(args.input, args.boats, args.robots,
+            not args.no_textures, numTicks=args.ticks, occlusion=args.occlusion,
+            walls=args.walls, static=args.static)
+        printResults(results)
+        if args.json:
+            with open(args.json, "w") as fp:
+                json.dump(results, fp, indent=1, default=float)
@@ -0,0 +1,222 @@
+import os
+import time
+import zlib
+import struct
+import ctypes
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from OpenGL import GL
+
+def encodePNG(pixels, level=1):
+    """Returns a (height, width, 4) uint8 RGBA image (top row first) as PNG
+    file data. zlib releases the GIL, so several can be encoded at once.
+    """
+    height, width = pixels.shape[:2]
+    rows = np.zeros((height, width * 4 + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels.reshape(height, -1)
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(rows.tobytes(), level)) +
+            chunk(b"IEND", b""))
+
+class FrameCapture(object):
+    """Captures frames of a GLWindow (set it as the window's frameCapture)
+    without waiting for the GPU: each frame is read with glReadPixels into
+    one of a ring of pixel buffer objects, which returns right away, and is
+    mapped slots - 1 frames later, when the copy has long finished. The
+    pixels are then encoded (PNG files in directory) and/or written raw
+    (RGBA, top row first) to pipe on worker threads.
+
+    While recording (see start and stop) every frame is captured; single
+    frames can be asked for with requestScreenshot at any time.
+    """
+    def __init__(self, size, directory=None, pipe=None, slots=3, workers=2,
+                 level=1, maxQueued=8, dropFrames=True):
+        """size is the framebuffer's (the window's) size. pipe is a file
+        opened for writing in binary, or a command run with the raw frames
+        on its standard input, e.g. "ffmpeg -f rawvideo -pix_fmt rgba -s
+        1000x400 -r 60 -i - out.mp4". level is the PNG compression level.
+        When more than maxQueued frames wait for the workers, frames are
+        dropped if dropFrames (which leaves gaps in a video), otherwise the
+        main loop waits.
+        """
+        self.size = tuple(size)
+        self.frameBytes = self.size[0] * self.size[1] * 4
+        self.directory = directory
+        self.level = level
+        self.maxQueued = maxQueued
+        self.dropFrames = dropFrames
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.process = None
+        self.pipe = pipe
+        if isinstance(pipe, str):
+            self.process = subprocess.Popen(pipe, shell=True, stdin=subprocess.PIPE)
+            self.pipe = self.process.stdin
+
+        self.buffers = list(GL.glGenBuffers(slots)) if slots > 1 else [GL.glGenBuffers(1)]
+        for buffer in self.buffers:
+            GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, buffer)
+            GL.glBufferData(GL.GL_PIXEL_PACK_BUFFER, self.frameBytes, None, GL.GL_STREAM_READ)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        # per slot: (fence, frame number, screenshot file), or None when free
+        self.reads = [None] * slots
+        self.slot = 0
+
+        # encoding on a pool; pipe writes on one thread, so they stay in order
+        self.encoders = ThreadPoolExecutor(workers, thread_name_prefix="capture")
+        self.writer = ThreadPoolExecutor(1, thread_name_prefix="capture_pipe") if self.pipe else None
+        self.queued = []
+
+        self.recording = False
+        self.screenshots = []
+        self.frameNumber = 0
+
+        self.numCaptured = 0
+        self.numDropped = 0
+        self.numStalls = 0
+        self.stallTime = 0.0
+        self.captureTime = 0.0
+
+    def start(self):
+        """Captures every frame from the next one on.
+        """
+        self.recording = True
+
+    def stop(self):
+        self.recording = False
+
+    def requestScreenshot(self, file):
+        """Writes the next frame to file (PNG).
+        """
+        self.screenshots.append(file)
+
+    def captureFrame(self):
+        """Collects the read made slots frames ago, if any, and starts reading
+        the frame just drawn if it is to be captured. Called by GLWindow after
+        rendering, before the buffers are swapped.
+        """
+        startTime = time.perf_counter()
+
+        self.finishRead(self.slot)
+
+        if self.recording or self.screenshots:
+            # frames the workers could not keep up with are not even read
+            self.queued = [future for future in self.queued if not future.done()]
+            inFlight = len(self.queued) + len(self.reads) - self.reads.count(None)
+            if self.dropFrames and not self.screenshots and inFlight >= self.maxQueued:
+                self.numDropped += 1
+            else:
+                GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+                GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self.buffers[self.slot])
+                GL.glReadPixels(0, 0, self.size[0], self.size[1], GL.GL_RGBA,
+                                GL.GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+                GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+                fence = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+
+                screenshot = self.screenshots.pop(0) if self.screenshots else None
+                self.reads[self.slot] = (fence, self.frameNumber if self.recording else None,
+                                         screenshot)
+                if self.recording:
+                    self.frameNumber += 1
+
+        # the ring turns every frame, so a read is always collected slots frames on
+        self.slot = (self.slot + 1) % len(self.buffers)
+
+        self.captureTime += (time.perf_counter() - startTime) * 1000.0
+
+    def finishRead(self, slot):
+        """Maps a slot's finished read (waiting for it if needed, counted as a
+        stall), copies the pixels out, and hands them to the workers.
+        """
+        read = self.reads[slot]
+        if read is None:
+            return
+        fence, frameNumber, screenshot = read
+        self.reads[slot] = None
+
+        result = GL.glClientWaitSync(fence, 0, 0)
+        if result not in (GL.GL_ALREADY_SIGNALED, GL.GL_CONDITION_SATISFIED):
+            self.numStalls += 1
+            stallStart = time.perf_counter()
+            while result == GL.GL_TIMEOUT_EXPIRED:
+                result = GL.glClientWaitSync(fence, GL.GL_SYNC_FLUSH_COMMANDS_BIT, 1000000)
+            self.stallTime += (time.perf_counter() - stallStart) * 1000.0
+        GL.glDeleteSync(fence)
+
+        pixels = np.empty((self.size[1], self.size[0], 4), dtype=np.uint8)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, self.buffers[slot])
+        pointer = GL.glMapBufferRange(GL.GL_PIXEL_PACK_BUFFER, 0, self.frameBytes, GL.GL_MAP_READ_BIT)
+        ctypes.memmove(pixels.ctypes.data, pointer, self.frameBytes)
+        GL.glUnmapBuffer(GL.GL_PIXEL_PACK_BUFFER)
+        GL.glBindBuffer(GL.GL_PIXEL_PACK_BUFFER, 0)
+
+        # if the workers fall behind, wait for the oldest rather than queue more
+        while len(self.queued) >= self.maxQueued:
+            self.queued.pop(0).result()
+
+        if screenshot:
+            self.queued.append(self.encoders.submit(self.writePNG, pixels, screenshot))
+        if frameNumber is not None:
+            if self.directory:
+                file = os.path.join(self.directory, "frame_%06d.png" % frameNumber)
+                self.queued.append(self.encoders.submit(self.writePNG, pixels, file))
+            if self.writer:
+                self.queued.append(self.writer.submit(self.writeRaw, pixels))
+            self.numCaptured += 1
+
+    def writePNG(self, pixels, file):
+        with open(file, "wb") as fp:
+            fp.write(encodePNG(pixels[::-1], self.level))
+
+    def writeRaw(self, pixels):
+        self.pipe.write(np.ascontiguousarray(pixels[::-1]).data)
+
+    def flush(self):
+        """Collects every read in flight and waits for the workers.
+        """
+        for i in range(len(self.buffers)):
+            self.finishRead((self.slot + i) % len(self.buffers))
+        for future in self.queued:
+            future.result()
+        self.queued = []
+
+    def getStats(self):
+        """Returns the frames captured and dropped, the reads that had to wait
+        for the GPU and the time (ms) spent waiting, and the average time
+        (ms) captureFrame took on the main loop.
+        """
+        calls = max(self.numCaptured + self.numDropped, 1)
+        return {"captured": self.numCaptured, "dropped": self.numDropped,
+                "stalls": self.numStalls, "stallTime": self.stallTime,
+                "frameTime": self.captureTime / calls}
+
+    def printSummary(self):
+        stats = self.getStats()
+        print("Captured %d frames  dropped %d  stalls %d (%.1f ms)  %.2f ms/frame on the main loop" %
+              (stats["captured"], stats["dropped"], stats["stalls"], stats["stallTime"],
+               stats["frameTime"]))
+
+    def close(self):
+        """Writes out everything in flight, stops the workers, closes the
+        pipe (waiting for its command to finish), and deletes the buffers.
+        Must be called on the GL thread.
+        """
+        self.flush()
+        self.encoders.shutdown()
+        if self.writer:
+            self.writer.shutdown()
+            self.pipe.close()
+        if self.process:
+            self.process.wait()
+
+        GL.glDeleteBuffers(len(self.buffers), self.buffers)
+        self.buffers = []
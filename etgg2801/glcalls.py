@@ -0,0 +1,308 @@
+import os
+import sys
+import json
+import time
+import ctypes
+import subprocess
+import OpenGL
+
+def configureProduction():
+    """Configures PyOpenGL for the least per call overhead: no glGetError
+    after every call, no error logging, no context or array size checks.
+    Must run before OpenGL.GL is imported; setting ETGG2801_PRODUCTION=1
+    does this when etgg2801 is imported.
+    """
+    if "OpenGL.GL" in sys.modules:
+        raise Exception("configureProduction must be called before OpenGL.GL is imported!")
+
+    flags = {"ERROR_CHECKING": False, "ERROR_LOGGING": False,
+             "CONTEXT_CHECKING": False, "ARRAY_SIZE_CHECKING": False}
+
+    # PyOpenGL's EGL bindings fail to import with error checking disabled.
+    # Importing them copies the flags into OpenGL._configflags, which is
+    # what the GL functions read when they are built, so set them there too.
+    if os.environ.get("PYOPENGL_PLATFORM") == "egl":
+        import OpenGL.EGL
+
+    for name, value in flags.items():
+        setattr(OpenGL, name, value)
+        if "OpenGL._configflags" in sys.modules:
+            setattr(sys.modules["OpenGL._configflags"], name, value)
+
+def isProduction():
+    return not OpenGL.ERROR_CHECKING
+
+def getByteSize(data):
+    """Returns the size in bytes of an array passed to GL (ctypes, NumPy, or
+    bytes), or of a size argument.
+    """
+    if isinstance(data, int):
+        return data
+    if hasattr(data, "nbytes"):
+        return data.nbytes
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    try:
+        return ctypes.sizeof(data)
+    except TypeError:
+        return 0
+
+def getBufferDataBytes(args):
+    # glBufferData(target, data, usage) or (target, size, data, usage);
+    # allocating storage (data None) uploads nothing
+    if len(args) == 4:
+        return getByteSize(args[1]) if args[2] is not None else 0
+    return getByteSize(args[1]) if len(args) == 3 else 0
+
+def getBufferSubDataBytes(args):
+    # glBufferSubData(target, offset, data) or (target, offset, size, data)
+    return getByteSize(args[2]) if len(args) >= 3 else 0
+
+def getComponents(imgFormat):
+    from OpenGL import GL
+    return {GL.GL_RGBA: 4, GL.GL_BGRA: 4, GL.GL_RGB: 3, GL.GL_BGR: 3,
+            GL.GL_RG: 2}.get(imgFormat, 1)
+
+def getTextureBytes(args):
+    # glTexImage2D(target, level, internalFormat, width, height, border, format, type, pixels);
+    # allocating storage (pixels None) uploads nothing
+    if len(args) < 9 or args[8] is None:
+        return 0
+
+    return int(args[3]) * int(args[4]) * getComponents(args[6])
+
+def getTexSubImageBytes(args):
+    # glTexSubImage2D(target, level, xoffset, yoffset, width, height, format, type, pixels)
+    if len(args) < 9:
+        return 0
+
+    return int(args[4]) * int(args[5]) * getComponents(args[6])
+
+class GLCallCounter(object):
+    """Counts GL calls made through the OpenGL.GL module while installed, by
+    category: draw calls, binds (including glUseProgram), other state
+    changes, uniform uploads, bytes uploaded to buffers and textures, and
+    the total number of calls. Code that calls GL.<function> (as this
+    package does) is counted; nothing is wrapped until install is called.
+    """
+    DRAWS = 0
+    BINDS = 1
+    STATE = 2
+    UNIFORMS = 3
+    BUFFER_BYTES = 4
+    TEXTURE_BYTES = 5
+    CALLS = 6
+    COLUMNS = ("draws", "binds", "state", "uniforms", "buffer_bytes",
+               "texture_bytes", "gl_calls")
+
+    STATE_PREFIXES = ("glEnable", "glDisable", "glBlend", "glDepth", "glCull",
+                      "glActiveTexture", "glViewport", "glPixelStore",
+                      "glTexParameter", "glClearColor", "glPolygonMode",
+                      "glVertexAttribPointer", "glEnableVertexAttribArray",
+                      "glDisableVertexAttribArray")
+
+    def __init__(self):
+        self.counts = [0] * len(GLCallCounter.COLUMNS)
+        self.originals = {}
+
+    def getCategory(self, name):
+        if name.startswith("glDraw") or name.startswith("glMultiDraw"):
+            return GLCallCounter.DRAWS
+        if name.startswith("glBind") or name == "glUseProgram":
+            return GLCallCounter.BINDS
+        if name.startswith("glUniform") or name.startswith("glProgramUniform"):
+            return GLCallCounter.UNIFORMS
+        if name.startswith(GLCallCounter.STATE_PREFIXES):
+            return GLCallCounter.STATE
+
+        return None
+
+    def wrap(self, func, category, sizeOf, byteColumn):
+        counts = self.counts
+        calls = GLCallCounter.CALLS
+
+        def counted(*args, **kwargs):
+            counts[calls] += 1
+            if category is not None:
+                counts[category] += 1
+            if sizeOf is not None:
+                counts[byteColumn] += sizeOf(args)
+            return func(*args, **kwargs)
+        counted.__wrapped__ = func
+
+        return counted
+
+    def install(self):
+        if self.originals:
+            return
+
+        from OpenGL import GL
+        for name in dir(GL):
+            if not (name.startswith("gl") and name[2:3].isupper()):
+                continue
+            func = getattr(GL, name)
+            if not callable(func):
+                continue
+
+            sizeOf, byteColumn = None, None
+            if name == "glBufferData":
+                sizeOf, byteColumn = getBufferDataBytes, GLCallCounter.BUFFER_BYTES
+            elif name == "glBufferSubData":
+                sizeOf, byteColumn = getBufferSubDataBytes, GLCallCounter.BUFFER_BYTES
+            elif name == "glTexImage2D":
+                sizeOf, byteColumn = getTextureBytes, GLCallCounter.TEXTURE_BYTES
+            elif name == "glTexSubImage2D":
+                sizeOf, byteColumn = getTexSubImageBytes, GLCallCounter.TEXTURE_BYTES
+
+            self.originals[name] = func
+            setattr(GL, name, self.wrap(func, self.getCategory(name), sizeOf, byteColumn))
+
+    def uninstall(self):
+        from OpenGL import GL
+        for name, func in self.originals.items():
+            setattr(GL, name, func)
+        self.originals = {}
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+
+    def getCounts(self):
+        return dict(zip(GLCallCounter.COLUMNS, self.counts))
+
+def getBarePointer(func, argTypes):
+    """Returns a plain ctypes function pointer to the driver entry point
+    behind a PyOpenGL function, taking argTypes: the same call with none
+    of PyOpenGL's argument conversion or error checking.
+    """
+    func = getattr(func, "__wrapped__", func)
+    while hasattr(func, "wrappedOperation"):
+        func = func.wrappedOperation
+    if not func.resolved:
+        func.load()
+    pointer = type(func).__call__.__self__
+    address = ctypes.cast(pointer, ctypes.c_void_p).value
+
+    return ctypes.CFUNCTYPE(None, *argTypes)(address)
+
+def timeCall(call, calls, repeats):
+    """Returns the fastest of repeats timings of call, in microseconds per
+    call.
+    """
+    best = None
+    for r in range(repeats):
+        startTime = time.perf_counter()
+        for i in range(calls):
+            call()
+        elapsed = (time.perf_counter() - startTime) * 1e6 / calls
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+def runCalls(calls, repeats=5):
+    """Times common per-frame calls in the current GL context, returning
+    {name: (microseconds per call through PyOpenGL, through a bare ctypes
+    pointer)}.
+    """
+    from OpenGL import GL
+    from . import Matrix4
+
+    vao = GL.glGenVertexArrays(1)
+    texture = GL.glGenTextures(1)
+    matrix = Matrix4().getCType()
+
+    # uniforms need a program in use
+    program = GL.glCreateProgram()
+    shaders = ((GL.GL_VERTEX_SHADER, b"#version 400\nuniform mat4 m;\nuniform int i;\n"
+                b"void main() { gl_Position = m * vec4(i); }\n"),
+               (GL.GL_FRAGMENT_SHADER, b"#version 400\nout vec4 c;\n"
+                b"void main() { c = vec4(1.0); }\n"))
+    for shaderType, source in shaders:
+        shader = GL.glCreateShader(shaderType)
+        GL.glShaderSource(shader, source)
+        GL.glCompileShader(shader)
+        GL.glAttachShader(program, shader)
+    GL.glLinkProgram(program)
+    GL.glUseProgram(program)
+    matrix_loc = GL.glGetUniformLocation(program, b"m")
+    int_loc = GL.glGetUniformLocation(program, b"i")
+
+    # (name, call through PyOpenGL, bare argument types, bare arguments)
+    c_int, c_uint = ctypes.c_int, ctypes.c_uint
+    tests = (("glUniformMatrix4fv", lambda: GL.glUniformMatrix4fv(matrix_loc, 1, False, matrix),
+              (c_int, c_int, ctypes.c_ubyte, ctypes.c_void_p),
+              (matrix_loc, 1, 0, ctypes.addressof(matrix))),
+             ("glUniform1i", lambda: GL.glUniform1i(int_loc, 0), (c_int, c_int), (int_loc, 0)),
+             ("glBindVertexArray", lambda: GL.glBindVertexArray(vao), (c_uint,), (int(vao),)),
+             ("glBindTexture", lambda: GL.glBindTexture(GL.GL_TEXTURE_2D, texture),
+              (c_uint, c_uint), (int(GL.GL_TEXTURE_2D), int(texture))),
+             ("glEnable", lambda: GL.glEnable(GL.GL_DEPTH_TEST), (c_uint,),
+              (int(GL.GL_DEPTH_TEST),)))
+
+    results = {}
+    for name, call, argTypes, args in tests:
+        call()
+        bare = getBarePointer(getattr(GL, name), argTypes)
+        results[name] = (timeCall(call, calls, repeats),
+                         timeCall(lambda: bare(*args), calls, repeats))
+
+    GL.glBindVertexArray(0)
+    GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+    GL.glUseProgram(0)
+    GL.glFinish()
+
+    return results
+
+def benchmark(calls=20000, rounds=5, offscreen="egl"):
+    """Compares the cost per call of PyOpenGL's default configuration, the
+    production configuration, and the default configuration with call
+    accounting installed, using an offscreen (software) context. Each mode
+    runs in a fresh process, rounds times, interleaved with the others so
+    drift affects them alike, and the median is reported. "bare" is the
+    same call through a plain ctypes pointer to the driver, so the time
+    PyOpenGL adds is the difference, and "saved" is how much of it the
+    production mode removes.
+    """
+    modes = (("default", {}),
+             ("production", {"ETGG2801_PRODUCTION": "1"}),
+             ("accounting", {"ETGG2801_GLCALLS_ACCOUNTING": "1"}))
+
+    runs = {mode: [] for mode, env in modes}
+    for r in range(rounds):
+        # a different mode goes first each round
+        for mode, env in modes[r % len(modes):] + modes[:r % len(modes)]:
+            childEnv = dict(os.environ, PYOPENGL_PLATFORM=offscreen, **env)
+            output = subprocess.check_output([sys.executable, "-m", "etgg2801.glcalls",
+                "--child", str(calls), offscreen], env=childEnv)
+            runs[mode].append(json.loads(output.decode().strip().splitlines()[-1]))
+
+    def median(values):
+        values = sorted(values)
+        return values[len(values) // 2]
+
+    print("us/call (median of %d runs)  bare  default  production  accounting  saved" % rounds)
+    for name in runs["default"][0]:
+        bare = median([run[name][1] for mode in runs for run in runs[mode]])
+        default, production, accounting = (median([run[name][0] for run in runs[mode]])
+            for mode, env in modes)
+        overhead = max(default - bare, 1e-9)
+        print("%-28s %5.2f  %7.2f  %10.2f  %10.2f  %5.2f us (%.0f%% of the wrapper cost)" %
+              (name, bare, default, production, accounting, default - production,
+               100.0 * (default - production) / overhead))
+
+def runChild(calls, offscreen):
+    from . import GLWindow
+
+    window = GLWindow((64, 64), offscreen=offscreen)
+    counter = None
+    if os.environ.get("ETGG2801_GLCALLS_ACCOUNTING"):
+        counter = GLCallCounter()
+        counter.install()
+
+    print(json.dumps(runCalls(calls)))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        runChild(int(sys.argv[2]), sys.argv[3])
+    else:
+        benchmark()
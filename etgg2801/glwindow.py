@@ -2,16 +2,24 @@
 # BY: Andrew Holbrook
 # DATE: 9/24/2015
 
+import os
+import time
+import threading
 import sdl2
 from sdl2 import sdlimage
 from ctypes import byref, c_int
 from OpenGL import GL
+from . import FrameProfiler, StackSampler, SnapshotBuffer, InputState, FrameCapture
 
 class GLWindow(object):
     """A window for use with OpenGL.
     """
     instance = None
     
+    VSYNC_OFF = 0
+    VSYNC_ON = 1
+    VSYNC_ADAPTIVE = -1
+    
     @staticmethod
     def getInstance():
         if not GLWindow.instance:
@@ -19,75 +27,486 @@ class GLWindow(object):
         
         return GLWindow.instance
     
-    def __init__(self, size=(600, 600), major=4, minor=0, fullscreen=False):
+    def __init__(self, size=(600, 600), major=4, minor=0, fullscreen=False, offscreen=None):
+        """Creates the window and its OpenGL context. If offscreen is 'egl' or
+        'osmesa', no window is opened: the context is created headless with
+        that API (Mesa's software rasterizer on machines without a GPU) and
+        rendering goes to a framebuffer object of the given size. The
+        PYOPENGL_PLATFORM environment variable must be set to the same value
+        before OpenGL is first imported.
+        """
         if GLWindow.instance:
             raise Exception("Window already created!")
         
         self.size = tuple(size)
         self.major = major
         self.minor = minor
+        self.offscreen = offscreen
+        self.window = None
+        self.glcontext = None
+        self.framebuffer = None
         
-        self.printFPS = False
-        self.periodTime = 0
-        self.fpsPeriod = 1000
-        self.fpsDelay = self.fpsPeriod
-        self.numFrames = 0
+        self.profiler = None
         self.timeStep = 10
         
-        self.__buildWindow()
+        # {SDL event type: handlers}, each called with every event of its type
+        # polled by mainLoop (see addEventHandler); mainLoop stops once
+        # running is cleared
+        self.eventHandlers = {}
+        self.running = False
+        self.addEventHandler(sdl2.SDL_QUIT, self.onQuit)
+        self.addEventHandler(sdl2.SDL_KEYDOWN, self.onKeyDown)
+        
+        # the StackSampler of a capture in progress (see startCapture); the
+        # capture key starts one of captureFrames frames
+        self.capture = None
+        self.captureFile = None
+        self.captureKey = sdl2.SDL_SCANCODE_F9
+        self.captureFrames = 60
+        
+        # a FrameCapture reading frames back for screenshots and recordings
+        # (see startFrameCapture and takeScreenshot), run before every swap
+        self.frameCapture = None
+        self.screenshotKey = sdl2.SDL_SCANCODE_F12
+        
+        # at most this many updates per frame (0 for no limit); time dropped
+        # because of the limit is added to droppedTime (ms)
+        self.maxStepsPerFrame = 10
+        self.droppedTime = 0.0
+        
+        # when True, render is called with the fraction (alpha) of a time step
+        # elapsed since the last update, to blend the previous and current state
+        self.interpolation = False
+        
+        # frames per second to limit the loop to (0 for no limit)
+        self.targetFPS = 0
         
-        if fullscreen:
+        # when True, mainLoop runs the updates on a separate thread, which
+        # hands snapshots of its state to the render loop through a
+        # SnapshotBuffer of snapshotSlots slots (see GLWindowRenderDelegate)
+        self.threaded = False
+        self.snapshotSlots = 3
+        self.snapshots = None
+        self.updateThread = None
+        self.updateError = None
+        self.updating = False
+        self.updateLock = threading.Lock()
+        self.updateStats = [0, 0.0, 0.0]
+        
+        if offscreen:
+            self.__buildOffscreen()
+        else:
+            self.__buildWindow()
+        
+        if fullscreen and not offscreen:
             sdl2.SDL_SetWindowFullscreen(self.window, sdl2.SDL_WINDOW_FULLSCREEN)
         
+        # an AssetStreamer whose GL uploads run every frame, before rendering
+        self.streamer = None
+        
+        # keyboard and mouse state for the updates, gathered from the events
+        self.input = InputState(self)
+        
         GLWindow.instance = self
     
     def setRenderDelegate(self, renderDelegate):
         self.renderDelegate = renderDelegate
     
-    def mainLoop(self):
+    def addEventHandler(self, eventType, handler):
+        """Calls handler with every SDL event of eventType (e.g.
+        sdl2.SDL_KEYDOWN) mainLoop polls, on the thread running it. The event
+        is reused for the next one, so handlers copy out what they keep.
+        """
+        self.eventHandlers[eventType] = self.eventHandlers.get(eventType, ()) + (handler,)
+    
+    def removeEventHandler(self, eventType, handler):
+        handlers = list(self.eventHandlers.get(eventType, ()))
+        if handler in handlers:
+            handlers.remove(handler)
+            self.eventHandlers[eventType] = tuple(handlers)
+    
+    def onQuit(self, event):
+        self.running = False
+    
+    def onKeyDown(self, event):
+        if event.key.repeat:
+            return
+        
+        if event.key.keysym.scancode == self.captureKey:
+            self.startCapture()
+        elif event.key.keysym.scancode == self.screenshotKey:
+            self.takeScreenshot()
+    
+    def enableProfiler(self, capacity=4096, printPeriod=0, glAccounting=False):
+        """Starts recording frame phase times in a FrameProfiler, which is
+        returned. printPeriod (ms) prints a summary periodically, and
+        glAccounting also records GL call counts per frame.
+        """
+        self.disableProfiler()
+        self.profiler = FrameProfiler(capacity, printPeriod, glAccounting)
+        
+        return self.profiler
+    
+    def disableProfiler(self):
+        if self.profiler:
+            self.profiler.close()
+        self.profiler = None
+    
+    def startCapture(self, numFrames=None, file=None, interval=1.0):
+        """Samples the main loop's stack every interval ms for numFrames
+        frames (by default captureFrames), then writes the samples to file
+        (a speedscope .json profile, or collapsed stacks otherwise; by
+        default capture-<date>-<time>.json) and prints a summary. Must be
+        called from the thread running mainLoop. Returns the StackSampler.
+        """
+        if self.capture:
+            return self.capture
+        
+        self.captureFile = file or time.strftime("capture-%Y%m%d-%H%M%S.json")
+        self.capture = StackSampler(interval)
+        self.capture.start(numFrames or self.captureFrames)
+        
+        return self.capture
+    
+    def finishCapture(self):
+        """Stops the capture in progress, if any, and writes it out.
+        """
+        capture = self.capture
+        if not capture:
+            return
+        
+        self.capture = None
+        capture.stop()
+        capture.write(self.captureFile)
+        print("Capture written to", self.captureFile)
+        capture.printSummary()
+    
+    def startFrameCapture(self, directory=None, pipe=None, **kwargs):
+        """Records every frame from the next one on, as PNG files in directory
+        and/or raw RGBA frames written to pipe (a binary file, or a command
+        such as an encoder reading them from its standard input), until
+        stopFrameCapture. The other arguments are FrameCapture's. Must be
+        called with the context current. Returns the FrameCapture.
+        """
+        self.stopFrameCapture()
+        self.frameCapture = FrameCapture(self.size, directory, pipe, **kwargs)
+        self.frameCapture.start()
+        
+        return self.frameCapture
+    
+    def stopFrameCapture(self):
+        """Writes out the frames still in flight and stops recording.
+        """
+        frameCapture = self.frameCapture
+        if not frameCapture:
+            return
+        
+        self.frameCapture = None
+        frameCapture.close()
+        if frameCapture.numCaptured:
+            frameCapture.printSummary()
+    
+    def takeScreenshot(self, file=None):
+        """Writes the next frame to file (PNG; by default
+        screenshot-<date>-<time>.png) without stalling the frame.
+        """
+        if not self.frameCapture:
+            self.frameCapture = FrameCapture(self.size, workers=1)
+        
+        file = file or time.strftime("screenshot-%Y%m%d-%H%M%S.png")
+        self.frameCapture.requestScreenshot(file)
+        print("Screenshot written to", file)
+    
+    def mainLoop(self, numFrames=None, stepsPerFrame=None):
+        """Runs the application until it is closed, or for numFrames frames if
+        given. Updates are run with a fixed time step (timeStep ms), timed
+        with SDL's performance counter; at most maxStepsPerFrame updates are
+        run per frame, and time that could not be caught up on is dropped.
+        With stepsPerFrame, every frame runs exactly that many updates
+        instead of following the elapsed time, which makes runs repeatable.
+        When threaded is set, the updates run in real time on their own
+        thread instead (stepsPerFrame is ignored) and every frame draws the
+        newest snapshot of their state. Returns the average frames per second.
+        """
         if not hasattr(self, "renderDelegate"):
             raise Exception("GLWindow's render delegate not set!")
         
-        dtime = 0
+        toMS = 1000.0 / sdl2.SDL_GetPerformanceFrequency()
+        
+        threaded = self.threaded
+        if threaded:
+            self.startUpdateThread()
+        
+        dtime = 0.0
+        alpha = 1.0
+        inputTime = 0
         event = sdl2.SDL_Event()
-        running = True
-        startTime = sdl2.SDL_GetTicks()
-        while running:
-            stopTime = sdl2.SDL_GetTicks()
-            dtime += stopTime - startTime
-            startTime = stopTime
-            
-            if self.printFPS:
-                self.periodTime += dtime
-                self.fpsDelay -= dtime
-                self.numFrames += 1
-                if self.fpsDelay <= 0:
-                    self.fpsDelay = self.fpsPeriod
-                    print("FPS:", (self.numFrames / (self.periodTime / 1000.0)))
-                    self.numFrames = 0
-                    self.periodTime = 0
+        handlers = self.eventHandlers
+        self.running = True
+        frameCount = 0
+        startTime = sdl2.SDL_GetPerformanceCounter()
+        runStartTime = startTime
+        try:
+            while self.running:
+                frameStartTime = sdl2.SDL_GetPerformanceCounter()
+                
+                # a disabled profiler (or capture) costs one check per phase
+                profiler = self.profiler
+                if profiler:
+                    profiler.beginFrame()
+                capture = self.capture
+                if capture:
+                    capture.phase = "events"
+                
+                dtime += (frameStartTime - startTime) * toMS
+                startTime = frameStartTime
+                
+                while sdl2.SDL_PollEvent(byref(event)) != 0:
+                    for handler in handlers.get(event.type, ()):
+                        handler(event)
+                
+                self.input.sample()
+                if profiler:
+                    profiler.endPhase(FrameProfiler.EVENTS)
                 
-            
-            while sdl2.SDL_PollEvent(byref(event)) != 0:
-                if event.type == sdl2.SDL_QUIT:
-                    running = False
+                if self.streamer:
+                    if capture:
+                        capture.phase = "stream"
+                    self.streamer.uploadFrame()
+                    if profiler:
+                        profiler.endPhase(FrameProfiler.STREAM)
+                
+                if threaded:
+                    if self.updateError:
+                        raise self.updateError
+                    
+                    snapshot = self.snapshots.acquire()
+                    inputTime = snapshot.inputTime
+                    if self.interpolation:
+                        # how far the frame is into the step after the snapshot
+                        age = (sdl2.SDL_GetPerformanceCounter() - snapshot.publishTime) * toMS
+                        alpha = min(1.0, age / self.timeStep)
+                    if profiler:
+                        profiler.addUpdates(*self.takeUpdateStats())
+                    
+                    if capture:
+                        capture.phase = "render"
+                    self.renderDelegate.renderSnapshot(snapshot, alpha)
                 else:
-                    pass
-                    # self.renderDelegate.addEvent(event)
-            
-            while dtime >= self.timeStep:
-                dtime -= self.timeStep
-                self.renderDelegate.update(self.timeStep)
-            self.renderDelegate.render()
-            
-            sdl2.SDL_GL_SwapWindow(self.window)
-            
+                    if stepsPerFrame:
+                        dtime = self.timeStep * stepsPerFrame
+                    if capture:
+                        capture.phase = "update"
+                    
+                    steps = 0
+                    while dtime >= self.timeStep:
+                        if self.maxStepsPerFrame and steps == self.maxStepsPerFrame and not stepsPerFrame:
+                            # too far behind (a hitch, or updates slower than real
+                            # time): skip ahead instead of spiralling
+                            self.droppedTime += dtime - dtime % self.timeStep
+                            dtime %= self.timeStep
+                            break
+                        
+                        dtime -= self.timeStep
+                        self.renderDelegate.update(self.timeStep)
+                        steps += 1
+                        if profiler:
+                            profiler.endStep()
+                    
+                    if steps:
+                        inputTime = self.input.takenTime
+                    
+                    if capture:
+                        capture.phase = "render"
+                    if self.interpolation:
+                        # how far the frame is between the last two update steps
+                        self.renderDelegate.render(dtime / self.timeStep if not stepsPerFrame else 1.0)
+                    else:
+                        self.renderDelegate.render()
+                if profiler:
+                    profiler.endPhase(FrameProfiler.RENDER)
+                
+                if self.frameCapture:
+                    if capture:
+                        capture.phase = "capture"
+                    self.frameCapture.captureFrame()
+                    if profiler:
+                        profiler.endPhase(FrameProfiler.CAPTURE)
+                
+                if capture:
+                    capture.phase = "swap"
+                self.swapBuffers()
+                if profiler:
+                    profiler.endPhase(FrameProfiler.SWAP)
+                    if inputTime:
+                        # from the input behind the drawn state (its oldest event, or the
+                        # end of its frame's events) to presenting it
+                        profiler.setValue(FrameProfiler.LATENCY,
+                            (sdl2.SDL_GetPerformanceCounter() - inputTime) * toMS)
+                
+                if self.targetFPS:
+                    if capture:
+                        capture.phase = "wait"
+                    self.waitForFrame(frameStartTime, toMS)
+                if profiler:
+                    profiler.endFrame()
+                if capture and capture.endFrame():
+                    self.finishCapture()
+                
+                frameCount += 1
+                if numFrames and frameCount >= numFrames:
+                    self.running = False
+        finally:
+            if threaded:
+                self.stopUpdateThread()
+            self.finishCapture()
+        
+        runTime = max(1e-3, (sdl2.SDL_GetPerformanceCounter() - runStartTime) * toMS)
         self.cleanup()
+        
+        return frameCount / (runTime / 1000.0)
+    
+    def startUpdateThread(self):
+        """Allocates the snapshot buffer, publishes the state before the first
+        update, and starts the update thread.
+        """
+        self.snapshots = SnapshotBuffer(self.renderDelegate.createSnapshot, self.snapshotSlots)
+        self.updateStats = [0, 0.0, 0.0]
+        self.updateError = None
+        self.publishSnapshot()
+        
+        self.updating = True
+        self.updateThread = threading.Thread(target=self.updateLoop, name="update")
+        self.updateThread.daemon = True
+        self.updateThread.start()
+    
+    def stopUpdateThread(self):
+        self.updating = False
+        if self.updateThread:
+            self.updateThread.join()
+        self.updateThread = None
+    
+    def updateLoop(self):
+        """Runs fixed step updates in real time until stopUpdateThread is
+        called, publishing a snapshot after every batch of steps. This is the
+        body of the update thread.
+        """
+        toMS = 1000.0 / sdl2.SDL_GetPerformanceFrequency()
+        
+        dtime = 0.0
+        startTime = sdl2.SDL_GetPerformanceCounter()
+        try:
+            while self.updating:
+                now = sdl2.SDL_GetPerformanceCounter()
+                dtime += (now - startTime) * toMS
+                startTime = now
+                
+                steps = 0
+                while dtime >= self.timeStep:
+                    if self.maxStepsPerFrame and steps == self.maxStepsPerFrame:
+                        self.droppedTime += dtime - dtime % self.timeStep
+                        dtime %= self.timeStep
+                        break
+                    
+                    dtime -= self.timeStep
+                    stepStartTime = sdl2.SDL_GetPerformanceCounter()
+                    self.renderDelegate.update(self.timeStep)
+                    elapsed = (sdl2.SDL_GetPerformanceCounter() - stepStartTime) * toMS
+                    steps += 1
+                    
+                    with self.updateLock:
+                        stats = self.updateStats
+                        stats[0] += 1
+                        stats[1] += elapsed
+                        stats[2] = max(stats[2], elapsed)
+                
+                if steps:
+                    self.publishSnapshot()
+                else:
+                    # wait for the next step, giving the render thread the GIL
+                    remaining = self.timeStep - dtime
+                    sdl2.SDL_Delay(int(remaining - 1.0) if remaining > 2.0 else 0)
+        except Exception as e:
+            self.updateError = e
+    
+    def publishSnapshot(self):
+        """Copies the render delegate's state into a free snapshot slot and
+        publishes it. Returns False if no slot was free.
+        """
+        slot = self.snapshots.getBackSlot()
+        if slot is None:
+            return False
+        
+        self.renderDelegate.writeSnapshot(slot)
+        slot.inputTime = self.input.takenTime
+        self.snapshots.publish(slot)
+        
+        return True
+    
+    def takeUpdateStats(self):
+        """Returns (steps, total ms, longest step ms) of the updates run on
+        the update thread since the last call.
+        """
+        with self.updateLock:
+            stats = self.updateStats
+            self.updateStats = [0, 0.0, 0.0]
+        
+        return stats
+    
+    def waitForFrame(self, frameStartTime, toMS):
+        """Sleeps (then spins for the last ms) until 1 / targetFPS seconds have
+        passed since the frame started.
+        """
+        frameTime = 1000.0 / self.targetFPS
+        remaining = frameTime - (sdl2.SDL_GetPerformanceCounter() - frameStartTime) * toMS
+        if remaining > 2.0:
+            sdl2.SDL_Delay(int(remaining - 1.0))
+        
+        while (sdl2.SDL_GetPerformanceCounter() - frameStartTime) * toMS < frameTime:
+            pass
+    
+    def setSwapInterval(self, interval):
+        """Sets the frame pacing of buffer swaps: VSYNC_OFF, VSYNC_ON, or
+        VSYNC_ADAPTIVE (late frames are not held for the next vertical blank;
+        falls back to VSYNC_ON when not supported). Returns the interval set.
+        """
+        if self.offscreen:
+            return GLWindow.VSYNC_OFF
+        
+        if sdl2.SDL_GL_SetSwapInterval(interval) != 0:
+            if interval != GLWindow.VSYNC_ADAPTIVE:
+                raise Exception(sdl2.SDL_GetError())
+            interval = GLWindow.VSYNC_ON
+            sdl2.SDL_GL_SetSwapInterval(interval)
+        
+        return interval
+    
+    def swapBuffers(self):
+        """Presents the frame. Offscreen, this waits for rendering to finish so
+        frame times include the work done by the (software) renderer.
+        """
+        if self.offscreen:
+            GL.glFinish()
+        else:
+            sdl2.SDL_GL_SwapWindow(self.window)
+    
+    def readPixels(self):
+        """Returns the RGBA contents of the current frame as bytes (bottom row
+        first).
+        """
+        return GL.glReadPixels(0, 0, self.size[0], self.size[1], GL.GL_RGBA,
+            GL.GL_UNSIGNED_BYTE)
     
     def cleanup(self):
+        self.stopFrameCapture()
+        if self.streamer:
+            self.streamer.close()
         self.renderDelegate.cleanup()
-        sdl2.SDL_GL_DeleteContext(self.glcontext)
-        sdl2.SDL_DestroyWindow(self.window)
+        if self.offscreen:
+            self.__destroyOffscreen()
+        else:
+            sdl2.SDL_GL_DeleteContext(self.glcontext)
+            sdl2.SDL_DestroyWindow(self.window)
         sdlimage.IMG_Quit()
         sdl2.SDL_Quit()
     
@@ -113,6 +532,117 @@ class GLWindow(object):
         
         # keep application from receiving text input events
         sdl2.SDL_StopTextInput()
+    
+    def __buildOffscreen(self):
+        if os.environ.get("PYOPENGL_PLATFORM") != self.offscreen:
+            raise Exception("PYOPENGL_PLATFORM must be set to '%s' before "
+                "OpenGL is imported!" % self.offscreen)
+        
+        # timers, events, and image loading are still provided by SDL
+        if sdl2.SDL_Init(sdl2.SDL_INIT_TIMER | sdl2.SDL_INIT_EVENTS) != 0:
+            raise Exception(sdl2.SDL_GetError())
+        
+        sdlimage.IMG_Init(sdlimage.IMG_INIT_PNG | sdlimage.IMG_INIT_JPG)
+        
+        if self.offscreen == "egl":
+            self.__createEGLContext()
+        elif self.offscreen == "osmesa":
+            self.__createOSMesaContext()
+        else:
+            raise Exception("Unknown offscreen backend: " + str(self.offscreen))
+        
+        # color and depth renderbuffers the size of the "window"
+        self.framebuffer = GL.glGenFramebuffers(1)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.framebuffer)
+        
+        self.colorBuffer = GL.glGenRenderbuffers(1)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, self.colorBuffer)
+        GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_RGBA8, self.size[0], self.size[1])
+        GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, GL.GL_COLOR_ATTACHMENT0,
+            GL.GL_RENDERBUFFER, self.colorBuffer)
+        
+        self.depthBuffer = GL.glGenRenderbuffers(1)
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, self.depthBuffer)
+        GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, GL.GL_DEPTH_COMPONENT24, self.size[0], self.size[1])
+        GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, GL.GL_DEPTH_ATTACHMENT,
+            GL.GL_RENDERBUFFER, self.depthBuffer)
+        
+        GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, 0)
+        
+        if GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER) != GL.GL_FRAMEBUFFER_COMPLETE:
+            raise Exception("Offscreen framebuffer is incomplete!")
+    
+    def __createEGLContext(self):
+        # Mesa: create the display without X11/Wayland
+        os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+        from OpenGL import EGL
+        
+        self.eglDisplay = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.eglDisplay, byref(major), byref(minor)):
+            raise Exception("Unable to initialize EGL!")
+        
+        configAttribs = (EGL.EGLint * 9)(
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_DEPTH_SIZE, 24,
+            EGL.EGL_NONE)
+        config = EGL.EGLConfig()
+        numConfigs = EGL.EGLint()
+        EGL.eglChooseConfig(self.eglDisplay, configAttribs, byref(config), 1, byref(numConfigs))
+        if numConfigs.value == 0:
+            raise Exception("No suitable EGL config!")
+        
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        contextAttribs = (EGL.EGLint * 7)(
+            EGL.EGL_CONTEXT_MAJOR_VERSION, self.major,
+            EGL.EGL_CONTEXT_MINOR_VERSION, self.minor,
+            EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK, EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+            EGL.EGL_NONE)
+        self.glcontext = EGL.eglCreateContext(self.eglDisplay, config,
+            EGL.EGL_NO_CONTEXT, contextAttribs)
+        if not self.glcontext:
+            raise Exception("Unable to create EGL context!")
+        
+        # surfaceless: everything is drawn into the framebuffer object
+        if not EGL.eglMakeCurrent(self.eglDisplay, EGL.EGL_NO_SURFACE,
+                                  EGL.EGL_NO_SURFACE, self.glcontext):
+            raise Exception("Unable to make EGL context current!")
+    
+    def __createOSMesaContext(self):
+        from OpenGL import osmesa, arrays
+        
+        attribs = arrays.GLintArray.asArray([
+            osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA,
+            osmesa.OSMESA_DEPTH_BITS, 24,
+            osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+            osmesa.OSMESA_CONTEXT_MAJOR_VERSION, self.major,
+            osmesa.OSMESA_CONTEXT_MINOR_VERSION, self.minor,
+            0])
+        self.glcontext = osmesa.OSMesaCreateContextAttribs(attribs, None)
+        if not self.glcontext:
+            raise Exception("Unable to create OSMesa context!")
+        
+        # OSMesa needs a client side buffer, even if drawing goes to the FBO
+        self.osmesaBuffer = arrays.GLubyteArray.zeros((self.size[1], self.size[0], 4))
+        if not osmesa.OSMesaMakeCurrent(self.glcontext, self.osmesaBuffer,
+                                        GL.GL_UNSIGNED_BYTE, self.size[0], self.size[1]):
+            raise Exception("Unable to make OSMesa context current!")
+    
+    def __destroyOffscreen(self):
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, 0)
+        GL.glDeleteRenderbuffers(2, [self.colorBuffer, self.depthBuffer])
+        GL.glDeleteFramebuffers(1, [self.framebuffer])
+        
+        if self.offscreen == "egl":
+            from OpenGL import EGL
+            EGL.eglMakeCurrent(self.eglDisplay, EGL.EGL_NO_SURFACE,
+                EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroyContext(self.eglDisplay, self.glcontext)
+            EGL.eglTerminate(self.eglDisplay)
+        else:
+            from OpenGL import osmesa
+            osmesa.OSMesaDestroyContext(self.glcontext)
 
 class GLWindowRenderDelegate(object):
     """This class will receive cleanup, update, and render calls from the
@@ -128,5 +658,27 @@ class GLWindowRenderDelegate(object):
     def update(self, dtime):
         raise Exception("MUST IMPLEMENT 'update' METHOD!")
     
-    def render(self):
+    def render(self, alpha=1.0):
+        """Draws the frame. alpha is only passed when the window's
+        interpolation is enabled (see GLWindow).
+        """
         raise Exception("MUST IMPLEMENT 'render' METHOD!")
+    
+    # only needed when the window's threaded mode is used
+    
+    def createSnapshot(self):
+        """Returns a new, empty object to copy the state needed for drawing
+        into. A few are allocated and reused.
+        """
+        raise Exception("MUST IMPLEMENT 'createSnapshot' METHOD!")
+    
+    def writeSnapshot(self, snapshot):
+        """Copies the current state into snapshot. Called on the update thread
+        after updates, so update may run again while the copy is drawn.
+        """
+        raise Exception("MUST IMPLEMENT 'writeSnapshot' METHOD!")
+    
+    def renderSnapshot(self, snapshot, alpha=1.0):
+        """Draws the frame from a snapshot instead of the live state.
+        """
+        raise Exception("MUST IMPLEMENT 'renderSnapshot' METHOD!")
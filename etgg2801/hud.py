@@ -0,0 +1,344 @@
+import ctypes
+import numpy as np
+from OpenGL import GL
+from . import Matrix4, ShaderProgram, DynamicBuffer
+
+sprite_vsrc = b'''
+#version 400
+
+layout (location = 0) in vec2 VertexPosition;
+layout (location = 1) in vec2 UV;
+layout (location = 2) in vec4 Color;
+
+out vec2 texCoord;
+out vec4 color;
+uniform mat4 projection;
+
+void main()
+{
+    texCoord = UV;
+    color = Color;
+    gl_Position = projection * vec4(VertexPosition, 0.0, 1.0);
+}
+'''
+
+sprite_fsrc = b'''
+#version 400
+
+in vec2 texCoord;
+in vec4 color;
+out vec4 FragColor;
+
+uniform sampler2D sampler;
+
+void main() {
+    FragColor = texture(sampler, texCoord) * color;
+}
+'''
+
+class AtlasRegion(object):
+    """Where an image was packed in a TextureAtlas: its pixel rectangle (x, y
+    from the top left) and texture coordinates.
+    """
+    def __init__(self, x, y, width, height, atlasSize):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.u0 = x / atlasSize
+        self.v0 = y / atlasSize
+        self.u1 = (x + width) / atlasSize
+        self.v1 = (y + height) / atlasSize
+
+class TextureAtlas(object):
+    """Packs many small images (HUD icons, the reticle) into one texture, so
+    they can all be drawn without changing textures. Images are added by
+    name, then pack places them on shelves, tallest first, each surrounded
+    by padding pixels copied from its edges so filtering never blends in a
+    neighbor.
+    """
+    def __init__(self, size=1024, padding=1):
+        self.size = size
+        self.padding = padding
+        self.images = {}
+        self.regions = {}
+        self.pixels = None
+        self.textureObject = None
+
+    def addImage(self, name, image):
+        """Adds an Image (see decodeImage) to be packed.
+        """
+        if self.pixels is not None:
+            raise Exception("Atlas already packed!")
+
+        self.images[name] = image
+
+    def getRegion(self, name):
+        if name not in self.regions:
+            raise Exception("No image '%s' in the atlas!" % name)
+
+        return self.regions[name]
+
+    def getRGBA(self, image):
+        pixels = np.frombuffer(image.pixels, dtype=np.uint8).reshape(image.height,
+            image.width, len(image.format))
+        channels = [pixels[:, :, image.format.index(c)] for c in "RGB"]
+        if 'A' in image.format:
+            channels.append(pixels[:, :, image.format.index('A')])
+        else:
+            channels.append(np.full((image.height, image.width), 255, dtype=np.uint8))
+
+        return np.dstack(channels)
+
+    def pack(self):
+        """Places every image and builds the atlas pixels (RGBA, rows from the
+        top). Raises an Exception if they do not fit.
+        """
+        self.pixels = np.zeros((self.size, self.size, 4), dtype=np.uint8)
+        self.regions = {}
+
+        x = 0
+        y = 0
+        shelfHeight = 0
+        pad = self.padding
+        byHeight = sorted(self.images.items(), key=lambda item: -item[1].height)
+        for name, image in byHeight:
+            width = image.width + 2 * pad
+            height = image.height + 2 * pad
+            if x + width > self.size:
+                x = 0
+                y += shelfHeight
+                shelfHeight = 0
+            if x + width > self.size or y + height > self.size:
+                raise Exception("Images do not fit in a %dx%d atlas!" % (self.size, self.size))
+
+            rgba = self.getRGBA(image)
+            if pad:
+                rgba = np.pad(rgba, ((pad, pad), (pad, pad), (0, 0)), mode='edge')
+            self.pixels[y : y + height, x : x + width] = rgba
+            self.regions[name] = AtlasRegion(x + pad, y + pad, image.width,
+                image.height, self.size)
+
+            x += width
+            shelfHeight = max(shelfHeight, height)
+
+        self.images = {}
+
+    def loadToVRAM(self):
+        """Packs the atlas, if not done yet, and creates its texture.
+        """
+        if self.pixels is None:
+            self.pack()
+
+        self.textureObject = GL.glGenTextures(1)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.textureObject)
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, self.size, self.size, 0,
+            GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, self.pixels)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+
+        self.pixels = None
+
+    def cleanup(self):
+        if self.textureObject is not None:
+            GL.glDeleteTextures(1, [self.textureObject])
+        self.textureObject = None
+
+class SpriteBatch(object):
+    """Draws textured quads from one TextureAtlas in a single draw call.
+    Between begin and end, draw adds quads to a vertex array; end writes
+    them all to a DynamicBuffer and draws them. The quads are in pixels,
+    from the top left of the screen.
+    """
+    # x, y, u, v, r, g, b, a
+    VERTEX_FLOATS = 8
+    VERTEX_BYTES = VERTEX_FLOATS * 4
+
+    def __init__(self, atlas, maxSprites=256, program=None):
+        """program defaults to one built from sprite_vsrc and sprite_fsrc.
+        """
+        if maxSprites * 4 > 65536:
+            raise Exception("SpriteBatch supports at most 16384 sprites!")
+
+        self.atlas = atlas
+        self.maxSprites = maxSprites
+        self.ownsProgram = program is None
+        self.program = program or ShaderProgram.fromSource(sprite_vsrc, sprite_fsrc)
+
+        self.vertices = np.zeros((maxSprites * 4, SpriteBatch.VERTEX_FLOATS), dtype=np.float32)
+        self.numSprites = 0
+        self.buffer = DynamicBuffer(maxSprites * 4 * SpriteBatch.VERTEX_BYTES)
+
+        # two triangles per quad; corners are top left, bottom left, bottom
+        # right, top right
+        quad = np.array([0, 1, 2, 0, 2, 3], dtype=np.uint16)
+        indices = (quad + 4 * np.arange(maxSprites, dtype=np.uint16)[:, None]).ravel()
+
+        self.vertexArrayObject = GL.glGenVertexArrays(1)
+        GL.glBindVertexArray(self.vertexArrayObject)
+        self.indexBuffer = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.indexBuffer)
+        GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, indices, GL.GL_STATIC_DRAW)
+
+        # the attributes point at the start of the buffer; each frame's quads
+        # are reached with a base vertex instead
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffer.buffer)
+        for location, (size, offset) in enumerate(((2, 0), (2, 8), (4, 16))):
+            GL.glVertexAttribPointer(location, size, GL.GL_FLOAT, False,
+                SpriteBatch.VERTEX_BYTES, ctypes.c_void_p(offset))
+            GL.glEnableVertexAttribArray(location)
+        GL.glBindVertexArray(0)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
+
+        self.projection = Matrix4()
+        self.numDrawCalls = 0
+
+    def begin(self, width, height):
+        """Starts a batch for a screen of width x height pixels.
+        """
+        self.numSprites = 0
+        self.projection = Matrix4.getOrthographic(top=0, bottom=height, left=0,
+            right=width, near=-1, far=1)
+
+    def draw(self, name, x, y, width=None, height=None, color=(1.0, 1.0, 1.0, 1.0)):
+        """Adds the atlas image called name with its top left corner at x, y,
+        scaled to width x height (by default its size in pixels) and tinted
+        by color.
+        """
+        if self.numSprites == self.maxSprites:
+            raise Exception("SpriteBatch is full!")
+
+        region = self.atlas.getRegion(name)
+        if width is None:
+            width = region.width
+        if height is None:
+            height = region.height
+
+        first = self.numSprites * 4
+        quad = self.vertices[first : first + 4]
+        quad[:, 0] = (x, x, x + width, x + width)
+        quad[:, 1] = (y, y + height, y + height, y)
+        quad[:, 2] = (region.u0, region.u0, region.u1, region.u1)
+        quad[:, 3] = (region.v0, region.v1, region.v1, region.v0)
+        quad[:, 4:] = color
+        self.numSprites += 1
+
+    def end(self):
+        """Draws every quad added since begin with one draw call.
+        """
+        self.numDrawCalls = 0
+        if self.numSprites == 0:
+            return
+
+        offset = self.buffer.write(self.vertices[: self.numSprites * 4])
+
+        previous = ShaderProgram.current
+        self.program.use()
+        GL.glUniformMatrix4fv(self.program.getUniformLocation("projection"), 1, False,
+            self.projection.getCType())
+        GL.glUniform1i(self.program.getUniformLocation("sampler"), 0)
+
+        GL.glBindVertexArray(self.vertexArrayObject)
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.atlas.textureObject)
+        GL.glDrawElementsBaseVertex(GL.GL_TRIANGLES, self.numSprites * 6,
+            GL.GL_UNSIGNED_SHORT, None, offset // SpriteBatch.VERTEX_BYTES)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        GL.glBindVertexArray(0)
+
+        self.buffer.endFrame()
+        self.numDrawCalls = 1
+
+        if previous is not None:
+            previous.use()
+
+    def cleanup(self):
+        self.buffer.cleanup()
+        GL.glDeleteBuffers(1, [self.indexBuffer])
+        GL.glDeleteVertexArrays(1, [self.vertexArrayObject])
+        if self.ownsProgram:
+            self.program.cleanup()
+
+class HUDSprite(object):
+    """An atlas image placed on the HUD. Its position is x, y pixels from an
+    anchor point given as a fraction of the screen ((0, 0) is the top left,
+    (0.5, 0.5) the center), and pivot is the point of the sprite, as a
+    fraction of its size, that is placed there.
+    """
+    def __init__(self, name, x=0, y=0, width=None, height=None, anchor=(0.0, 0.0),
+                 pivot=(0.0, 0.0), color=(1.0, 1.0, 1.0, 1.0)):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.anchor = anchor
+        self.pivot = pivot
+        self.color = color
+        self.visible = True
+
+class HUDLayer(object):
+    """Screen space sprites drawn over the scene with an orthographic
+    projection in pixels, all from one TextureAtlas in one draw call. Unlike
+    HUDModel, nothing follows the camera, so the HUD costs nothing in
+    update.
+    """
+    def __init__(self, size, atlas, maxSprites=256, shaders=None):
+        """size is the screen size in pixels. The atlas is packed and
+        uploaded if it has no texture yet. With a ShaderManager, the sprite
+        program is built (and cached) by it.
+        """
+        self.size = tuple(size)
+        self.atlas = atlas
+        if atlas.textureObject is None:
+            atlas.loadToVRAM()
+
+        program = None
+        if shaders is not None:
+            program = shaders.getProgram("hud_sprite", sprite_vsrc, sprite_fsrc)
+        self.batch = SpriteBatch(atlas, maxSprites, program)
+        self.sprites = []
+
+    def setSize(self, size):
+        self.size = tuple(size)
+
+    def addSprite(self, name, **kwargs):
+        """Adds a HUDSprite of the atlas image called name (see HUDSprite for
+        the keyword arguments) and returns it.
+        """
+        sprite = HUDSprite(name, **kwargs)
+        self.sprites.append(sprite)
+
+        return sprite
+
+    def removeSprite(self, sprite):
+        self.sprites.remove(sprite)
+
+    def render(self):
+        width, height = self.size
+        self.batch.begin(width, height)
+        for sprite in self.sprites:
+            if not sprite.visible:
+                continue
+
+            region = self.atlas.getRegion(sprite.name)
+            w = region.width if sprite.width is None else sprite.width
+            h = region.height if sprite.height is None else sprite.height
+            x = sprite.anchor[0] * width + sprite.x - sprite.pivot[0] * w
+            y = sprite.anchor[1] * height + sprite.y - sprite.pivot[1] * h
+            self.batch.draw(sprite.name, x, y, w, h, sprite.color)
+
+        depthTest = GL.glIsEnabled(GL.GL_DEPTH_TEST)
+        GL.glDisable(GL.GL_DEPTH_TEST)
+        self.batch.end()
+        if depthTest:
+            GL.glEnable(GL.GL_DEPTH_TEST)
+
+    def cleanup(self):
+        self.batch.cleanup()
+        self.atlas.cleanup()
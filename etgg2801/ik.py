@@ -0,0 +1,285 @@
+import time
+import numpy as np
+from . import KinematicChain, REVOLUTE, PRISMATIC, Scara, Viper
+
+class IKSolver(object):
+    """Base class for inverse kinematics solvers. A solver drives the tool
+    point (toolOffset, given in the frame of the last link) of a
+    KinematicChain to target positions expressed in the robot's base frame.
+    """
+    def __init__(self, chain, toolOffset=(0.0, 0.0, 0.0)):
+        if type(self) == IKSolver:
+            raise Exception("IKSolver CANNOT BE INSTANTIATED!")
+
+        self.chain = chain
+        self.toolOffset = np.array(toolOffset, dtype=np.float64)
+
+    def solve(self, targets, initial=None):
+        """Returns (values, converged) for an array of targets of shape (3,)
+        or (N, 3). initial optionally gives the starting (or current) joint
+        values of each robot.
+        """
+        raise Exception("MUST IMPLEMENT 'solve' METHOD!")
+
+    def getToolPositions(self, values):
+        """Returns the base frame positions of the tool point for the given
+        joint values, shape values.shape[:-1] + (3,).
+        """
+        world = self.chain.forwardKinematics(values)
+        last = world[..., -1, :, :]
+
+        return np.matmul(last[..., :3, :3], self.toolOffset) + last[..., :3, 3]
+
+    def getInitialValues(self, initial, count):
+        """Returns a (count, J) array of starting joint values.
+        """
+        if initial is None:
+            initial = self.chain.values
+        values = np.empty((count, self.chain.getNumJoints()))
+        values[:] = initial
+
+        return np.clip(values, self.chain.valueMin, self.chain.valueMax)
+
+    def solveRobot(self, robot, target):
+        """Solves for a world space target position (Vector4) and, when the
+        target is reachable, applies the joint values to the robot. Returns
+        True on success.
+        """
+        base = self.chain.getBaseTransforms(robot.position.getXYZ(),
+            robot.orientation.getXYZ())
+        local = np.linalg.solve(base, np.array(target.getXYZ() + [1.0]))[:3]
+
+        values, converged = self.solve(local, [j.value for j in robot.joints])
+        if converged:
+            for j, v in zip(robot.joints, values):
+                j.value = float(v)
+
+        return bool(converged)
+
+class ScaraIKSolver(IKSolver):
+    """Closed form solver for revolute-revolute-prismatic arms whose joints
+    all act along the Y axis (Scara). Both elbow configurations are tried,
+    and the one within the joint limits that is closest to the initial
+    values is kept.
+    """
+    def __init__(self, chain=None, toolOffset=(-0.275, 0.0, 0.0)):
+        """When no chain is given, the Scara joints are used. The default tool
+        offset is the length of the outer link of the arm.
+        """
+        if chain is None:
+            chain = KinematicChain.fromJoints(Scara.getJoints())
+
+        super().__init__(chain, toolOffset)
+
+        if (list(chain.jointTypes) != [REVOLUTE, REVOLUTE, PRISMATIC] or
+                not np.allclose(chain.axes, (0, 1, 0))):
+            raise Exception("ScaraIKSolver requires an RRP chain about the Y axis!")
+
+        # link vectors in the XZ plane, before and after the elbow joint
+        self.inner = chain.offsets[1, [0, 2]]
+        self.outer = chain.offsets[2, [0, 2]] + self.toolOffset[[0, 2]]
+        self.height = chain.offsets[:, 1].sum() + self.toolOffset[1]
+
+        if np.hypot(*self.inner) == 0 or np.hypot(*self.outer) == 0:
+            raise Exception("ScaraIKSolver requires non-zero link lengths!")
+
+    def solve(self, targets, initial=None):
+        """See IKSolver class.
+        """
+        targets = np.asarray(targets, dtype=np.float64)
+        single = targets.ndim == 1
+        targets = targets.reshape(-1, 3)
+        count = len(targets)
+        chain = self.chain
+        current = self.getInitialValues(initial, count)
+
+        q = targets[:, [0, 2]] - chain.offsets[0, [0, 2]]
+        lenInner = np.hypot(*self.inner)
+        lenOuter = np.hypot(*self.outer)
+        angleInner = np.arctan2(self.inner[1], self.inner[0])
+        angleOuter = np.arctan2(self.outer[1], self.outer[0])
+
+        # law of cosines for the elbow; a rotation of theta about Y turns a
+        # vector in the XZ plane by -theta
+        cosElbow = ((q ** 2).sum(axis=1) - lenInner ** 2 - lenOuter ** 2) / (2 * lenInner * lenOuter)
+        reachable = np.abs(cosElbow) <= 1.0 + 1e-9
+        elbow = np.arccos(np.clip(cosElbow, -1.0, 1.0))
+
+        values = np.empty((count, 2, 3))
+        theta1 = np.stack((elbow, -elbow), axis=1) - angleInner + angleOuter
+        values[:, :, 1] = np.degrees(theta1)
+
+        # direction of the elbow-rotated arm, compared to the target direction
+        armX = self.inner[0] + np.cos(theta1) * self.outer[0] + np.sin(theta1) * self.outer[1]
+        armZ = self.inner[1] - np.sin(theta1) * self.outer[0] + np.cos(theta1) * self.outer[1]
+        values[:, :, 0] = np.degrees(np.arctan2(armZ, armX) -
+            np.arctan2(q[:, 1], q[:, 0])[:, np.newaxis])
+        values[:, :, 2] = (targets[:, 1] - self.height)[:, np.newaxis]
+
+        # wrap angles into the joint ranges where possible
+        for k in (0, 1):
+            low = chain.valueMin[k]
+            values[:, :, k] = np.mod(values[:, :, k] - low, 360.0) + low
+
+        valid = (np.all(values >= chain.valueMin - 1e-9, axis=2) &
+                 np.all(values <= chain.valueMax + 1e-9, axis=2) &
+                 reachable[:, np.newaxis])
+
+        distance = np.abs(values - current[:, np.newaxis, :]).sum(axis=2)
+        distance[~valid] = np.inf
+        best = np.argmin(distance, axis=1)
+
+        solved = np.where(valid.any(axis=1)[:, np.newaxis],
+            values[np.arange(count), best], current)
+        converged = valid.any(axis=1)
+
+        if single:
+            return solved[0], converged[0]
+
+        return solved, converged
+
+class DLSIKSolver(IKSolver):
+    """Damped least squares (Levenberg-Marquardt) solver for the position of
+    the tool point of any serial chain (Viper). Each iteration is computed
+    for all unconverged targets at once, and joint values are clamped to
+    their limits after every step.
+    """
+    def __init__(self, chain=None, toolOffset=(0.0, 0.0, 0.0), damping=0.02,
+                 tolerance=1e-4, maxIterations=30, maxStep=0.2, restarts=8):
+        """When no chain is given, the Viper joints are used. damping is the
+        lambda term of the solver, tolerance the required distance to the
+        target, and maxStep the largest error corrected per iteration.
+        Targets that get stuck (usually against a joint limit) are retried
+        from random joint values up to restarts times.
+        """
+        if chain is None:
+            chain = KinematicChain.fromJoints(Viper.getJoints())
+
+        super().__init__(chain, toolOffset)
+
+        self.damping = damping
+        self.tolerance = tolerance
+        self.maxIterations = maxIterations
+        self.maxStep = maxStep
+        self.restarts = restarts
+        self.iterations = np.zeros(0, dtype=np.int32)
+        self.random = np.random.default_rng(0)
+
+    def getJacobians(self, values):
+        """Returns the tool positions (N, 3) and position Jacobians (N, 3, J)
+        for the (N, J) joint values. Revolute columns are per radian.
+        """
+        world = self.chain.forwardKinematics(values)
+        last = world[:, -1]
+        tool = np.matmul(last[:, :3, :3], self.toolOffset) + last[:, :3, 3]
+
+        # joint k moves about (or along) its axis in the frame of link k + 1
+        frames = world[:, 1:]
+        axes = np.einsum('njab,jb->nja', frames[..., :3, :3], self.chain.axes)
+        lever = tool[:, np.newaxis, :] - frames[..., :3, 3]
+
+        revolute = (self.chain.jointTypes == REVOLUTE)[:, np.newaxis]
+        columns = np.where(revolute, np.cross(axes, lever), axes)
+
+        return tool, np.swapaxes(columns, 1, 2)
+
+    def solve(self, targets, initial=None):
+        """See IKSolver class. The iteration count of each target is kept in
+        the iterations attribute.
+        """
+        targets = np.asarray(targets, dtype=np.float64)
+        single = targets.ndim == 1
+        targets = targets.reshape(-1, 3)
+        count = len(targets)
+        chain = self.chain
+
+        values = self.getInitialValues(initial, count)
+        converged = np.zeros(count, dtype=bool)
+        self.iterations = np.zeros(count, dtype=np.int32)
+
+        self.iterate(targets, values, converged, np.arange(count))
+        for r in range(self.restarts):
+            retry = np.nonzero(~converged)[0]
+            if len(retry) == 0:
+                break
+
+            values[retry] = self.random.uniform(chain.valueMin, chain.valueMax,
+                (len(retry), chain.getNumJoints()))
+            self.iterate(targets, values, converged, retry)
+
+        if single:
+            return values[0], converged[0]
+
+        return values, converged
+
+    def iterate(self, targets, values, converged, active):
+        """Runs up to maxIterations steps for the targets indexed by active,
+        updating values and converged in place.
+        """
+        chain = self.chain
+
+        # revolute joints are stored in degrees
+        scale = np.where(chain.jointTypes == REVOLUTE, np.degrees(1.0), 1.0)
+        damping2 = self.damping ** 2
+
+        for i in range(self.maxIterations + 1):
+            tool, jacobian = self.getJacobians(values[active])
+            error = targets[active] - tool
+            distance = np.sqrt((error ** 2).sum(axis=1))
+
+            done = distance < self.tolerance
+            converged[active[done]] = True
+            if i == self.maxIterations:
+                break
+
+            keep = ~done
+            active = active[keep]
+            if len(active) == 0:
+                break
+
+            error = error[keep]
+            distance = distance[keep]
+            jacobian = jacobian[keep]
+
+            # limit how far a single step is allowed to go
+            error *= np.minimum(1.0, self.maxStep / distance)[:, np.newaxis]
+
+            jjt = np.matmul(jacobian, np.swapaxes(jacobian, 1, 2))
+            jjt += damping2 * np.eye(3)
+            step = np.linalg.solve(jjt, error[..., np.newaxis])
+            dq = np.matmul(np.swapaxes(jacobian, 1, 2), step)[..., 0]
+
+            values[active] = np.clip(values[active] + dq * scale,
+                chain.valueMin, chain.valueMax)
+            self.iterations[active] += 1
+
+def benchmark(count=10000, seed=0):
+    """Solves count random reachable targets for each solver, printing the
+    convergence rate, residual error, and throughput.
+    """
+    rng = np.random.default_rng(seed)
+    solvers = (("Scara (analytic)", ScaraIKSolver()), ("Viper (DLS)", DLSIKSolver()))
+
+    for name, solver in solvers:
+        chain = solver.chain
+        values = rng.uniform(chain.valueMin, chain.valueMax,
+            (count, chain.getNumJoints()))
+        targets = solver.getToolPositions(values)
+
+        startTime = time.perf_counter()
+        solved, converged = solver.solve(targets)
+        elapsed = time.perf_counter() - startTime
+
+        residual = np.sqrt(((solver.getToolPositions(solved) - targets) ** 2).sum(axis=1))
+
+        print(name)
+        print("  converged:      %.2f%%" % (100.0 * converged.mean()))
+        print("  mean residual:  %.3g" % residual[converged].mean())
+        print("  max residual:   %.3g" % residual[converged].max())
+        if isinstance(solver, DLSIKSolver):
+            print("  mean iterations: %.1f" % solver.iterations[converged].mean())
+        print("  time:           %.4f s" % elapsed)
+        print("  throughput:     %.0f targets/s" % (count / elapsed))
+
+if __name__ == "__main__":
+    benchmark()
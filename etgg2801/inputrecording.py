@@ -0,0 +1,143 @@
+import math
+import struct
+import sdl2
+
+# Input log layout (little endian):
+#   header:  magic, version, timeStep (ms)
+#   ticks:   dx, dy, numKeys, then numKeys uint16 scancodes held down
+#
+# One tick is written per update step (per InputState.take), so replaying
+# a log with one update per frame drives the scene through exactly the same
+# states whatever the frame rate.
+INPUT_HEADER = struct.Struct('<4sHf')
+INPUT_TICK = struct.Struct('<iiH')
+
+INPUT_MAGIC = b'INPT'
+INPUT_VERSION = 1
+
+class InputRecorder(object):
+    """Stands in for a window's InputState (set it as GLWindow.input),
+    passing the live input through and writing every tick taken to a log
+    that InputPlayer replays.
+    """
+    def __init__(self, source, file, timeStep=10):
+        """source is the InputState to record; timeStep (ms) is the update
+        time step the ticks are taken at.
+        """
+        self.source = source
+        self.numTicks = 0
+        self.fp = open(file, 'wb')
+        self.fp.write(INPUT_HEADER.pack(INPUT_MAGIC, INPUT_VERSION, timeStep))
+
+    @property
+    def sampleTime(self):
+        return self.source.sampleTime
+
+    @property
+    def takenTime(self):
+        return self.source.takenTime
+
+    def setMouseCapture(self, capture):
+        self.source.setMouseCapture(capture)
+
+    def sample(self):
+        self.source.sample()
+
+    def take(self):
+        keys, dx, dy = self.source.take()
+
+        pressed = [code for code, down in enumerate(keys) if down]
+        self.fp.write(INPUT_TICK.pack(dx, dy, len(pressed)))
+        self.fp.write(struct.pack('<%dH' % len(pressed), *pressed))
+        self.numTicks += 1
+
+        return keys, dx, dy
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+class InputPlayer(object):
+    """Stands in for a window's InputState (set it as GLWindow.input),
+    returning the ticks of a log written by InputRecorder (or
+    createFlythrough) one per take, then no input once finished is set.
+    """
+    def __init__(self, file):
+        with open(file, 'rb') as fp:
+            data = fp.read()
+
+        magic, version, self.timeStep = INPUT_HEADER.unpack_from(data, 0)
+        if magic != INPUT_MAGIC or version != INPUT_VERSION:
+            raise Exception("Not an input log: " + file)
+
+        self.ticks = []
+        offset = INPUT_HEADER.size
+        while offset < len(data):
+            dx, dy, numKeys = INPUT_TICK.unpack_from(data, offset)
+            offset += INPUT_TICK.size
+            pressed = struct.unpack_from('<%dH' % numKeys, data, offset)
+            offset += 2 * numKeys
+
+            keys = bytearray(sdl2.SDL_NUM_SCANCODES)
+            for code in pressed:
+                keys[code] = 1
+            self.ticks.append((bytes(keys), dx, dy))
+
+        self.numTicks = len(self.ticks)
+        self.position = 0
+        self.finished = False
+        self.idle = (bytes(sdl2.SDL_NUM_SCANCODES), 0, 0)
+
+        # performance counter of the latest sample, and of the sample last taken
+        self.sampleTime = 0
+        self.takenTime = 0
+
+    def setMouseCapture(self, capture):
+        pass
+
+    def sample(self):
+        self.sampleTime = sdl2.SDL_GetPerformanceCounter()
+
+    def take(self):
+        self.takenTime = self.sampleTime
+        if self.position == self.numTicks:
+            self.finished = True
+            return self.idle
+
+        tick = self.ticks[self.position]
+        self.position += 1
+
+        return tick
+
+    def rewind(self):
+        self.position = 0
+        self.finished = False
+
+def createFlythrough(file, numTicks=1000, timeStep=10):
+    """Writes a scripted input log: flying forward for two legs of 2
+    seconds and back for two, strafing on every third leg, while yawing from
+    side to side and pitching gently, so runs without a recorded session
+    still cover the scene the same way every time.
+    """
+    with open(file, 'wb') as fp:
+        fp.write(INPUT_HEADER.pack(INPUT_MAGIC, INPUT_VERSION, timeStep))
+
+        legTicks = max(1, int(2000 / timeStep))
+        mouseX = mouseY = 0.0
+        for tick in range(numTicks):
+            leg = tick // legTicks
+            pressed = [sdl2.SDL_SCANCODE_W if leg % 4 < 2 else sdl2.SDL_SCANCODE_S]
+            if leg % 3 == 2:
+                pressed.append(sdl2.SDL_SCANCODE_D if leg % 2 else sdl2.SDL_SCANCODE_A)
+
+            # the mouse moves in whole counts, so accumulate the motion
+            seconds = tick * timeStep / 1000.0
+            x = mouseX + 0.3 * timeStep / 10.0 * math.sin(seconds * 0.8)
+            y = mouseY + 0.05 * timeStep / 10.0 * math.sin(seconds * 0.5)
+            dx = int(round(x)) - int(round(mouseX))
+            dy = int(round(y)) - int(round(mouseY))
+            mouseX, mouseY = x, y
+
+            fp.write(INPUT_TICK.pack(dx, dy, len(pressed)))
+            fp.write(struct.pack('<%dH' % len(pressed), *pressed))
@@ -0,0 +1,163 @@
+import numpy as np
+from . import Matrix4
+
+REVOLUTE = 0
+PRISMATIC = 1
+
+def getRotationArray(ax, ay, az):
+    """Returns an array of 3x3 rotation matrices for the given arrays of angles
+    (degrees). The result matches Matrix4.getRotation (X * Y * Z) for each
+    element and has shape ax.shape + (3, 3).
+    """
+    ax = np.radians(ax)
+    ay = np.radians(ay)
+    az = np.radians(az)
+    cx, sx = np.cos(ax), np.sin(ax)
+    cy, sy = np.cos(ay), np.sin(ay)
+    cz, sz = np.cos(az), np.sin(az)
+
+    rot = np.empty(np.shape(ax) + (3, 3))
+    rot[..., 0, 0] = cy * cz
+    rot[..., 0, 1] = -cy * sz
+    rot[..., 0, 2] = sy
+    rot[..., 1, 0] = cx * sz + sx * sy * cz
+    rot[..., 1, 1] = cx * cz - sx * sy * sz
+    rot[..., 1, 2] = -sx * cy
+    rot[..., 2, 0] = sx * sz - cx * sy * cz
+    rot[..., 2, 1] = sx * cz + cx * sy * sz
+    rot[..., 2, 2] = cx * cy
+
+    return rot
+
+def toMatrix4(array):
+    """Converts a 4x4 array into a Matrix4.
+    """
+    return Matrix4([[float(v) for v in row] for row in array])
+
+class KinematicChain(object):
+    """Array representation of a robot's serial chain of joints. Joint axes,
+    offsets, limits, velocities, and values are stored as arrays so that the
+    link-to-world transforms for one robot, or a batch of N robots sharing
+    the same configuration, can be computed in a few vectorized passes.
+    """
+
+    @staticmethod
+    def fromRobot(robot):
+        """Builds a chain from the joints of a Robot (Scara, Viper, etc).
+        """
+        return KinematicChain.fromJoints(robot.joints)
+
+    @staticmethod
+    def fromJoints(joints):
+        """Builds a chain from a list of joints, e.g. Scara.getJoints().
+        """
+        chain = KinematicChain()
+        for j in joints:
+            chain.addJoint(j)
+
+        return chain
+
+    def __init__(self):
+        self.partNames = []
+        self.jointTypes = np.zeros(0, dtype=np.int8)
+        self.axes = np.zeros((0, 3))
+        self.offsets = np.zeros((0, 3))
+        self.valueMin = np.zeros(0)
+        self.valueMax = np.zeros(0)
+        self.velocities = np.zeros(0)
+        self.values = np.zeros(0)
+
+    def getNumJoints(self):
+        return len(self.jointTypes)
+
+    def getNumLinks(self):
+        return len(self.partNames)
+
+    def addJoint(self, joint):
+        """Appends a Joint (RevoluteJoint or PrismaticJoint) to the chain.
+        """
+        from .robot import PrismaticJoint
+
+        if not self.partNames:
+            self.partNames.append(joint.partA)
+        self.partNames.append(joint.partB)
+
+        jointType = PRISMATIC if isinstance(joint, PrismaticJoint) else REVOLUTE
+        self.jointTypes = np.append(self.jointTypes, np.int8(jointType))
+        self.axes = np.vstack((self.axes, (tuple(joint.axis) + (0, 0, 0))[:3]))
+        self.offsets = np.vstack((self.offsets, (tuple(joint.offset) + (0, 0, 0))[:3]))
+        self.valueMin = np.append(self.valueMin, joint.valueMin)
+        self.valueMax = np.append(self.valueMax, joint.valueMax)
+        self.velocities = np.append(self.velocities, joint.velocity)
+        self.values = np.append(self.values, joint.value)
+
+    def getJointTransforms(self, values=None):
+        """Returns the transformations of each link relative to its parent for
+        the given joint values. values may have shape (J,) or (N, J); the
+        result has shape values.shape + (4, 4).
+        """
+        if values is None:
+            values = self.values
+        values = np.asarray(values, dtype=np.float64)
+
+        # angle (revolute) or displacement (prismatic) along each axis
+        scaled = values[..., :, np.newaxis] * self.axes
+        revolute = self.jointTypes == REVOLUTE
+        prismatic = self.jointTypes == PRISMATIC
+
+        local = np.zeros(values.shape + (4, 4))
+        local[..., 3, 3] = 1.0
+        local[..., :3, :3] = np.eye(3)
+        local[..., :3, 3] = self.offsets + scaled * prismatic[:, np.newaxis]
+
+        if revolute.any():
+            angles = scaled[..., revolute, :]
+            local[..., revolute, :3, :3] = getRotationArray(
+                angles[..., 0], angles[..., 1], angles[..., 2])
+
+        return local
+
+    def getBaseTransforms(self, positions=None, orientations=None, count=None):
+        """Returns the object-to-world transformations of robot bases, given
+        arrays of positions (N, 3) and Euler orientations in degrees (N, 3).
+        """
+        if positions is None and orientations is None:
+            base = np.zeros((4, 4)) if count is None else np.zeros((count, 4, 4))
+            base[..., :, :] = np.eye(4)
+            return base
+
+        if positions is None:
+            positions = np.zeros(np.shape(orientations))
+        if orientations is None:
+            orientations = np.zeros(np.shape(positions))
+        positions = np.asarray(positions, dtype=np.float64)
+        orientations = np.asarray(orientations, dtype=np.float64)
+
+        base = np.zeros(positions.shape[:-1] + (4, 4))
+        base[..., :3, :3] = getRotationArray(orientations[..., 0],
+            orientations[..., 1], orientations[..., 2])
+        base[..., :3, 3] = positions[..., :3]
+        base[..., 3, 3] = 1.0
+
+        return base
+
+    def forwardKinematics(self, values=None, positions=None, orientations=None):
+        """Computes the link-to-world transformations of every link in the
+        chain. values may have shape (J,) for one robot or (N, J) for a batch
+        of robots; positions and orientations are optional base poses with
+        matching leading dimensions. The result has shape (J + 1, 4, 4) or
+        (N, J + 1, 4, 4), ordered as partNames.
+        """
+        if values is None:
+            values = self.values
+        values = np.asarray(values, dtype=np.float64)
+        batch = values.shape[:-1]
+
+        local = self.getJointTransforms(values)
+        count = batch[0] if batch else None
+        world = np.empty(batch + (self.getNumLinks(), 4, 4))
+        world[..., 0, :, :] = self.getBaseTransforms(positions, orientations, count)
+        for k in range(self.getNumJoints()):
+            world[..., k + 1, :, :] = np.matmul(world[..., k, :, :], local[..., k, :, :])
+
+        return world
@@ -55,6 +55,23 @@ class Matrix4(object):
         
         return Matrix4(((a, 0, 0, 0), (0, b, 0, 0), (0, 0, c, d), (0, 0, -1, 0)))
     
+    @staticmethod
+    def interpolate(a, b, alpha, rigid=False):
+        """Returns a matrix blended between a (alpha = 0) and b (alpha = 1). If
+        rigid is True, the orientation is orthonormalized after blending.
+        """
+        m = Matrix4([[a.data[i][j] + (b.data[i][j] - a.data[i][j]) * alpha
+                      for j in range(4)] for i in range(4)])
+        
+        if rigid:
+            x, y, z = m.basis()
+            z.normalize()
+            x = y.cross(z).normalize()
+            y = z.cross(x)
+            m.setOrientation(x, y, z)
+        
+        return m
+    
     def __init__(self, data=None):
         if not data:
             self.data = [[0] * i + [1] + [0] * (3 - i) for i in range(4)]
@@ -0,0 +1,360 @@
+import numpy as np
+
+# Triangle and vertex orders for Model (see Model.setOptimized). Models are
+# drawn from a triangle list, so every vertex of every triangle is shaded;
+# indexed, a vertex shared by neighbouring triangles is shaded once as long
+# as it is still in the GPU's post-transform cache. The passes below reorder
+# the triangles of each part for that cache (Tipsify, Sander et al. 2007),
+# then reorder clusters of them so outer surfaces tend to be drawn first
+# and hide what is behind them from the fragment shader, then number the
+# vertices in the order they are first used so they are fetched in order.
+
+def indexVertices(arrays):
+    """Turns triangle list vertex arrays (position, UV, normal, ...) into
+    indexed ones. Returns (arrays, indices, first): the unique vertices, in
+    order of first use, the index of every original vertex among them, and
+    the original vertex each unique one was first seen at.
+    """
+    numVertices = len(arrays[0])
+    if numVertices == 0:
+        return list(arrays), np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.intp)
+
+    # vertices are the same if all of their attributes are, bit for bit
+    rows = np.concatenate([a.reshape(numVertices, -1).view(np.uint8) for a in arrays], axis=1)
+    keys = np.ascontiguousarray(rows).view(np.dtype((np.void, rows.shape[1]))).ravel()
+    unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    order = np.argsort(first)
+    remap = np.empty(len(order), dtype=np.uint32)
+    remap[order] = np.arange(len(order), dtype=np.uint32)
+    first = first[order]
+
+    return [a[first] for a in arrays], remap[inverse.ravel()], first
+
+def analyzeVertexCache(indices, cacheSize=16):
+    """Returns (ACMR, ATVR) of drawing indices through a FIFO post-transform
+    cache of cacheSize vertices: vertices shaded per triangle (3 at worst,
+    about 0.5 at best) and per vertex used (1 is ideal).
+    """
+    if len(indices) == 0:
+        return 0.0, 0.0
+
+    # a vertex is cached if fewer than cacheSize misses happened since its own
+    stamps = {}
+    misses = 0
+    for v in indices.tolist():
+        stamp = stamps.get(v)
+        if stamp is None or misses - stamp >= cacheSize:
+            stamps[v] = misses
+            misses += 1
+
+    return misses / (len(indices) / 3.0), misses / float(len(stamps))
+
+def getAdjacency(indices, numVertices):
+    """Returns (offsets, triangles): the triangles using vertex v are
+    triangles[offsets[v]:offsets[v + 1]].
+    """
+    vertices = indices.astype(np.intp)
+    counts = np.bincount(vertices, minlength=numVertices)
+    offsets = np.zeros(numVertices + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    triangles = np.argsort(vertices, kind="stable") // 3
+
+    return offsets, triangles
+
+def optimizeVertexCache(indices, numVertices, cacheSize=16):
+    """Reorders the triangles for a post-transform cache of cacheSize
+    vertices with Tipsify: fans around one vertex at a time, moving on to a
+    vertex of the fan still in the cache with triangles left (the one that
+    has been in the longest without falling out), or back to a recent one
+    when the fan was a dead end. Returns (indices, clusters): the new
+    indices, and the first triangle of every run that starts with a jump
+    (an empty cache, as far as the order is concerned).
+    """
+    numTriangles = len(indices) // 3
+    if numTriangles == 0:
+        return indices.copy(), []
+
+    offsets, adjacency = getAdjacency(indices, numVertices)
+    offsets = offsets.tolist()
+    adjacency = adjacency.tolist()
+    triangles = indices.reshape(-1, 3).tolist()
+    live = np.bincount(indices.astype(np.intp), minlength=numVertices).tolist()
+    stamps = [0] * numVertices
+    emitted = [False] * numTriangles
+
+    order = []
+    clusters = [0]
+    deadEnd = []
+    time = cacheSize + 1
+    cursor = 0
+    fanning = int(indices[0])
+    while fanning >= 0:
+        candidates = []
+        for t in adjacency[offsets[fanning]:offsets[fanning + 1]]:
+            if emitted[t]:
+                continue
+            emitted[t] = True
+            order.append(t)
+            for v in triangles[t]:
+                deadEnd.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time - stamps[v] > cacheSize:
+                    stamps[v] = time
+                    time += 1
+
+        # the candidate still cached after its own fan, in the longest
+        fanning = -1
+        best = -1
+        for v in candidates:
+            if live[v] > 0:
+                age = time - stamps[v]
+                if age + 2 * live[v] <= cacheSize and age > best:
+                    best = age
+                    fanning = v
+        if fanning >= 0:
+            continue
+
+        while deadEnd and fanning < 0:
+            v = deadEnd.pop()
+            if live[v] > 0:
+                fanning = v
+        while cursor < numVertices and fanning < 0:
+            if live[cursor] > 0:
+                fanning = cursor
+            cursor += 1
+        if fanning >= 0 and len(order) < numTriangles:
+            clusters.append(len(order))
+
+    return indices.reshape(-1, 3)[order].ravel(), clusters
+
+def getSoftClusters(indices, clusters, cacheSize=16, threshold=1.05):
+    """Splits the clusters of optimizeVertexCache further wherever the ACMR
+    of a cluster so far is within threshold of the whole cluster's, so
+    overdraw has more to reorder at little cost to the cache.
+    """
+    numTriangles = len(indices) // 3
+    ends = clusters[1:] + [numTriangles]
+    soft = []
+    for start, end in zip(clusters, ends):
+        acmr = analyzeVertexCache(indices[start * 3:end * 3], cacheSize)[0]
+
+        soft.append(start)
+        stamps = {}
+        misses = 0
+        first = start
+        for t in range(start, end):
+            for v in indices[t * 3:t * 3 + 3].tolist():
+                stamp = stamps.get(v)
+                if stamp is None or misses - stamp >= cacheSize:
+                    stamps[v] = misses
+                    misses += 1
+            if t + 1 < end and misses / float(t + 1 - first) <= acmr * threshold:
+                soft.append(t + 1)
+                first = t + 1
+                stamps = {}
+                misses = 0
+
+    return soft
+
+def optimizeOverdraw(indices, positions, clusters, cacheSize=16, threshold=1.05):
+    """Reorders the clusters of a vertex cache optimized order (see
+    optimizeVertexCache, split with getSoftClusters) so clusters far out
+    from the mesh's center along their normal come first: they are the
+    most likely to be in front, from any direction, and their triangles
+    stay in order. positions are the (n, 3) float vertex positions.
+    """
+    numTriangles = len(indices) // 3
+    if numTriangles == 0:
+        return indices.copy()
+
+    clusters = getSoftClusters(indices, clusters, cacheSize, threshold)
+    corners = positions[indices.astype(np.intp)].reshape(-1, 3, 3).astype(np.float64)
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    areas = np.linalg.norm(normals, axis=1)
+    centroids = corners.mean(axis=1)
+    center = (centroids * areas[:, None]).sum(axis=0) / max(areas.sum(), 1e-30)
+
+    # area weighted sums per cluster (the normals' length is twice the area)
+    starts = np.array(clusters, dtype=np.intp)
+    clusterAreas = np.add.reduceat(areas, starts)
+    clusterCentroids = np.add.reduceat(centroids * areas[:, None], starts) / \
+        np.maximum(clusterAreas, 1e-30)[:, None]
+    clusterNormals = np.add.reduceat(normals, starts)
+    clusterNormals /= np.maximum(np.linalg.norm(clusterNormals, axis=1), 1e-30)[:, None]
+    keys = ((clusterCentroids - center) * clusterNormals).sum(axis=1)
+
+    ends = clusters[1:] + [numTriangles]
+    order = [t for c in np.argsort(-keys, kind="stable")
+             for t in range(clusters[c], ends[c])]
+
+    return indices.reshape(-1, 3)[order].ravel()
+
+def optimizeVertexFetch(indices, numVertices):
+    """Numbers the vertices in the order the indices first use them, so
+    they are read from memory in order. Returns (indices, order): the new
+    indices, and the old vertex of each new one (vertex arrays become
+    array[order]). Unused vertices are left out.
+    """
+    first = np.full(numVertices, len(indices), dtype=np.intp)
+    np.minimum.at(first, indices.astype(np.intp), np.arange(len(indices)))
+    order = np.argsort(first, kind="stable")[:len(np.unique(indices))]
+
+    remap = np.empty(numVertices, dtype=np.uint32)
+    remap[order] = np.arange(len(order), dtype=np.uint32)
+
+    return remap[indices], order
+
+def optimizeMesh(arrays, ranges, positions=None, cacheSize=16, threshold=1.05):
+    """Indexes triangle list vertex arrays (see indexVertices) and runs the
+    vertex cache, overdraw, and vertex fetch passes. Triangles stay within
+    their (first vertex, vertex count) range, e.g. a material of a part,
+    so ranges drawn separately are unchanged; the vertex numbers of the
+    ranges are the same as indices. positions are the float positions of
+    the vertices (by default arrays[0]), for the overdraw pass. Returns
+    (arrays, indices, report): the report has the triangle and vertex
+    counts and ACMR and ATVR before (the triangles as given, indexed) and
+    after.
+    """
+    if positions is None:
+        positions = arrays[0]
+    arrays, indices, first = indexVertices(arrays)
+    positions = positions[first]
+    numVertices = len(first)
+    acmr, atvr = analyzeVertexCache(indices, cacheSize)
+
+    optimized = indices.copy()
+    for start, count in ranges:
+        part = indices[start:start + count]
+        part, clusters = optimizeVertexCache(part, numVertices, cacheSize)
+        optimized[start:start + count] = optimizeOverdraw(part, positions, clusters,
+                                                          cacheSize, threshold)
+
+    optimized, order = optimizeVertexFetch(optimized, numVertices)
+    arrays = [a[order] for a in arrays]
+
+    report = {"triangles": len(indices) // 3, "vertices": len(indices),
+              "uniqueVertices": len(order), "acmrBefore": acmr, "atvrBefore": atvr}
+    report["acmr"], report["atvr"] = analyzeVertexCache(optimized, cacheSize)
+
+    return arrays, optimized, report
+
+compare_vsrc = b'''
+#version 400
+
+layout (location = 0) in vec3 VertexPosition;
+layout (location = 1) in vec2 UV;
+
+out vec2 texCoord;
+uniform mat4 modelview;
+uniform mat4 projection;
+
+void main()
+{
+    texCoord = UV;
+    gl_Position = projection * modelview * vec4(VertexPosition, 1.0);
+}
+'''
+
+compare_fsrc = b'''
+#version 400
+
+in vec2 texCoord;
+out vec4 FragColor;
+
+uniform sampler2D sampler;
+
+void main() {
+    FragColor = texture(sampler, texCoord);
+}
+'''
+
+def compare(file="boat.obj", textureFile="boat_diffuse.png", size=(512, 512), views=8,
+            repeats=20):
+    """Draws an .obj file as loaded and optimized from views directions
+    around it and prints the optimization report, the fragments that pass
+    the depth test per covered pixel (overdraw; fragments failing it are
+    rejected before shading), the draw time, and how much the images
+    differ. Runs offscreen (PYOPENGL_PLATFORM=egl).
+    """
+    import os
+    import time
+    from OpenGL import GL
+    from . import GLWindow, ShaderProgram, OBJReader, Matrix4
+
+    window = GLWindow(size, offscreen=os.environ.get("PYOPENGL_PLATFORM", "egl"))
+    GL.glViewport(0, 0, size[0], size[1])
+    GL.glEnable(GL.GL_DEPTH_TEST)
+    program = ShaderProgram.fromSource(compare_vsrc, compare_fsrc)
+    program.use()
+    query = int(GL.glGenQueries(1)[0])
+
+    results = []
+    for optimized in (False, True):
+        model = OBJReader.readFile(file)
+        model.setOptimized(optimized)
+        model.addDiffuseTexture(textureFile)
+        model.loadToVRAM()
+        if optimized:
+            report = model.getOptimizationReport()
+
+        positions = np.array(model.getOBJVertexList()).reshape(-1, 3)
+        center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+        radius = float(np.linalg.norm(positions.max(axis=0) - center))
+        projection = Matrix4.getPerspective(fovy=45, near=0.1 * radius,
+            far=5 * radius, aspect=size[0] / size[1])
+        GL.glUniformMatrix4fv(program.getUniformLocation("projection"), 1, False,
+            projection.getCType())
+
+        images = []
+        passed = covered = 0
+        drawTime = 0.0
+        for view in range(views):
+            modelview = (Matrix4.getTranslation(0, 0, -2.5 * radius) *
+                         Matrix4.getRotation(ax=30 * (-1) ** view, ay=360.0 * view / views) *
+                         Matrix4.getTranslation(*(-center)))
+            GL.glUniformMatrix4fv(program.getUniformLocation("modelview"), 1, False,
+                modelview.getCType())
+
+            GL.glClearColor(0.0, 0.0, 0.0, 0.0)
+            GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+            GL.glBeginQuery(GL.GL_SAMPLES_PASSED, query)
+            model.render()
+            GL.glEndQuery(GL.GL_SAMPLES_PASSED)
+            passed += int(GL.glGetQueryObjectuiv(query, GL.GL_QUERY_RESULT))
+
+            pixels = np.frombuffer(window.readPixels(), dtype=np.uint8)
+            image = pixels.reshape(size[1], size[0], 4).astype(np.int16)
+            covered += int((image[:, :, 3] > 0).sum())
+            images.append(image[:, :, :3])
+
+            GL.glFinish()
+            startTime = time.perf_counter()
+            for i in range(repeats):
+                GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+                model.render()
+            GL.glFinish()
+            drawTime += (time.perf_counter() - startTime) * 1000.0 / repeats
+
+        results.append((images, passed / max(covered, 1), drawTime / views))
+        model.cleanup()
+
+    GL.glDeleteQueries(1, [query])
+    program.cleanup()
+
+    print("Triangles: %d  vertices: %d unindexed, %d indexed" % (report["triangles"],
+          report["vertices"], report["uniqueVertices"]))
+    print("ACMR: %.3f -> %.3f  ATVR: %.3f -> %.3f  (as loaded, indexed -> optimized)" %
+          (report["acmrBefore"], report["acmr"], report["atvrBefore"], report["atvr"]))
+    print("Overdraw: %.3f -> %.3f fragments per pixel  draw: %.2f -> %.2f ms" %
+          (results[0][1], results[1][1], results[0][2], results[1][2]))
+
+    difference = np.abs(np.array(results[0][0]) - np.array(results[1][0])).max(axis=3)
+    print("Image difference: max %d/255  mean %.4f  pixels > 2/255: %d of %d" %
+          (difference.max(), difference.mean(), (difference > 2).sum(), difference.size))
+
+if __name__ == "__main__":
+    import sys
+
+    compare(*sys.argv[1:3])
@@ -2,20 +2,260 @@
 # BY: Andrew Holbrook
 # DATE: 9/24/2015
 
+import os
+import sys
+import copy
 import ctypes
+import weakref
+import numpy as np
 from OpenGL import GL
-from sdl2 import sdlimage
-from . import GLWindow, Vector4, Matrix4
+from . import GLWindow, Vector4, Matrix4, fitOBB, fitConvexHull, Image, decodeImage, parseOBJ, ShaderProgram
+from . import (quantizePositions, dequantizePositions, getPositionErrorBound,
+    quantizeUVs, dequantizeUVs, packNormals, unpackNormals, getNormalError)
+from . import optimizeMesh, buildMipmaps
+
+# (size, type, normalized) of the position, UV, and normal attributes
+FLOAT_FORMAT = ((3, GL.GL_FLOAT, False), (2, GL.GL_FLOAT, False), (3, GL.GL_FLOAT, False))
+
+def getMipmappedBytes(width, height, bytesPerPixel=4):
+    """Returns the bytes of a texture with every mipmap level.
+    """
+    total = 0
+    while True:
+        total += width * height * bytesPerPixel
+        if width == 1 and height == 1:
+            return total
+        width = max(1, width // 2)
+        height = max(1, height // 2)
+
+def getObjectBytes(data):
+    """Returns the bytes a list (counting each distinct element object once)
+    or NumPy array takes in the Python heap, or 0 for None.
+    """
+    if data is None:
+        return 0
+    if isinstance(data, np.ndarray):
+        return sys.getsizeof(data) + (0 if data.flags.owndata else data.nbytes)
+    
+    elements = {id(x): x for x in data}
+    
+    return sys.getsizeof(data) + sum(sys.getsizeof(x) for x in elements.values())
+
+def createTexture(image):
+    """Creates a mipmapped texture from an Image and returns it.
+    """
+    imgFormat = {'RGB': GL.GL_RGB, 'BGR': GL.GL_BGR, 'RGBA': GL.GL_RGBA,
+                 'BGRA': GL.GL_BGRA}[image.format]
+    
+    GL.glActiveTexture(GL.GL_TEXTURE0)
+    textureObject = GL.glGenTextures(1)
+    
+    GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+    GL.glBindTexture(GL.GL_TEXTURE_2D, textureObject)
+    GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, image.width,
+        image.height, 0, imgFormat, GL.GL_UNSIGNED_BYTE, image.pixels)
+    
+    GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+    GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+    
+    GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+    
+    return textureObject
+
+def createTextureSteps(mipmaps, chunkBytes=None):
+    """Generator that creates a texture from every mipmap level of an image
+    (see buildMipmaps) and returns it, yielding the number of bytes uploaded
+    by each step. With chunkBytes, at most that many bytes of rows are
+    uploaded per step (or as many as are sent to it, see Model.uploadSteps),
+    and None is yielded before allocating the levels. The texture is deleted
+    if the generator is closed before it is done.
+    """
+    imgFormat = {'RGB': GL.GL_RGB, 'BGR': GL.GL_BGR, 'RGBA': GL.GL_RGBA,
+                 'BGRA': GL.GL_BGRA}[mipmaps[0].format]
+    
+    numBytes = getMipmappedBytes(mipmaps[0].width, mipmaps[0].height)
+    if chunkBytes is not None and numBytes > chunkBytes:
+        yield None
+    
+    # every level is allocated at once, which takes a while for large ones
+    textureObject = GL.glGenTextures(1)
+    try:
+        GL.glBindTexture(GL.GL_TEXTURE_2D, textureObject)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAX_LEVEL, len(mipmaps) - 1)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        if bool(GL.glTexStorage2D):
+            GL.glTexStorage2D(GL.GL_TEXTURE_2D, len(mipmaps), GL.GL_RGBA8,
+                mipmaps[0].width, mipmaps[0].height)
+        else:
+            for level, image in enumerate(mipmaps):
+                GL.glTexImage2D(GL.GL_TEXTURE_2D, level, GL.GL_RGBA8, image.width,
+                    image.height, 0, imgFormat, GL.GL_UNSIGNED_BYTE, None)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        size = yield 0
+        
+        for level, image in enumerate(mipmaps):
+            rowBytes = len(image.pixels) // image.height
+            y = 0
+            while y < image.height:
+                numRows = image.height - y
+                if chunkBytes is not None:
+                    numRows = min(numRows, max(1, (size or chunkBytes) // rowBytes))
+                GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+                GL.glBindTexture(GL.GL_TEXTURE_2D, textureObject)
+                GL.glTexSubImage2D(GL.GL_TEXTURE_2D, level, 0, y, image.width, numRows,
+                    imgFormat, GL.GL_UNSIGNED_BYTE,
+                    image.pixels[y * rowBytes : (y + numRows) * rowBytes])
+                GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+                y += numRows
+                size = yield numRows * rowBytes
+    except GeneratorExit:
+        GL.glDeleteTextures(1, [textureObject])
+        raise
+    
+    return textureObject
+
+class TextureCache(object):
+    """The textures of materials, by file name, so a file used by several
+    materials (or models) is only loaded once. Textures are deleted when the
+    last material using them is released.
+    """
+    instance = None
+    
+    @staticmethod
+    def getInstance():
+        if not TextureCache.instance:
+            TextureCache.instance = TextureCache()
+        
+        return TextureCache.instance
+    
+    def __init__(self):
+        # file name: [textureObject, number of users, bytes]
+        self.textures = {}
+        self.whiteTexture = None
+        self.numLoads = 0
+    
+    def contains(self, file):
+        return file in self.textures
+    
+    def acquire(self, file, image=None):
+        """Returns the texture of an image file, creating it the first time
+        from image (the decoded file) if given, or else from the file.
+        """
+        entry = self.textures.get(file)
+        if entry is None:
+            image = image or decodeImage(file)
+            entry = [createTexture(image), 0, getMipmappedBytes(image.width, image.height)]
+            self.textures[file] = entry
+            self.numLoads += 1
+        
+        entry[1] += 1
+        
+        return entry[0]
+    
+    def add(self, file, textureObject, numBytes):
+        """Adds a texture made from an image file elsewhere (see
+        createTextureSteps), with no users yet. If the file was loaded
+        meanwhile, textureObject is deleted and the loaded one is kept.
+        """
+        if file in self.textures:
+            GL.glDeleteTextures(1, [textureObject])
+            return
+        
+        self.textures[file] = [textureObject, 0, numBytes]
+        self.numLoads += 1
+    
+    def release(self, file):
+        entry = self.textures[file]
+        entry[1] -= 1
+        if entry[1] == 0:
+            GL.glDeleteTextures(1, [entry[0]])
+            del self.textures[file]
+    
+    def getTextureBytes(self, file):
+        return self.textures[file][2] if file in self.textures else 0
+    
+    def getTotalBytes(self):
+        return sum(entry[2] for entry in self.textures.values())
+    
+    def getWhiteTexture(self):
+        """Returns a 1x1 white texture, for materials with only a color.
+        """
+        if self.whiteTexture is None:
+            self.whiteTexture = createTexture(Image(1, 1, 'RGBA', b'\xff' * 4))
+        
+        return self.whiteTexture
 
 class Model(object):
     """Class for representing a Wavefront OBJ object.
     """
+    # what happens to the vertex data in Python once it is uploaded (see
+    # setResidency)
+    KEEP = 0
+    COMPACT = 1
+    DROP = 2
+    
+    # every model alive, for getTotalMemoryUsage
+    instances = weakref.WeakSet()
+    
     def __init__(self):
         self.parts = []
         self.normals = []
         self.num_indices = 0
         self.textureObject = None
+        self.textureBytes = 0
+        self.vertexArrayObject = None
+        self.positionBuffer = None
+        self.uvBuffer = None
+        self.normalBuffer = None
+        self.indexBuffer = None
+        self.indexType = None
+        self.vertexData = None
+        self.indexData = None
+        
+        # (material, first vertex, vertex count) sorted by material, for the
+        # whole model and for each part by name
+        self.batches = []
+        self.partRanges = {}
+        self.materials = []
+        # file name: decoded mipmap levels (or just the image), see
+        # prepareVertexData
+        self.materialImages = {}
+        
+        # see setQuantized
+        self.quantized = False
+        self.maxQuantizationError = None
+        self.vertexFormat = FLOAT_FORMAT
+        self.dequantizeMatrix = None
+        self.quantizationReport = None
+        
+        # see setOptimized and setStatic
+        self.optimized = False
+        self.static = False
+        self.optimizationReport = None
+        
+        # the .obj file read again when dropped data is needed
+        self.residency = Model.KEEP
+        self.sourceFile = None
+        self.geometryDropped = False
+        self.bufferBytes = 0
+        
+        # the model whose GL objects this one draws (see createInstance)
+        self.instanceOf = None
+        
         self.modelMatrix = Matrix4()
+        self.previousModelMatrix = None
+        self.collisionShapes = {}
+        
+        # (minimum, maximum) corners in model coordinates, see getBounds
+        self.bounds = None
+        
+        Model.instances.add(self)
     
     def __str__(self):
         return str(self.num_indices)
@@ -23,6 +263,89 @@ class Model(object):
     def setPosition(self, pos):
         self.modelMatrix.setPosition(pos)
     
+    def storePreviousState(self):
+        """Keeps a copy of the model matrix before an update, for blending.
+        """
+        self.previousModelMatrix = Matrix4(self.modelMatrix.data)
+    
+    def getState(self):
+        """Returns copies of (modelMatrix, previousModelMatrix).
+        """
+        previous = self.previousModelMatrix
+        return (Matrix4(self.modelMatrix.data),
+                Matrix4(previous.data) if previous is not None else None)
+    
+    def getModelMatrix(self, alpha=1.0, state=None):
+        """Returns the model matrix blended between its state before the last
+        update (alpha = 0) and its current state (alpha = 1). state, from
+        getState, is used instead of the current state if given.
+        """
+        modelMatrix, previousModelMatrix = state or (self.modelMatrix, self.previousModelMatrix)
+        if alpha >= 1.0 or previousModelMatrix is None:
+            return modelMatrix
+        
+        return Matrix4.interpolate(previousModelMatrix, modelMatrix, alpha)
+    
+    def setQuantized(self, quantized=True, maxError=None):
+        """Uploads the vertices in compact formats (16 bytes per vertex instead
+        of 32, see the quantize module) when quantized is True. Positions are
+        stored within the model's bounding box, so getDequantizeMatrix must
+        be applied after the model matrix; they stay floats if that would be
+        off by more than maxError (in model units). Must be set before
+        loadToVRAM.
+        """
+        self.quantized = quantized
+        self.maxQuantizationError = maxError
+    
+    def getDequantizeMatrix(self):
+        """Returns the matrix from quantized positions to model coordinates,
+        or None if positions are floats.
+        """
+        return self.dequantizeMatrix
+    
+    def getQuantizationReport(self):
+        """Returns, once the vertex data is prepared, a dictionary of the
+        vertex count, the bytes the vertices take as floats and as uploaded,
+        and the largest position and UV errors (None where kept as floats)
+        and normal error (degrees).
+        """
+        return self.quantizationReport
+    
+    def setOptimized(self, optimized=True):
+        """Uploads the vertices indexed, with the triangles of every part
+        reordered for the post-transform vertex cache and for less overdraw
+        and the vertices for fetch locality (see the meshopt module), when
+        optimized is True. Must be set before loadToVRAM.
+        """
+        self.optimized = optimized
+    
+    def setStatic(self, static=True):
+        """Marks the model as never moving, so a Scene with static batching
+        draws it merged with the other static models (see StaticBatch). Its
+        model matrix is only read when it is added to the scene.
+        """
+        self.static = static
+    
+    def getOptimizationReport(self):
+        """Returns, once the vertex data is prepared, a dictionary of the
+        triangle count, the vertex count unindexed and indexed, and the
+        ACMR and ATVR of the triangles as loaded (acmrBefore, atvrBefore)
+        and as uploaded (acmr, atvr).
+        """
+        return self.optimizationReport
+    
+    def getBounds(self):
+        """Returns the (minimum, maximum) corners of the model's bounding box
+        in model coordinates, or None if it has no vertices. Kept once the
+        vertex data is prepared, so it survives releaseGeometry.
+        """
+        if self.bounds is None:
+            positions = np.array(self.getOBJVertexList(), dtype=np.float64).reshape(-1, 3)
+            if len(positions):
+                self.bounds = (positions.min(axis=0), positions.max(axis=0))
+        
+        return self.bounds
+    
     def getNumParts(self):
         return len(self.parts)
     
@@ -30,19 +353,22 @@ class Model(object):
         return self.num_indices
     
     def getNumNormals(self):
+        self.restoreGeometry()
         return len(self.normals)
     
     def getOBJVertexList(self):
+        self.restoreGeometry()
         objVertexList = []
         for p in self.parts:
-            objVertexList += p.vertices
+            objVertexList.extend(p.vertices)
         
         return objVertexList
     
     def getOBJUVList(self):
+        self.restoreGeometry()
         objUVList = []
         for p in self.parts:
-            objUVList += p.uvs
+            objUVList.extend(p.uvs)
         
         return objUVList
     
@@ -65,20 +391,23 @@ class Model(object):
         return uvList
     
     def getIndexList(self):
+        self.restoreGeometry()
         tmpList = []
         for p in self.parts:
-            tmpList += p.indices
+            tmpList.extend(p.indices)
         
         return tmpList
     
     def getUVIndexList(self):
+        self.restoreGeometry()
         tmpList = []
         for p in self.parts:
-            tmpList += p.uvIndices
+            tmpList.extend(p.uvIndices)
         
         return tmpList
     
     def getNormalList(self):
+        self.restoreGeometry()
         return self.normals
     
     def generateNormals(self):
@@ -96,94 +425,395 @@ class Model(object):
         self.parts.append(p)
         self.num_indices += p.getNumIndices()
     
+    def buildCollisionShapes(self, hull=False):
+        """Fits a collision shape (an OrientedBox, or a ConvexHull if hull is
+        True) to the vertices of each part, keyed by part name.
+        """
+        self.restoreGeometry()
+        self.collisionShapes = {}
+        for p in self.parts:
+            if len(p.vertices) < 3:
+                continue
+            
+            if hull:
+                self.collisionShapes[p.name] = fitConvexHull(p.vertices)
+            else:
+                self.collisionShapes[p.name] = fitOBB(p.vertices)
+    
     def addDiffuseTexture(self, textureImage):
-        GL.glActiveTexture(GL.GL_TEXTURE0)
-        self.textureObject = GL.glGenTextures(1)
-        
-        surface = sdlimage.IMG_Load(bytes(textureImage, 'UTF-8'))
-        pixels = ctypes.cast(surface.contents.pixels, ctypes.c_void_p)
-        width = surface.contents.w
-        height = surface.contents.h
-        
-        bmask = surface.contents.format.contents.Bmask
+        """Creates the diffuse texture from an image file, or from an Image
+        that was already decoded (see AssetPreloader).
+        """
+        if not isinstance(textureImage, Image):
+            textureImage = decodeImage(textureImage)
+        
+        self.textureObject = createTexture(textureImage)
+        self.textureBytes = getMipmappedBytes(textureImage.width, textureImage.height)
+    
+    def setResidency(self, residency, sourceFile=None):
+        """Sets what is done with the vertex data kept in Python (the parts'
+        lists and the normals) once the model is uploaded: KEEP it, COMPACT
+        it into NumPy arrays, or DROP it. Dropped data is read again from
+        sourceFile (by default the file the model was read from) the next
+        time it is needed, e.g. by getVertexList; models not read from a file
+        are compacted instead.
+        """
+        self.residency = residency
+        if sourceFile is not None:
+            self.sourceFile = sourceFile
+    
+    def releaseGeometry(self):
+        """Applies the residency policy to the vertex data.
+        """
+        if self.residency == Model.DROP and self.sourceFile:
+            for p in self.parts:
+                p.drop()
+            self.normals = []
+            self.geometryDropped = True
+        elif self.residency != Model.KEEP:
+            for p in self.parts:
+                p.compact()
+            self.normals = np.array(self.normals, dtype=np.float32)
+    
+    def restoreGeometry(self):
+        """Reads dropped vertex data back from the source file.
+        """
+        if not self.geometryDropped:
+            return
+        
+        self.geometryDropped = False
+        for p, (name, vertices, uvs, indices, uvIndices, materials) in zip(self.parts,
+                parseOBJ(self.sourceFile)):
+            p.vertices = vertices
+            p.uvs = uvs
+            p.indices = indices
+            p.uvIndices = uvIndices
+        self.generateNormals()
+    
+    def getMemoryUsage(self):
+        """Returns the bytes the model takes as a dictionary: 'cpu' (its
+        vertex data in Python), 'gpu' (its buffers and textures), 'parts' (a
+        dictionary of {'cpu': bytes, 'gpu': bytes} by part name) and
+        'textures' (a dictionary of bytes by texture: 'diffuse' for the
+        model's own texture, otherwise the file of a material's texture,
+        which may be shared with other models).
+        """
+        vertexBytes = self.bufferBytes / max(self.num_indices, 1)
+        parts = {}
+        for p in self.parts:
+            ranges = self.partRanges.get(p.name, [])
+            parts[p.name] = {"cpu": p.getMemoryUsage(),
+                             "gpu": int(sum(r[2] for r in ranges) * vertexBytes)}
         
-        imgFormat = GL.GL_RGBA
-        if bmask == 255:
-            imgFormat = GL.GL_BGRA
+        textures = {}
+        if self.textureObject is not None:
+            textures["diffuse"] = self.textureBytes
+        cache = TextureCache.getInstance()
+        for material in self.materials:
+            if material is not None and material.textureObject is not None:
+                textures[material.diffuseTexture] = cache.getTextureBytes(material.diffuseTexture)
         
-        GL.glBindTexture(GL.GL_TEXTURE_2D, self.textureObject)
-        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGBA, width, height, 0,
-            imgFormat, GL.GL_UNSIGNED_BYTE, pixels)
+        cpu = sum(part["cpu"] for part in parts.values()) + getObjectBytes(self.normals)
         
-        GL.glGenerateMipmap(GL.GL_TEXTURE_2D)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
-        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        return {"cpu": cpu, "gpu": self.bufferBytes + sum(textures.values()),
+                "parts": parts, "textures": textures}
+    
+    @staticmethod
+    def getTotalMemoryUsage():
+        """Returns the bytes taken by every model alive, as a dictionary:
+        'cpu' and 'gpu' (counting textures shared by materials once),
+        'textures' (the material textures, which are included in 'gpu'), and
+        'process', the resident size of the whole process (None where it is
+        not known).
+        """
+        cpu = 0
+        gpu = 0
+        for model in list(Model.instances):
+            usage = model.getMemoryUsage()
+            cpu += usage["cpu"]
+            gpu += model.bufferBytes + usage["textures"].get("diffuse", 0)
+        textures = TextureCache.getInstance().getTotalBytes()
+        
+        process = None
+        try:
+            with open("/proc/self/statm") as fp:
+                process = int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            pass
+        
+        return {"cpu": cpu, "gpu": gpu + textures, "textures": textures,
+                "process": process}
+    
+    def createInstance(self):
+        """Returns a model that draws this (uploaded) model's GL objects with
+        its own model matrix, for many copies of one model. Cleaning up an
+        instance does nothing; the original owns the GL objects.
+        """
+        instance = copy.copy(self)
+        instance.instanceOf = self
+        instance.modelMatrix = Matrix4(self.modelMatrix.data)
+        instance.previousModelMatrix = None
         
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+        return instance
     
     def cleanup(self):
+        if self.instanceOf is not None:
+            return
+        
         if self.textureObject != None:
             GL.glDeleteTextures(1, self.textureObject)
-        GL.glDeleteBuffers(1, self.positionBuffer)
-        GL.glDeleteVertexArrays(1, self.vertexArrayObject)
+        for buffer in (self.positionBuffer, self.uvBuffer, self.normalBuffer, self.indexBuffer):
+            if buffer != None:
+                GL.glDeleteBuffers(1, buffer)
+        if self.vertexArrayObject != None:
+            GL.glDeleteVertexArrays(1, self.vertexArrayObject)
+        
+        self.textureObject = None
+        self.textureBytes = 0
+        self.positionBuffer = self.uvBuffer = self.normalBuffer = self.indexBuffer = None
+        self.vertexArrayObject = None
+        self.bufferBytes = 0
+        
+        cache = TextureCache.getInstance()
+        for material in self.materials:
+            if material is not None and material.textureObject is not None:
+                cache.release(material.diffuseTexture)
+                material.textureObject = None
+    
+    def prepareVertexData(self, withMipmaps=False):
+        """Builds the position, UV, and normal arrays uploaded by loadToVRAM,
+        with the triangles sorted by material, and decodes the material
+        textures not loaded yet, building their mipmap levels too if
+        withMipmaps (for uploadSteps with chunkBytes). No GL context is
+        needed, so this can run on a worker thread.
+        """
+        self.generateNormals()
+        arrays = (np.array(self.getVertexList(), dtype=np.float32).reshape(-1, 3),
+                  np.array(self.getUVList(), dtype=np.float32).reshape(-1, 2),
+                  np.array(self.normals, dtype=np.float32).reshape(-1, 3))
+        
+        if len(arrays[0]):
+            self.bounds = (arrays[0].min(axis=0).astype(np.float64),
+                           arrays[0].max(axis=0).astype(np.float64))
+        
+        order = self.sortByMaterial()
+        arrays = [a[order] if len(a) == len(order) else a for a in arrays]
+        positions = arrays[0]
+        if self.quantized:
+            arrays = self.quantizeVertexData(arrays)
+        
+        # the triangles are reordered within each part's material ranges
+        self.indexData = None
+        if self.optimized and len(positions) == len(order):
+            ranges = sorted((first, count) for partRanges in self.partRanges.values()
+                            for material, first, count in partRanges)
+            arrays, indices, self.optimizationReport = optimizeMesh(arrays, ranges, positions)
+            self.indexData = indices.astype(np.uint16 if len(arrays[0]) <= 65536 else np.uint32)
+        self.vertexData = tuple(a.ravel() for a in arrays)
+        
+        cache = TextureCache.getInstance()
+        self.materialImages = {}
+        for material in self.materials:
+            file = material.diffuseTexture if material is not None else None
+            if file and not cache.contains(file) and file not in self.materialImages:
+                image = decodeImage(file)
+                self.materialImages[file] = buildMipmaps(image) if withMipmaps else [image]
+    
+    def quantizeVertexData(self, arrays):
+        """Returns the position, UV, and normal arrays in compact formats
+        (keeping any that can't be stored within bounds as floats), and sets
+        vertexFormat, dequantizeMatrix, and quantizationReport.
+        """
+        positions, uvs, normals = arrays
+        floatBytes = sum(a.nbytes for a in arrays)
+        vertexFormat = list(FLOAT_FORMAT)
+        
+        self.dequantizeMatrix = None
+        positionError = getPositionErrorBound(positions)
+        if self.maxQuantizationError is None or positionError <= self.maxQuantizationError:
+            positions, minimum, extent = quantizePositions(positions)
+            vertexFormat[0] = (4, GL.GL_UNSIGNED_SHORT, True)
+            self.dequantizeMatrix = (Matrix4.getTranslation(*minimum) *
+                                     Matrix4.getScale(*extent))
+            positionError = float(np.abs(dequantizePositions(positions,
+                minimum, extent) - arrays[0]).max(initial=0.0))
+        else:
+            positionError = None
+        
+        uvError = None
+        quantizedUVs = quantizeUVs(uvs)
+        if quantizedUVs is not None:
+            uvError = float(np.abs(dequantizeUVs(quantizedUVs) - uvs).max(initial=0.0))
+            uvs = quantizedUVs
+            vertexFormat[1] = (2, GL.GL_UNSIGNED_SHORT, True)
+        
+        packedNormals = packNormals(normals)
+        normalError = getNormalError(normals, unpackNormals(packedNormals))
+        normals = packedNormals
+        vertexFormat[2] = (4, GL.GL_INT_2_10_10_10_REV, True)
+        
+        self.vertexFormat = tuple(vertexFormat)
+        self.quantizationReport = {"vertices": len(arrays[0]), "floatBytes": floatBytes,
+            "bytes": positions.nbytes + uvs.nbytes + normals.nbytes,
+            "positionError": positionError, "uvError": uvError,
+            "normalError": normalError}
+        
+        return [positions, uvs, normals]
+    
+    def sortByMaterial(self):
+        """Groups the triangles of every part by material (in order of first
+        use), keeping the parts in order within each material, and fills in
+        batches and partRanges. Returns the new order of the vertices.
+        """
+        self.materials = []
+        ranges = []
+        first = 0
+        for i, p in enumerate(self.parts):
+            for material, start, count in p.getMaterialRanges():
+                if material not in self.materials:
+                    self.materials.append(material)
+                ranges.append((self.materials.index(material), i, material, first + start, count))
+            first += p.getNumIndices()
+        ranges.sort(key=lambda r: r[:2])
+        
+        self.batches = []
+        self.partRanges = {}
+        offset = 0
+        for key, i, material, start, count in ranges:
+            partRanges = self.partRanges.setdefault(self.parts[i].name, [])
+            for batches in (self.batches, partRanges):
+                if batches and batches[-1][0] is material:
+                    batches[-1][2] += count
+                else:
+                    batches.append([material, offset, count])
+            offset += count
+        
+        if not ranges:
+            return np.zeros(0, dtype=np.intp)
+        
+        return np.concatenate([np.arange(r[3], r[3] + r[4]) for r in ranges])
     
     def loadToVRAM(self):
         """Create the OpenGL objects for rendering this model.
         """
+        for uploaded in self.uploadSteps():
+            pass
+    
+    def uploadSteps(self, chunkBytes=None):
+        """Generator that creates the OpenGL objects for rendering this model
+        one step at a time, yielding the number of bytes uploaded by each. With
+        chunkBytes, the buffers are filled at most that many bytes per step,
+        so the upload can be spread over several frames (see AssetStreamer).
+        A byte count sent to the generator limits its next step instead, and
+        None is yielded before allocating anything larger than chunkBytes,
+        which is a single call that may take a while. Material textures are
+        uploaded the same way, from the mipmap levels built by
+        prepareVertexData, and only added to the TextureCache once complete.
+        """
+        if self.vertexData is None:
+            self.prepareVertexData(chunkBytes is not None)
         
         # Create vertex array object to encapsulate the state needed to provide
         # vertex information.
         self.vertexArrayObject = GL.glGenVertexArrays(1)
-        GL.glBindVertexArray(self.vertexArrayObject)
-        
-        # postition vertex buffer object
-        self.positionBuffer = GL.glGenBuffers(1)
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.positionBuffer)
-        
-        # read and copy vertex data to VRAM
-        vertexList = self.getVertexList()
-        c_vertexArray = ctypes.c_float * len(vertexList)
-        c_vertexArray = c_vertexArray(*vertexList)
-        del vertexList
-        
-        GL.glBufferData(GL.GL_ARRAY_BUFFER, c_vertexArray, GL.GL_STATIC_DRAW)
-        del c_vertexArray
-        
-        # position data is associated with location 0
-        GL.glVertexAttribPointer(0, 3, GL.GL_FLOAT, False, 0, None)
-        
-        self.uvBuffer = GL.glGenBuffers(1)
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.uvBuffer)
-        
-        uvList = self.getUVList()
-        uv = ctypes.c_float * len(uvList)
-        uv = uv(*uvList)
-        del uvList
-        
-        GL.glBufferData(GL.GL_ARRAY_BUFFER, uv, GL.GL_STATIC_DRAW)
-        del uv
-        
-        GL.glVertexAttribPointer(1, 2, GL.GL_FLOAT, False, 0, None)
-        
-        self.generateNormals()
-        
-        self.normalBuffer = GL.glGenBuffers(1)
-        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.normalBuffer)
-        
-        c_normalArray = ctypes.c_float * len(self.normals)
-        c_normalArray = c_normalArray(*self.normals)
-        GL.glBufferData(GL.GL_ARRAY_BUFFER, c_normalArray, GL.GL_STATIC_DRAW)
-        del c_normalArray
-        
-        GL.glVertexAttribPointer(2, 3, GL.GL_FLOAT, False, 0, None)
-        
-        GL.glEnableVertexAttribArray(0)
-        GL.glEnableVertexAttribArray(1)
-        GL.glEnableVertexAttribArray(2)
-        
-        GL.glBindVertexArray(0)
+        self.bufferBytes = 0
+        
+        # positions at location 0, UVs at 1, and normals at 2
+        names = ("positionBuffer", "uvBuffer", "normalBuffer")
+        attributes = zip(names, self.vertexFormat, self.vertexData)
+        for location, (name, (size, dataType, normalized), data) in enumerate(attributes):
+            buffer = GL.glGenBuffers(1)
+            setattr(self, name, buffer)
+            self.bufferBytes += data.nbytes
+            yield from self.bufferUploadSteps(GL.GL_ARRAY_BUFFER, buffer, data, chunkBytes)
+            
+            GL.glBindVertexArray(self.vertexArrayObject)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, buffer)
+            GL.glVertexAttribPointer(location, size, dataType, normalized, 0, None)
+            GL.glEnableVertexAttribArray(location)
+            GL.glBindVertexArray(0)
+        
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        self.vertexData = None
+        
+        if self.indexData is not None:
+            data = self.indexData
+            self.indexBuffer = GL.glGenBuffers(1)
+            self.indexType = GL.GL_UNSIGNED_SHORT if data.itemsize == 2 else GL.GL_UNSIGNED_INT
+            self.bufferBytes += data.nbytes
+            
+            yield from self.bufferUploadSteps(GL.GL_ELEMENT_ARRAY_BUFFER,
+                self.indexBuffer, data, chunkBytes)
+            self.indexData = None
+        
+        # each texture file is only loaded by the first material using it
+        cache = TextureCache.getInstance()
+        for material in self.materials:
+            if material is None or not material.diffuseTexture:
+                continue
+            
+            file = material.diffuseTexture
+            levels = self.materialImages.get(file)
+            if chunkBytes is not None and levels and not cache.contains(file):
+                if len(levels) == 1:
+                    levels = buildMipmaps(levels[0])
+                textureObject = yield from createTextureSteps(levels, chunkBytes)
+                cache.add(file, textureObject, getMipmappedBytes(levels[0].width, levels[0].height))
+                material.textureObject = cache.acquire(file)
+            else:
+                loaded = bool(levels) and not cache.contains(file)
+                material.textureObject = cache.acquire(file, levels[0] if levels else None)
+                yield len(levels[0].pixels) if loaded else 0
+        self.materialImages = {}
+        
+        self.releaseGeometry()
+    
+    def bufferUploadSteps(self, target, buffer, data, chunkBytes=None):
+        """Generator that fills a buffer with data, in one step without
+        chunkBytes (see uploadSteps), yielding the bytes uploaded by each.
+        """
+        def bind():
+            # the element buffer binding is part of the vertex array's state
+            if target == GL.GL_ELEMENT_ARRAY_BUFFER:
+                GL.glBindVertexArray(self.vertexArrayObject)
+            GL.glBindBuffer(target, buffer)
+        
+        def unbind():
+            if target == GL.GL_ELEMENT_ARRAY_BUFFER:
+                GL.glBindVertexArray(0)
+        
+        if chunkBytes is None:
+            bind()
+            GL.glBufferData(target, data, GL.GL_STATIC_DRAW)
+            unbind()
+            yield data.nbytes
+            return
+        
+        if data.nbytes > chunkBytes:
+            yield None
+        bind()
+        GL.glBufferData(target, data.nbytes, None, GL.GL_STATIC_DRAW)
+        unbind()
+        size = yield 0
+        
+        raw = data.view(np.uint8)
+        offset = 0
+        while offset < len(raw):
+            # other code may have bound buffers since the last step
+            chunk = raw[offset : offset + (size or chunkBytes)]
+            bind()
+            GL.glBufferSubData(target, offset, len(chunk), chunk)
+            unbind()
+            offset += len(chunk)
+            size = yield len(chunk)
+    
+    def textureUploadSteps(self, mipmaps, chunkBytes=None):
+        """Generator that creates the diffuse texture from every mipmap level
+        of an image (see buildMipmaps), yielding the number of bytes uploaded
+        by each step (see createTextureSteps).
+        """
+        self.textureBytes = getMipmappedBytes(mipmaps[0].width, mipmaps[0].height)
+        self.textureObject = yield from createTextureSteps(mipmaps, chunkBytes)
     
     def update(self, dtime):
         pass
@@ -192,46 +822,53 @@ class Model(object):
         self.renderAllParts()
     
     def renderPartByIndex(self, index):
-        GL.glBindVertexArray(self.vertexArrayObject)
-        
-        if self.textureObject != None:
-            GL.glBindTexture(GL.GL_TEXTURE_2D, self.textureObject)
-        
-        offset = 0
-        for i in range(0, index):
-            offset += self.parts[i].getNumIndices()
-        
-        c_offset = ctypes.c_void_p(offset * ctypes.sizeof(ctypes.c_uint))
-        GL.glDrawElements(GL.GL_TRIANGLES, self.parts[index].getNumIndices(), GL.GL_UNSIGNED_INT, c_offset)
-        
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
-        GL.glBindVertexArray(0)
+        self.renderBatches(self.partRanges.get(self.parts[index].name, []))
         
     def renderPartByName(self, name):
-        GL.glBindVertexArray(self.vertexArrayObject)
-        
-        if self.textureObject != None:
-            GL.glBindTexture(GL.GL_TEXTURE_2D, self.textureObject)
-        
-        offset = 0
-        for p in self.parts:
-            if p.name == name:
-                c_offset = ctypes.c_void_p(offset * ctypes.sizeof(ctypes.c_uint))
-                GL.glDrawElements(GL.GL_TRIANGLES, p.getNumIndices(), GL.GL_UNSIGNED_INT, c_offset)
-                break
-            
-            offset += p.getNumIndices()
-        
-        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
-        GL.glBindVertexArray(0)
+        self.renderBatches(self.partRanges.get(name, []))
     
     def renderAllParts(self):
-        GL.glBindVertexArray(self.vertexArrayObject)
+        self.renderBatches(self.batches)
+    
+    def getTexture(self, material):
+        """Returns the texture to draw a material with: its own, a white one
+        if it only has a color, or the model's diffuse texture if material is
+        None (white if the model has none either).
+        """
+        if material is None and self.textureObject is not None:
+            return self.textureObject
+        if material is None or material.textureObject is None:
+            return TextureCache.getInstance().getWhiteTexture()
+        
+        return material.textureObject
+    
+    def renderBatches(self, batches):
+        """Draws (material, first vertex, vertex count) batches (first index
+        and index count when indexed), binding each material's texture and
+        setting the diffuseColor uniform of the program in use (if it has
+        one) to its color.
+        """
+        program = ShaderProgram.current
+        color_loc = program.getUniformLocation("diffuseColor") if program else -1
         
-        if self.textureObject != None:
-            GL.glBindTexture(GL.GL_TEXTURE_2D, self.textureObject)
+        GL.glBindVertexArray(self.vertexArrayObject)
         
-        GL.glDrawArrays(GL.GL_TRIANGLES, 0, self.getNumIndices())
+        boundTexture = None
+        for material, first, count in batches:
+            texture = self.getTexture(material)
+            if texture != boundTexture:
+                GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+                boundTexture = texture
+            
+            if color_loc != -1:
+                color = material.getColor() if material else (1.0, 1.0, 1.0, 1.0)
+                GL.glUniform4f(color_loc, *color)
+            
+            if self.indexBuffer is not None:
+                GL.glDrawElements(GL.GL_TRIANGLES, count, self.indexType,
+                    ctypes.c_void_p(first * (2 if self.indexType == GL.GL_UNSIGNED_SHORT else 4)))
+            else:
+                GL.glDrawArrays(GL.GL_TRIANGLES, first, count)
         
         GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
         
@@ -261,13 +898,46 @@ class ModelPart(object):
         self.indices = []
         self.uvs = []
         self.uvIndices = []
+        
+        # (Material, first index) where each usemtl starts
+        self.materials = []
+        
+        # len(indices) while the lists are dropped
+        self.numDroppedIndices = 0
     
     def getNumIndices(self):
+        if self.indices is None:
+            return self.numDroppedIndices
+        
         return len(self.indices)
     
     def getNumUVIndices(self):
         return len(self.uvIndices)
     
+    def compact(self):
+        """Replaces the lists with NumPy arrays (float32 vertices and UVs,
+        int32 indices), a fraction of the size of lists of Python numbers.
+        """
+        if self.vertices is None:
+            return
+        
+        self.vertices = np.array(self.vertices, dtype=np.float32)
+        self.uvs = np.array(self.uvs, dtype=np.float32)
+        self.indices = np.array(self.indices, dtype=np.int32)
+        self.uvIndices = np.array(self.uvIndices, dtype=np.int32)
+    
+    def drop(self):
+        """Releases the lists (see Model.restoreGeometry).
+        """
+        self.numDroppedIndices = self.getNumIndices()
+        self.vertices = self.uvs = self.indices = self.uvIndices = None
+    
+    def getMemoryUsage(self):
+        """Returns the bytes the part's lists (or arrays) take.
+        """
+        return sum(getObjectBytes(data) for data in
+                   (self.vertices, self.uvs, self.indices, self.uvIndices))
+    
     def setName(self, name):
         self.name = name
     
@@ -294,6 +964,28 @@ class ModelPart(object):
     
     def addUVIndices(self, uvIndices):
         self.uvIndices += uvIndices
+    
+    def addMaterial(self, material, first):
+        """Uses material (a Material, or None) from index first on.
+        """
+        self.materials.append((material, first))
+    
+    def getMaterialRanges(self):
+        """Returns (material, first index, index count) for each run of
+        indices using one material, None where no material was set.
+        """
+        starts = list(self.materials)
+        if not starts or starts[0][1] > 0:
+            starts.insert(0, (None, 0))
+        
+        ends = [first for material, first in starts[1:]] + [len(self.indices)]
+        
+        ranges = []
+        for (material, first), end in zip(starts, ends):
+            if end > first:
+                ranges.append((material, first, end - first))
+        
+        return ranges
 
 class OBJReader(object):
     
@@ -301,39 +993,26 @@ class OBJReader(object):
     def readFile(file):
         """Reads an .obj file and returns the data as a Model object.
         """
+        return OBJReader.buildModel(parseOBJ(file), file)
+    
+    @staticmethod
+    def buildModel(parts, file=None):
+        """Returns a Model made of the parts returned by parseOBJ, from file
+        if given (see Model.setResidency).
+        """
         model = Model()
-        currentPart = None
-        
-        fp = open(file)
-        
-        for line in fp:
-            if line[0:2] == 'v ':
-                verts = line.split()
-                for i in range(1, len(verts)):
-                    currentPart.addVertex(float(verts[i]))
-            elif line[0:2] == 'vt':
-                uvs = line.split()
-                for i in range(1, len(uvs)):
-                    currentPart.addUV(float(uvs[i]))
-            elif line[0] == 'f':
-                indices = line.split()
-                for i in range(1, len(indices)):
-                    tmpIndex = indices[i].split('/')
-                    currentPart.addIndex(int(tmpIndex[0]) - 1)
-                    if len(tmpIndex) > 1:
-                        currentPart.addUVIndex(int(tmpIndex[1]) - 1)
-            elif line[0] == 'o':
-                if currentPart == None:
-                    currentPart = ModelPart()
-                else:
-                    model.addPart(currentPart)
-                    currentPart = ModelPart()
-                
-                currentPart.setName(line.split()[1])
-                
-        fp.close()
-        
-        if currentPart != None:
-            model.addPart(currentPart)
-        
-        return model
\ No newline at end of file
+        model.sourceFile = file
+        for name, vertices, uvs, indices, uvIndices, materials in parts:
+            part = ModelPart()
+            part.setName(name)
+            part.addVertices(vertices)
+            part.addUVS(uvs)
+            part.addIndices(indices)
+            part.addUVIndices(uvIndices)
+            for material, first in materials:
+                part.addMaterial(material, first)
+            model.addPart(part)
+        
+        model.buildCollisionShapes()
+        
+        return model
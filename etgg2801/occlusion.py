@@ -0,0 +1,331 @@
+import time
+import numpy as np
+
+# the corners of a bounding box, as which of (minimum, maximum) to take for
+# x, y, and z
+BOX_CORNERS = np.array([[x, y, z] for x in (0, 1) for y in (0, 1) for z in (0, 1)], dtype=bool)
+
+def getTriangles(model):
+    """Returns a model's triangles, (n, 3, 3), in model coordinates.
+    """
+    return np.array(model.getVertexList(), dtype=np.float64).reshape(-1, 3, 3)
+
+def selectOccluderTriangles(triangles, maxTriangles=512):
+    """Returns the maxTriangles largest triangles. Any subset of a mesh's
+    triangles hides no more than the mesh does, so this trades how much an
+    occluder hides for how long it takes to rasterize, and the small
+    triangles dropped would mostly miss every pixel center anyway.
+    """
+    if maxTriangles is None or len(triangles) <= maxTriangles:
+        return triangles
+
+    areas = np.linalg.norm(np.cross(triangles[:, 1] - triangles[:, 0],
+                                    triangles[:, 2] - triangles[:, 0]), axis=1)
+
+    return triangles[np.argsort(areas)[-maxTriangles:]]
+
+def clipTriangles(triangles):
+    """Clips (n, 3, 4) clip space triangles against the near plane (z >= -w)
+    and returns the (m, 3, 4) triangles in front of it: one vertex behind
+    leaves a quad (two triangles), two behind leave a smaller triangle.
+    """
+    distances = triangles[:, :, 2] + triangles[:, :, 3]
+    inside = distances >= 0
+    if inside.all():
+        return triangles
+    numInside = inside.sum(axis=1)
+
+    result = [triangles[numInside == 3]]
+
+    # rotate each triangle so the vertex that differs from the others comes first
+    for count in (2, 1):
+        selected = numInside == count
+        if not selected.any():
+            continue
+        tris = triangles[selected]
+        dist = distances[selected]
+        first = np.argmax(inside[selected] if count == 1 else ~inside[selected], axis=1)
+        order = (first[:, None] + np.arange(3)) % 3
+        tris = np.take_along_axis(tris, order[:, :, None], axis=1)
+        dist = np.take_along_axis(dist, order, axis=1)
+
+        a, b, c = tris[:, 0], tris[:, 1], tris[:, 2]
+        ab = a + (b - a) * (dist[:, 0] / (dist[:, 0] - dist[:, 1]))[:, None]
+        ac = a + (c - a) * (dist[:, 0] / (dist[:, 0] - dist[:, 2]))[:, None]
+        if count == 1:
+            result.append(np.stack([a, ab, ac], axis=1))
+        else:
+            result.append(np.stack([ab, b, c], axis=1))
+            result.append(np.stack([ab, c, ac], axis=1))
+
+    return np.concatenate(result)
+
+def rasterizeTriangles(depth, triangles):
+    """Rasterizes (n, 3, 3) screen space triangles (x and y in pixels, z the
+    depth in [0, 1]) into depth, keeping the nearest depth at every pixel
+    center a triangle covers, in either winding. Every row of every triangle
+    gets its span of pixels from the triangle's edges, and the spans are
+    expanded into pixels, so the work is proportional to the pixels covered
+    (not to the triangles' bounding boxes) and done in a few array
+    operations however many triangles there are.
+    """
+    height, width = depth.shape
+
+    # (3, n) arrays of the vertices' x, y, and z, without the triangles
+    # that are degenerate or miss every row or column of pixel centers
+    x, y, z = np.ascontiguousarray(triangles.transpose(2, 1, 0))
+    area = (x[1] - x[0]) * (y[2] - y[0]) - (x[2] - x[0]) * (y[1] - y[0])
+    bottom = np.maximum(np.ceil(y.min(axis=0) - 0.5), 0)
+    top = np.minimum(np.floor(y.max(axis=0) - 0.5), height - 1)
+    keep = ((top >= bottom) & (np.abs(area) > 1e-12) &
+            (x.max(axis=0) >= 0.5) & (x.min(axis=0) <= width - 0.5))
+    x, y, z, area = x[:, keep], y[:, keep], z[:, keep], area[keep]
+    bottom = bottom[keep].astype(np.int64)
+    top = top[keep].astype(np.int64)
+
+    # edges (A x + B y + C >= 0 inside) and the depth plane of each triangle
+    sign = np.sign(area)
+    A = (y - np.roll(y, -1, axis=0)) * sign
+    B = (np.roll(x, -1, axis=0) - x) * sign
+    C = -(A * x + B * y)
+    zx = -((y[1] - y[0]) * (z[2] - z[0]) - (y[2] - y[0]) * (z[1] - z[0])) / area
+    zy = -((z[1] - z[0]) * (x[2] - x[0]) - (z[2] - z[0]) * (x[1] - x[0])) / area
+    zc = z[0] - zx * x[0] - zy * y[0]
+
+    # the rows of pixel centers each triangle spans
+    numRows = top - bottom + 1
+    tri = np.repeat(np.arange(len(area)), numRows)
+    row = bottom[tri] + np.arange(len(tri)) - np.repeat(np.cumsum(numRows) - numRows, numRows)
+    cy = row + 0.5
+
+    # each row's span, with a little slack so centers on an edge shared by
+    # two triangles aren't missed by both to rounding
+    low = np.full(len(tri), 0.5)
+    high = np.full(len(tri), width - 0.5)
+    empty = np.zeros(len(tri), dtype=bool)
+    for edge in range(3):
+        a = A[edge, tri]
+        rest = B[edge, tri] * cy + C[edge, tri]
+        bound = -rest / np.where(a != 0, a, 1.0)
+        low = np.where(a > 0, np.maximum(low, bound), low)
+        high = np.where(a < 0, np.minimum(high, bound), high)
+        empty |= (a == 0) & (rest < 0)
+    first = np.ceil(low - 0.5 - 1e-7).astype(np.int64)
+    count = np.where(empty, 0, np.maximum(np.floor(high - 0.5 + 1e-7).astype(np.int64) - first + 1, 0))
+
+    span = np.repeat(np.arange(len(tri)), count)
+    px = first[span] + np.arange(len(span)) - np.repeat(np.cumsum(count) - count, count)
+    py = row[span]
+    t = tri[span]
+    values = zc[t] + zx[t] * (px + 0.5) + zy[t] * (py + 0.5)
+    np.minimum.at(depth.reshape(-1), py * width + px, values)
+
+def buildPyramid(depth):
+    """Returns the hierarchical depth levels of depth (whose sides are
+    powers of two): each level keeps the farthest depth of 2x2 texels of the
+    one before, down to a single texel.
+    """
+    levels = [depth]
+    while levels[-1].shape != (1, 1):
+        level = levels[-1]
+        height, width = level.shape
+        level = level.reshape(max(height // 2, 1), min(height, 2),
+                              max(width // 2, 1), min(width, 2))
+        levels.append(level.max(axis=(1, 3)))
+
+    return levels
+
+class OcclusionCuller(object):
+    """Software occlusion culling for Scene.render: designated occluders
+    (large meshes such as the ground or hulls) are rasterized on the CPU
+    into a small depth buffer each frame, reduced to a hierarchical depth
+    pyramid, and every object's projected bounding box is tested against it
+    before it is drawn. Objects entirely outside the view are culled too.
+
+    Depth is sampled at pixel centers, so an occluder can hide up to a
+    pixel more than it covers at its silhouette; keep the resolution at a
+    few hundred pixels across or more.
+    """
+    def __init__(self, size=(256, 128), maxTriangles=256):
+        """size (powers of two) is the resolution of the depth buffer;
+        maxTriangles is the most triangles kept of each occluder mesh (see
+        selectOccluderTriangles).
+        """
+        self.size = size
+        self.maxTriangles = maxTriangles
+        self.occluders = []
+        self.triangles = {}
+        self.depth = np.ones((size[1], size[0]))
+        self.levels = buildPyramid(self.depth)
+
+        self.numFrames = 0
+        self.lastFrame = None
+        self.totals = {"tested": 0, "occluded": 0, "outside": 0, "triangles": 0,
+                       "rasterize": 0.0, "test": 0.0}
+
+    def addOccluder(self, o, triangles=None):
+        """Rasterizes o's triangles (or the given (n, 3, 3) triangles in o's
+        model coordinates) every frame. Instances of a model (see
+        Model.createInstance) share its triangles.
+        """
+        source = o.instanceOf or o
+        if triangles is not None:
+            self.triangles[source] = np.asarray(triangles, dtype=np.float64)
+        elif source not in self.triangles:
+            self.triangles[source] = selectOccluderTriangles(getTriangles(source),
+                                                             self.maxTriangles)
+        self.occluders.append(o)
+
+    def removeOccluder(self, o):
+        self.occluders.remove(o)
+
+    def rasterizeOccluders(self, viewProjection, matrices):
+        """Clears the depth buffer, rasterizes the front faces of every
+        occluder (placed by matrices, by occluder; back faces are culled as
+        GL culls them), and rebuilds the pyramid. Returns the number of
+        triangles rasterized.
+        """
+        width, height = self.size
+        self.depth.fill(1.0)
+
+        # the instances of each mesh are transformed together
+        placed = {}
+        for o in self.occluders:
+            placed.setdefault(o.instanceOf or o, []).append(matrices[o].data)
+        clip = []
+        for source, modelMatrices in placed.items():
+            mvps = viewProjection @ np.array(modelMatrices)
+            vertices = self.triangles[source].reshape(-1, 3)
+            clip.append((vertices @ mvps[:, :, :3].transpose(0, 2, 1) +
+                         mvps[:, None, :, 3]).reshape(-1, 3, 4))
+
+        numTriangles = 0
+        if clip:
+            triangles = clipTriangles(np.concatenate(clip))
+            screen = triangles[:, :, :3] / triangles[:, :, 3:]
+            screen = (screen * 0.5 + 0.5) * np.array([width, height, 1.0])
+            x, y = screen[:, :, 0], screen[:, :, 1]
+            frontFacing = ((x[:, 1] - x[:, 0]) * (y[:, 2] - y[:, 0]) -
+                           (x[:, 2] - x[:, 0]) * (y[:, 1] - y[:, 0])) > 0
+            rasterizeTriangles(self.depth, screen[frontFacing])
+            numTriangles = int(frontFacing.sum())
+
+        self.levels = buildPyramid(self.depth)
+
+        return numTriangles
+
+    def testBoxes(self, minimums, maximums, mvps):
+        """Tests (n, 3) bounding boxes placed by (n, 4, 4) model view
+        projection matrices against the pyramid. Returns (visible, outside):
+        whether each box may be visible, and whether it is outside the view.
+        """
+        width, height = self.size
+        corners = np.where(BOX_CORNERS[None], maximums[:, None], minimums[:, None])
+        clip = np.einsum('nij,nkj->nki', mvps[:, :, :3], corners) + mvps[:, None, :, 3]
+
+        # boxes reaching behind the camera are kept
+        behind = (clip[:, :, 3] <= 1e-6).any(axis=1)
+        clip[behind, :, 3] = 1.0
+        ndc = clip[:, :, :3] / clip[:, :, 3:]
+        low = ndc.min(axis=1)
+        high = ndc.max(axis=1)
+
+        outside = ~behind & ((high[:, 0] < -1) | (low[:, 0] > 1) |
+                             (high[:, 1] < -1) | (low[:, 1] > 1) | (low[:, 2] > 1))
+
+        # the texels covering the box's screen rectangle at the level where
+        # it spans at most 2x2 of them
+        x0 = np.clip((low[:, 0] * 0.5 + 0.5) * width, 0, width)
+        x1 = np.clip((high[:, 0] * 0.5 + 0.5) * width, 0, width)
+        y0 = np.clip((low[:, 1] * 0.5 + 0.5) * height, 0, height)
+        y1 = np.clip((high[:, 1] * 0.5 + 0.5) * height, 0, height)
+        extent = np.maximum(np.maximum(x1 - x0, y1 - y0), 1.0)
+        level = np.minimum(np.ceil(np.log2(extent)).astype(np.int64), len(self.levels) - 1)
+
+        farthest = np.zeros(len(minimums))
+        for i, depth in enumerate(self.levels):
+            selected = np.nonzero(level == i)[0]
+            if not len(selected):
+                continue
+            levelHeight, levelWidth = depth.shape
+            scale = 2.0 ** i
+            tx0 = np.minimum((x0[selected] / scale).astype(np.int64), levelWidth - 1)
+            tx1 = np.clip(np.ceil(x1[selected] / scale).astype(np.int64) - 1, tx0, tx0 + 1)
+            ty0 = np.minimum((y0[selected] / scale).astype(np.int64), levelHeight - 1)
+            ty1 = np.clip(np.ceil(y1[selected] / scale).astype(np.int64) - 1, ty0, ty0 + 1)
+            tx1 = np.minimum(tx1, levelWidth - 1)
+            ty1 = np.minimum(ty1, levelHeight - 1)
+            farthest[selected] = np.maximum.reduce([depth[ty0, tx0], depth[ty0, tx1],
+                                                    depth[ty1, tx0], depth[ty1, tx1]])
+
+        nearest = low[:, 2] * 0.5 + 0.5
+        occluded = ~behind & ~outside & (nearest > farthest)
+
+        return ~(occluded | outside), outside
+
+    def cull(self, objects, modelMatrices, viewMatrix, projMatrix):
+        """Returns whether each of objects (placed by modelMatrices) may be
+        visible from viewMatrix with projMatrix. Occluders are tested too
+        (a box can't be hidden by the mesh inside it); objects without bounds
+        are always drawn.
+        """
+        startTime = time.perf_counter()
+        viewProjection = np.array((projMatrix * viewMatrix).data)
+        matrices = dict(zip(objects, modelMatrices))
+        for o in self.occluders:
+            matrices.setdefault(o, o.modelMatrix)
+        numTriangles = self.rasterizeOccluders(viewProjection, matrices)
+        rasterizeTime = time.perf_counter()
+
+        visible = [True] * len(objects)
+        tested = [i for i, o in enumerate(objects) if o.getBounds() is not None]
+
+        numOccluded = numOutside = 0
+        if tested:
+            bounds = [objects[i].getBounds() for i in tested]
+            mvps = viewProjection @ np.array([modelMatrices[i].data for i in tested])
+            inView, outside = self.testBoxes(np.array([b[0] for b in bounds]),
+                                             np.array([b[1] for b in bounds]), mvps)
+            for i, v in zip(tested, inView):
+                visible[i] = bool(v)
+            numOutside = int(outside.sum())
+            numOccluded = int((~inView).sum()) - numOutside
+        endTime = time.perf_counter()
+
+        self.lastFrame = {"tested": len(tested), "occluded": numOccluded,
+                          "outside": numOutside, "triangles": numTriangles,
+                          "rasterize": (rasterizeTime - startTime) * 1000.0,
+                          "test": (endTime - rasterizeTime) * 1000.0}
+        for name, value in self.lastFrame.items():
+            self.totals[name] += value
+        self.numFrames += 1
+
+        return visible
+
+    def getStats(self):
+        """Returns per frame averages since the last reset: objects tested,
+        the ratios of them occluded and outside the view, occluder triangles
+        rasterized, and the CPU time (ms) of rasterizing, testing, and both.
+        """
+        frames = max(self.numFrames, 1)
+        tested = max(self.totals["tested"], 1)
+        return {"frames": self.numFrames,
+                "tested": self.totals["tested"] / frames,
+                "occludedRatio": self.totals["occluded"] / tested,
+                "outsideRatio": self.totals["outside"] / tested,
+                "triangles": self.totals["triangles"] / frames,
+                "rasterize": self.totals["rasterize"] / frames,
+                "test": self.totals["test"] / frames,
+                "cpu": (self.totals["rasterize"] + self.totals["test"]) / frames}
+
+    def printSummary(self):
+        stats = self.getStats()
+        print("Occlusion: %.1f objects tested/frame  occluded %.1f%%  outside %.1f%%  "
+              "%d triangles  rasterize %.2f  test %.2f  total %.2f ms/frame" %
+              (stats["tested"], 100.0 * stats["occludedRatio"], 100.0 * stats["outsideRatio"],
+               stats["triangles"], stats["rasterize"], stats["test"], stats["cpu"]))
+
+    def reset(self):
+        self.numFrames = 0
+        for name in self.totals:
+            self.totals[name] = 0
@@ -0,0 +1,215 @@
+import json
+import numpy as np
+import sdl2
+from . import GLCallCounter
+
+class FrameProfiler(object):
+    """Records how long each phase of GLWindow.mainLoop takes, per frame, in
+    a preallocated ring buffer of the last capacity frames. Times are taken
+    from SDL's high resolution performance counter and stored in ms.
+    """
+    EVENTS = 0
+    UPDATE = 1
+    UPDATE_MAX = 2
+    RENDER = 3
+    SWAP = 4
+    FRAME = 5
+    STEPS = 6
+    LATENCY = 7
+    STREAM = 8
+    CAPTURE = 9
+    GL_COUNTS = 10
+    COLUMNS = ("events", "update", "update_max", "render", "swap", "frame",
+               "steps", "latency", "stream", "capture") + GLCallCounter.COLUMNS
+
+    def __init__(self, capacity=4096, printPeriod=0, glAccounting=False):
+        """printPeriod (ms), when non-zero, prints a summary of the recent
+        frames that often. glAccounting installs a GLCallCounter whose counts
+        are recorded with each frame.
+        """
+        self.glCounter = None
+        if glAccounting:
+            self.glCounter = GLCallCounter()
+            self.glCounter.install()
+
+        self.capacity = capacity
+        self.samples = np.zeros((capacity, len(FrameProfiler.COLUMNS)))
+        self.index = 0
+        self.count = 0
+
+        self.frequency = float(sdl2.SDL_GetPerformanceFrequency())
+        self.scale = 1000.0 / self.frequency
+        self.printPeriod = printPeriod
+        self.printDelay = printPeriod
+        self.printFrames = 0
+
+        self.row = self.samples[0]
+        self.frameStart = 0
+        self.lastMark = 0
+
+    def beginFrame(self):
+        self.row = self.samples[self.index]
+        self.row[:] = 0
+        self.frameStart = sdl2.SDL_GetPerformanceCounter()
+        self.lastMark = self.frameStart
+
+    def endPhase(self, phase):
+        """Adds the time since the previous mark to a phase.
+        """
+        now = sdl2.SDL_GetPerformanceCounter()
+        self.row[phase] += (now - self.lastMark) * self.scale
+        self.lastMark = now
+
+    def endStep(self):
+        """Ends one fixed-step update.
+        """
+        now = sdl2.SDL_GetPerformanceCounter()
+        elapsed = (now - self.lastMark) * self.scale
+        row = self.row
+        row[FrameProfiler.UPDATE] += elapsed
+        row[FrameProfiler.STEPS] += 1
+        if elapsed > row[FrameProfiler.UPDATE_MAX]:
+            row[FrameProfiler.UPDATE_MAX] = elapsed
+        self.lastMark = now
+
+    def addUpdates(self, steps, time, maxTime):
+        """Records updates run elsewhere (on GLWindow's update thread) during
+        the frame: how many, their total time, and the longest (ms).
+        """
+        row = self.row
+        row[FrameProfiler.STEPS] += steps
+        row[FrameProfiler.UPDATE] += time
+        row[FrameProfiler.UPDATE_MAX] = max(row[FrameProfiler.UPDATE_MAX], maxTime)
+    
+    def setValue(self, column, value):
+        self.row[column] = value
+    
+    def endFrame(self):
+        frameTime = (sdl2.SDL_GetPerformanceCounter() - self.frameStart) * self.scale
+        self.row[FrameProfiler.FRAME] = frameTime
+
+        if self.glCounter:
+            self.row[FrameProfiler.GL_COUNTS:] = self.glCounter.counts
+            self.glCounter.reset()
+
+        self.index = (self.index + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+        if self.printPeriod:
+            self.printDelay -= frameTime
+            self.printFrames += 1
+            if self.printDelay <= 0:
+                self.printSummary(self.printFrames)
+                self.printDelay = self.printPeriod
+                self.printFrames = 0
+
+    def getSamples(self):
+        """Returns the recorded frames, oldest first, as a (count, columns)
+        array.
+        """
+        if self.count < self.capacity:
+            return self.samples[:self.count].copy()
+
+        return np.roll(self.samples, -self.index, axis=0)
+
+    def getStats(self, numFrames=None):
+        """Returns a dictionary of statistics over the recorded frames (or the
+        last numFrames): p50/p95/p99/max/mean of every phase in ms, frames
+        per second, and update steps per frame and per second. Frames without
+        a latency measurement are left out of its statistics.
+        """
+        samples = self.getSamples()
+        if numFrames:
+            samples = samples[-numFrames:]
+
+        stats = {"frames": len(samples)}
+        if len(samples) == 0:
+            return stats
+
+        for column, name in enumerate(FrameProfiler.COLUMNS):
+            if column == FrameProfiler.STEPS:
+                continue
+            values = samples[:, column]
+            if column == FrameProfiler.LATENCY:
+                values = values[values > 0]
+                if len(values) == 0:
+                    continue
+            p50, p95, p99 = np.percentile(values, (50, 95, 99))
+            stats[name] = {"p50": p50, "p95": p95, "p99": p99,
+                           "max": values.max(), "mean": values.mean()}
+
+        steps = samples[:, FrameProfiler.STEPS]
+        totalTime = max(samples[:, FrameProfiler.FRAME].sum(), 1e-9)
+        stats["steps_per_frame"] = {"mean": steps.mean(), "max": steps.max()}
+        stats["steps_per_second"] = 1000.0 * steps.sum() / totalTime
+        stats["fps"] = 1000.0 * len(samples) / totalTime
+
+        return stats
+
+    def getHistogram(self, column=FRAME, bins=50):
+        """Returns (counts, binEdges) of a column's times (ms).
+        """
+        return np.histogram(self.getSamples()[:, column], bins=bins)
+
+    def printSummary(self, numFrames=None):
+        """Prints the frame rate, frame time percentiles, steps per frame,
+        update throughput, and input latency of the recorded frames (or the
+        last numFrames).
+        """
+        stats = self.getStats(numFrames)
+        if stats["frames"] == 0:
+            return
+        frame = stats["frame"]
+
+        print("FPS: %.1f  frame p50 %.2f  p95 %.2f  p99 %.2f  max %.2f ms  steps/frame %.2f" %
+              (stats["fps"], frame["p50"], frame["p95"], frame["p99"], frame["max"],
+               stats["steps_per_frame"]["mean"]))
+        
+        if "latency" in stats:
+            latency = stats["latency"]
+            print("Updates/s: %.1f  update p95 %.2f ms  input latency p50 %.2f  p95 %.2f  max %.2f ms" %
+                  (stats["steps_per_second"], stats["update"]["p95"], latency["p50"],
+                   latency["p95"], latency["max"]))
+        
+        if stats["stream"]["max"] > 0:
+            stream = stats["stream"]
+            print("Stream uploads: p50 %.2f  p95 %.2f  max %.2f ms" %
+                  (stream["p50"], stream["p95"], stream["max"]))
+        
+        if stats["capture"]["max"] > 0:
+            capture = stats["capture"]
+            print("Frame capture: p50 %.2f  p95 %.2f  max %.2f ms" %
+                  (capture["p50"], capture["p95"], capture["max"]))
+
+        if self.glCounter:
+            print("GL/frame: %.1f calls  %.1f draws  %.1f binds  %.1f state  %.1f uniforms  %.0f buffer bytes  %.0f texture bytes" %
+                  tuple(stats[name]["mean"] for name in ("gl_calls", "draws", "binds",
+                        "state", "uniforms", "buffer_bytes", "texture_bytes")))
+
+    def writeCSV(self, file):
+        """Writes one line per recorded frame, oldest first.
+        """
+        np.savetxt(file, self.getSamples(), delimiter=",", fmt="%.6f",
+            header=",".join(FrameProfiler.COLUMNS), comments="")
+
+    def writeJSON(self, file):
+        """Writes the statistics and the recorded frames.
+        """
+        samples = self.getSamples()
+        data = {"stats": self.getStats(),
+                "columns": list(FrameProfiler.COLUMNS),
+                "samples": samples.tolist()}
+
+        with open(file, "w") as fp:
+            json.dump(data, fp, indent=1, default=float)
+
+    def reset(self):
+        self.index = 0
+        self.count = 0
+
+    def close(self):
+        """Removes the GL call accounting, if installed.
+        """
+        if self.glCounter:
+            self.glCounter.uninstall()
+            self.glCounter = None
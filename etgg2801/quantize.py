@@ -0,0 +1,183 @@
+import numpy as np
+
+# Compact vertex formats for Model (see Model.setQuantized): positions as
+# 16 bit unsigned normalized integers within the model's bounding box (the
+# box is applied by Model.getDequantizeMatrix), UVs as 16 bit unsigned
+# normalized integers, and normals as 10 bit signed normalized integers
+# packed with GL_INT_2_10_10_10_REV. GL converts them back to floats when
+# reading the attributes, so the shaders are unchanged.
+
+def quantizePositions(positions):
+    """Returns (quantized, minimum, extent) for an (n, 3) array: quantized
+    is (n, 4) uint16 (the 4th component is padding, to keep vertices 4 byte
+    aligned) and position = minimum + quantized / 65535 * extent.
+    """
+    if len(positions) == 0:
+        return np.zeros((0, 4), dtype=np.uint16), np.zeros(3), np.ones(3)
+
+    minimum = positions.min(axis=0).astype(np.float64)
+    extent = positions.max(axis=0) - minimum
+    extent[extent == 0] = 1.0
+
+    quantized = np.zeros((len(positions), 4), dtype=np.uint16)
+    quantized[:, :3] = np.rint((positions - minimum) / extent * 65535.0)
+
+    return quantized, minimum, extent
+
+def dequantizePositions(quantized, minimum, extent):
+    return minimum + quantized[:, :3] / 65535.0 * extent
+
+def getPositionErrorBound(positions):
+    """Returns the largest error quantizePositions can make along any axis:
+    half a step of the largest side of the bounding box.
+    """
+    if len(positions) == 0:
+        return 0.0
+
+    return float((positions.max(axis=0) - positions.min(axis=0)).max()) / 65535.0 / 2
+
+def quantizeUVs(uvs):
+    """Returns (n, 2) uint16 UVs, or None if any is outside [0, 1] (UVs
+    that repeat the texture can't be stored as unsigned normalized values).
+    """
+    if len(uvs) and (uvs.min() < 0.0 or uvs.max() > 1.0):
+        return None
+
+    return np.rint(uvs * 65535.0).astype(np.uint16)
+
+def dequantizeUVs(quantized):
+    return quantized / 65535.0
+
+def packNormals(normals):
+    """Packs (n, 3) unit normals into n uint32 values for
+    GL_INT_2_10_10_10_REV: x in bits 0-9, y in 10-19, z in 20-29.
+    """
+    components = np.rint(np.clip(normals, -1.0, 1.0) * 511.0).astype(np.int32) & 0x3FF
+
+    return (components[:, 0] | (components[:, 1] << 10) |
+            (components[:, 2] << 20)).astype(np.uint32)
+
+def unpackNormals(packed):
+    components = np.stack([(packed >> shift) & 0x3FF for shift in (0, 10, 20)], axis=1)
+    components = components.astype(np.int32)
+    components[components >= 512] -= 1024
+
+    return np.maximum(components / 511.0, -1.0)
+
+def getNormalError(normals, decoded):
+    """Returns the largest angle in degrees between normals and the decoded
+    normals (once renormalized, as the shaders do).
+    """
+    if len(normals) == 0:
+        return 0.0
+
+    lengths = np.linalg.norm(decoded, axis=1) * np.linalg.norm(normals, axis=1)
+    lengths[lengths == 0] = 1.0
+    cosines = np.clip((normals * decoded).sum(axis=1) / lengths, -1.0, 1.0)
+
+    return float(np.degrees(np.arccos(cosines)).max())
+
+compare_vsrc = b'''
+#version 400
+
+layout (location = 0) in vec3 VertexPosition;
+layout (location = 1) in vec2 UV;
+layout (location = 2) in vec3 VertexNormal;
+
+out vec3 normal;
+out vec2 texCoord;
+uniform mat4 modelview;
+uniform mat4 model;
+uniform mat4 projection;
+
+void main()
+{
+    normal = (model * vec4(VertexNormal, 0.0)).xyz;
+    texCoord = UV;
+    gl_Position = projection * modelview * vec4(VertexPosition, 1.0);
+}
+'''
+
+compare_fsrc = b'''
+#version 400
+
+in vec3 normal;
+in vec2 texCoord;
+out vec4 FragColor;
+
+uniform sampler2D sampler;
+
+void main() {
+    float light = 0.3 + 0.7 * abs(dot(normalize(normal), normalize(vec3(1.0, 2.0, 3.0))));
+    FragColor = vec4(texture(sampler, texCoord).rgb * light, 1.0);
+}
+'''
+
+def compare(file="boat.obj", textureFile="boat_diffuse.png", size=(512, 512), maxError=None):
+    """Renders an .obj file with float and with quantized vertices, lit so
+    normal errors show, and prints the quantization report and how much the
+    two images differ. Runs offscreen (PYOPENGL_PLATFORM=egl).
+    """
+    import os
+    from OpenGL import GL
+    from . import GLWindow, ShaderProgram, OBJReader, Matrix4
+
+    window = GLWindow(size, offscreen=os.environ.get("PYOPENGL_PLATFORM", "egl"))
+    GL.glViewport(0, 0, size[0], size[1])
+    GL.glEnable(GL.GL_DEPTH_TEST)
+    program = ShaderProgram.fromSource(compare_vsrc, compare_fsrc)
+    program.use()
+
+    images = []
+    for quantized in (False, True):
+        model = OBJReader.readFile(file)
+        model.setQuantized(quantized, maxError)
+        model.addDiffuseTexture(textureFile)
+        model.loadToVRAM()
+        if quantized:
+            report = model.getQuantizationReport()
+
+        # the whole model in view, from above and to the side
+        positions = np.array(model.getOBJVertexList()).reshape(-1, 3)
+        center = (positions.min(axis=0) + positions.max(axis=0)) / 2
+        radius = float(np.linalg.norm(positions.max(axis=0) - center))
+        view = (Matrix4.getTranslation(0, 0, -2.5 * radius) *
+                Matrix4.getRotation(ax=30, ay=-40) *
+                Matrix4.getTranslation(*(-center)))
+        projection = Matrix4.getPerspective(fovy=45, near=0.1 * radius,
+            far=5 * radius, aspect=size[0] / size[1])
+
+        GL.glClearColor(0.0, 0.0, 0.0, 1.0)
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+        GL.glUniformMatrix4fv(program.getUniformLocation("projection"), 1, False,
+            projection.getCType())
+        GL.glUniformMatrix4fv(program.getUniformLocation("model"), 1, False,
+            model.modelMatrix.getCType())
+        modelview = view * model.modelMatrix
+        if model.getDequantizeMatrix() is not None:
+            modelview = modelview * model.getDequantizeMatrix()
+        GL.glUniformMatrix4fv(program.getUniformLocation("modelview"), 1, False,
+            modelview.getCType())
+        model.render()
+
+        pixels = np.frombuffer(window.readPixels(), dtype=np.uint8)
+        images.append(pixels.reshape(size[1], size[0], 4)[:, :, :3].astype(np.int16))
+        model.cleanup()
+
+    program.cleanup()
+
+    print("Vertices: %d  float: %d bytes  quantized: %d bytes  saved: %d bytes (%.0f%%)" %
+          (report["vertices"], report["floatBytes"], report["bytes"],
+           report["floatBytes"] - report["bytes"],
+           100.0 * (1 - report["bytes"] / max(report["floatBytes"], 1))))
+    print("Position error: %s  UV error: %s  normal error: %.3f deg" %
+          ("%.6f" % report["positionError"] if report["positionError"] is not None else "float",
+           "%.6f" % report["uvError"] if report["uvError"] is not None else "float",
+           report["normalError"]))
+
+    difference = np.abs(images[0] - images[1]).max(axis=2)
+    print("Image difference: max %d/255  mean %.4f  pixels > 2/255: %d of %d" %
+          (difference.max(), difference.mean(), (difference > 2).sum(), difference.size))
+
+if __name__ == "__main__":
+    compare()
@@ -0,0 +1,235 @@
+import struct
+import zlib
+import numpy as np
+
+# Trajectory log layout (little endian):
+#   header:  magic, version, flags, numJoints, chunkFrames, timeStep
+#   chunks:  firstFrame, numFrames, dataSize, data (padded to 4 bytes)
+#   index:   (firstFrame, offset) per chunk, then indexOffset, numChunks, magic
+#
+# Chunk data is columnar: numJoints columns of numFrames float32 values. When
+# delta compression is enabled, each column stores the difference between the
+# bit patterns of consecutive values (lossless) and the chunk is deflated.
+HEADER = struct.Struct('<4sHHIIf')
+CHUNK = struct.Struct('<III')
+INDEX_ENTRY = np.dtype([('firstFrame', '<u4'), ('offset', '<u8')])
+FOOTER = struct.Struct('<QI4s')
+
+MAGIC = b'JTRK'
+INDEX_MAGIC = b'JIDX'
+VERSION = 1
+FLAG_DELTA = 1
+
+class TrajectoryRecorder(object):
+    """Records the joint values of a robot once per fixed time step into a
+    chunked, columnar binary log that can be replayed with TrajectoryPlayer.
+    """
+    def __init__(self, robot, file, timeStep=10, chunkFrames=1024, compress=False):
+        """Creates the log file. Samples are taken every timeStep (ms) of robot
+        updates and written out chunkFrames at a time.
+        """
+        self.robot = robot
+        self.numJoints = len(robot.joints)
+        self.timeStep = timeStep
+        self.chunkFrames = chunkFrames
+        self.compress = compress
+
+        self.buffer = np.empty((chunkFrames, self.numJoints), dtype=np.float32)
+        self.bufferFrames = 0
+        self.numFrames = 0
+        self.elapsed = 0.0
+        self.index = []
+
+        self.fp = open(file, 'wb')
+        flags = FLAG_DELTA if compress else 0
+        self.fp.write(HEADER.pack(MAGIC, VERSION, flags, self.numJoints,
+            chunkFrames, timeStep))
+
+    def start(self):
+        """Starts recording on every update of the robot.
+        """
+        self.robot.addUpdateHook(self.onUpdate)
+
+    def stop(self):
+        self.robot.removeUpdateHook(self.onUpdate)
+
+    def onUpdate(self, robot, dtime):
+        self.elapsed += dtime
+        while self.elapsed >= self.timeStep:
+            self.elapsed -= self.timeStep
+            self.addFrame([j.value for j in robot.joints])
+
+    def addFrame(self, values):
+        """Appends one frame of joint values to the log.
+        """
+        self.buffer[self.bufferFrames] = values
+        self.bufferFrames += 1
+        self.numFrames += 1
+
+        if self.bufferFrames == self.chunkFrames:
+            self.writeChunk()
+
+    def writeChunk(self):
+        if self.bufferFrames == 0:
+            return
+
+        columns = np.ascontiguousarray(self.buffer[:self.bufferFrames].T)
+        if self.compress:
+            bits = columns.view('<u4')
+            deltas = np.empty_like(bits)
+            deltas[:, 0] = bits[:, 0]
+            np.subtract(bits[:, 1:], bits[:, :-1], out=deltas[:, 1:])
+            data = zlib.compress(deltas.tobytes())
+        else:
+            data = columns.astype('<f4').tobytes()
+
+        firstFrame = self.numFrames - self.bufferFrames
+        self.index.append((firstFrame, self.fp.tell()))
+        self.fp.write(CHUNK.pack(firstFrame, self.bufferFrames, len(data)))
+        self.fp.write(data)
+        self.fp.write(b'\0' * (-len(data) % 4))
+
+        self.bufferFrames = 0
+
+    def close(self):
+        """Writes any buffered frames and the seek index, then closes the log.
+        """
+        if self.fp is None:
+            return
+
+        if self.onUpdate in self.robot.updateHooks:
+            self.stop()
+
+        self.writeChunk()
+
+        indexOffset = self.fp.tell()
+        self.fp.write(np.array(self.index, dtype=INDEX_ENTRY).tobytes())
+        self.fp.write(FOOTER.pack(indexOffset, len(self.index), INDEX_MAGIC))
+        self.fp.close()
+        self.fp = None
+
+class TrajectoryPlayer(object):
+    """Memory-maps a log written by TrajectoryRecorder. Any frame can be
+    fetched in constant time: the chunk is found from the frame number and
+    the seek index, and uncompressed chunks are read in place.
+    """
+    def __init__(self, file):
+        self.data = np.memmap(file, dtype=np.uint8, mode='r')
+
+        magic, version, flags, self.numJoints, self.chunkFrames, self.timeStep = \
+            HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise Exception("Not a joint trajectory log: " + str(file))
+
+        self.compressed = bool(flags & FLAG_DELTA)
+        self.index = self.readIndex()
+
+        self.numFrames = 0
+        if len(self.index):
+            lastFrames = CHUNK.unpack_from(self.data, int(self.index[-1]['offset']))[1]
+            self.numFrames = int(self.index[-1]['firstFrame']) + lastFrames
+
+        self.cachedChunk = -1
+        self.cachedColumns = None
+
+    def readIndex(self):
+        """Returns the seek index from the footer, rebuilding it by walking the
+        chunks if the log was not closed properly.
+        """
+        if len(self.data) >= HEADER.size + FOOTER.size:
+            indexOffset, numChunks, magic = FOOTER.unpack_from(self.data,
+                len(self.data) - FOOTER.size)
+            if magic == INDEX_MAGIC:
+                return np.frombuffer(self.data, dtype=INDEX_ENTRY,
+                    count=numChunks, offset=indexOffset)
+
+        index = []
+        offset = HEADER.size
+        while offset + CHUNK.size <= len(self.data):
+            firstFrame, numFrames, dataSize = CHUNK.unpack_from(self.data, offset)
+            end = offset + CHUNK.size + dataSize
+            if numFrames == 0 or end > len(self.data):
+                break
+
+            index.append((firstFrame, offset))
+            offset = end + (-dataSize % 4)
+
+        return np.array(index, dtype=INDEX_ENTRY)
+
+    def getDuration(self):
+        """Returns the length of the recording in ms.
+        """
+        return max(0, self.numFrames - 1) * self.timeStep
+
+    def getChunk(self, chunk):
+        """Returns the (numJoints, numFrames) columns of a chunk.
+        """
+        if chunk == self.cachedChunk:
+            return self.cachedColumns
+
+        offset = int(self.index[chunk]['offset'])
+        firstFrame, numFrames, dataSize = CHUNK.unpack_from(self.data, offset)
+        offset += CHUNK.size
+
+        if self.compressed:
+            raw = zlib.decompress(self.data[offset : offset + dataSize])
+            deltas = np.frombuffer(raw, dtype='<u4').reshape(self.numJoints, numFrames)
+            columns = np.cumsum(deltas, axis=1, dtype=np.uint32).view('<f4')
+        else:
+            columns = np.frombuffer(self.data, dtype='<f4',
+                count=self.numJoints * numFrames, offset=offset)
+            columns = columns.reshape(self.numJoints, numFrames)
+
+        self.cachedChunk = chunk
+        self.cachedColumns = columns
+
+        return columns
+
+    def getFrame(self, frame):
+        """Returns the joint values of a frame (clamped to the recording).
+        """
+        if self.numFrames == 0:
+            raise Exception("Joint trajectory log has no frames!")
+
+        frame = min(max(0, int(frame)), self.numFrames - 1)
+        chunk = frame // self.chunkFrames
+
+        return self.getChunk(chunk)[:, frame - chunk * self.chunkFrames]
+
+    def getValues(self, time):
+        """Returns the joint values at time (ms), linearly interpolated between
+        the two nearest frames.
+        """
+        if self.numFrames == 0:
+            raise Exception("Joint trajectory log has no frames!")
+
+        position = min(max(0.0, time / self.timeStep), self.numFrames - 1)
+        frame = int(position)
+        alpha = position - frame
+
+        values = self.getFrame(frame).astype(np.float64)
+        if alpha > 0:
+            values += (self.getFrame(frame + 1) - values) * alpha
+
+        return values
+
+    def applyFrame(self, robot, frame):
+        """Sets the joint values of robot to those of a frame.
+        """
+        self.applyValues(robot, self.getFrame(frame))
+
+    def applyTime(self, robot, time):
+        """Sets the joint values of robot to the interpolated values at time.
+        """
+        self.applyValues(robot, self.getValues(time))
+
+    def applyValues(self, robot, values):
+        if len(robot.joints) != self.numJoints:
+            raise Exception("Robot does not match the recorded joints!")
+
+        for j, v in zip(robot.joints, values):
+            j.value = float(v)
+
+    def close(self):
+        self.cachedColumns = None
+        del self.data
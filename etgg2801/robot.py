@@ -2,8 +2,8 @@
 # BY: Andrew Holbrook
 # DATE: 9/24/2015
 
-from OpenGL import GL
-from . import GLWindow, Vector4, Matrix4
+import numpy as np
+from . import Vector4, Matrix4, KinematicChain
 
 class Joint(object):
     """Base class for all joint types (prismatic, revolute, etc).
@@ -15,6 +15,7 @@ class Joint(object):
         self.partA = partA
         self.partB = partB
         self.value = 0.0
+        self.previousValue = 0.0
         self.velocity = 0.0
         self.axis = axis
         self.offset = offset
@@ -73,74 +74,150 @@ class PrismaticJoint(Joint):
         return self.offsetMatrix * Matrix4.getTranslation(*dList)
 
 class Robot(object):
-    def __init__(self, model):
+    def __init__(self, model=None):
+        """Creates a robot drawn with the given model. The model (and the GL
+        window) is only needed for rendering, so a robot without one can be
+        simulated headless.
+        """
         self.model = model
         self.joints = []
         self.position = Vector4()
         self.orientation = Vector4()
-        
-        renderDelegate = GLWindow.getInstance().renderDelegate
-        self.modelview_loc = renderDelegate.modelview_loc
+        self.kinematics = None
+        self.updateHooks = []
     
     def addJoint(self, joint):
         self.joints.append(joint)
     
+    def addUpdateHook(self, hook):
+        """Registers a function called as hook(robot, dtime) after each update.
+        """
+        self.updateHooks.append(hook)
+    
+    def removeUpdateHook(self, hook):
+        self.updateHooks.remove(hook)
+    
+    def getKinematics(self):
+        """Returns the KinematicChain for this robot's joints, with its values
+        synchronized to the current joint values.
+        """
+        if self.kinematics is None or self.kinematics.getNumJoints() != len(self.joints):
+            self.kinematics = KinematicChain.fromRobot(self)
+        else:
+            self.kinematics.values[:] = [j.value for j in self.joints]
+        
+        return self.kinematics
+    
     def cleanup(self):
-        self.model.cleanup()
+        if self.model != None:
+            self.model.cleanup()
     
     def update(self, dtime):
         for j in self.joints:
+            j.previousValue = j.value
             j.dfunc(dtime)
+        
+        for h in self.updateHooks:
+            h(self, dtime)
+    
+    def getState(self):
+        """Returns copies of the joint values, their values before the last
+        update, and the base position and orientation.
+        """
+        return (np.array([j.value for j in self.joints]),
+                np.array([j.previousValue for j in self.joints]),
+                self.position.getXYZ(), self.orientation.getXYZ())
     
-    def render(self):
-        rotMatrix_ow = Matrix4.getRotation(*self.orientation.getXYZ())
-        tranMatrix_ow = Matrix4.getTranslation(*self.position.getXYZ())
+    def render(self, alpha=1.0, state=None, viewMatrix=None):
+        """Draws every part of the robot, with joint values blended between
+        their values before the last update (alpha = 0) and now (alpha = 1).
+        state, from getState, is drawn instead of the current values if given.
+        With viewMatrix (the camera's), the modelview matrices include it.
+        """
+        # imported here so robots can be simulated without PyOpenGL
+        from OpenGL import GL
+        from . import ShaderProgram
         
-        # object to world matrix
-        matrix_ow = tranMatrix_ow * rotMatrix_ow
-        GL.glUniformMatrix4fv(self.modelview_loc, 1, False, matrix_ow.getCType())
+        modelview_loc = ShaderProgram.current.getUniformLocation("modelview")
         
-        self.model.renderPartByName(self.joints[0].partA)
+        if state is None:
+            state = self.getState()
+        values, previousValues, position, orientation = state
+        if alpha < 1.0:
+            values = previousValues + (values - previousValues) * alpha
         
-        for j in self.joints:
-            matrix_ow *= j.getTransformation()
-            GL.glUniformMatrix4fv(self.modelview_loc, 1, False, matrix_ow.getCType())
-            self.model.renderPartByName(j.partB)
+        # link to world matrices for every part, computed in one pass (the
+        # cached chain only supplies the structure, so it is left untouched
+        # when drawing from another thread)
+        chain = self.kinematics
+        if chain is None or chain.getNumJoints() != len(values):
+            chain = self.getKinematics()
+        matrices_ow = chain.forwardKinematics(values, position,
+            orientation).astype(np.float32)
+        
+        # a quantized model's positions are within its bounding box
+        dequantize = self.model.getDequantizeMatrix()
+        if dequantize is not None:
+            matrices_ow = matrices_ow @ np.array(dequantize.data, dtype=np.float32)
+        if viewMatrix is not None:
+            matrices_ow = np.array(viewMatrix.data, dtype=np.float32) @ matrices_ow
+        
+        for name, matrix_ow in zip(chain.partNames, matrices_ow):
+            GL.glUniformMatrix4fv(modelview_loc, 1, True, matrix_ow)
+            self.model.renderPartByName(name)
 
 class Scara(Robot):
-    def __init__(self, model):
+    def __init__(self, model=None):
         super().__init__(model)
         
-        self.addJoint(RevoluteJoint("L0", "L1"))
-        self.addJoint(RevoluteJoint("L1", "L2", offset=(-0.325,0.0)))
-        self.addJoint(PrismaticJoint("L2", "d3"))
+        for j in Scara.getJoints():
+            self.addJoint(j)
+    
+    @staticmethod
+    def getJoints():
+        """Returns a new list of the joints making up a SCARA arm.
+        """
+        joints = [RevoluteJoint("L0", "L1"),
+                  RevoluteJoint("L1", "L2", offset=(-0.325,0.0)),
+                  PrismaticJoint("L2", "d3")]
+        
+        joints[0].velocity = 386.0 / 1000.0
+        joints[1].velocity = 720.0 / 2000.0
+        joints[2].velocity = 1.1 / 1000.0
         
-        self.joints[0].velocity = 386.0 / 1000.0
-        self.joints[1].velocity = 720.0 / 2000.0
-        self.joints[2].velocity = 1.1 / 1000.0
+        joints[0].setLimits(-105, 105)
+        joints[1].setLimits(-150, 150)
+        joints[2].setLimits(-0.21, 0.21)
         
-        self.joints[0].setLimits(-105, 105)
-        self.joints[1].setLimits(-150, 150)
-        self.joints[2].setLimits(-0.21, 0.21)
+        return joints
 
 class Viper(Robot):
-    def __init__(self, model):
+    def __init__(self, model=None):
         super().__init__(model)
         
-        self.addJoint(RevoluteJoint('L0', 'L1'))
-        self.addJoint(RevoluteJoint('L1', 'L2', (0, 0, 1), (-0.075, 0.335, 0.0)))
-        self.addJoint(RevoluteJoint('L2', 'L3', (0, 0, 1), (-0.365, 0, 0)))
-        self.addJoint(RevoluteJoint('L3', 'L4', (0, 1, 0), (0.09, 0, 0)))
-        self.addJoint(RevoluteJoint('L4', 'L5', (0, 0, 1), (0, 0.4, 0)))
+        for j in Viper.getJoints():
+            self.addJoint(j)
+    
+    @staticmethod
+    def getJoints():
+        """Returns a new list of the joints making up a six-axis (Viper) arm.
+        """
+        joints = [RevoluteJoint('L0', 'L1'),
+                  RevoluteJoint('L1', 'L2', (0, 0, 1), (-0.075, 0.335, 0.0)),
+                  RevoluteJoint('L2', 'L3', (0, 0, 1), (-0.365, 0, 0)),
+                  RevoluteJoint('L3', 'L4', (0, 1, 0), (0.09, 0, 0)),
+                  RevoluteJoint('L4', 'L5', (0, 0, 1), (0, 0.4, 0))]
                
-        self.joints[0].velocity = 328.0 / 1000.0
-        self.joints[1].velocity = 300.0 / 1000.0
-        self.joints[2].velocity = 375.0 / 1000.0
-        self.joints[3].velocity = 375.0 / 1000.0
-        self.joints[4].velocity = 375.0 / 1000.0
-        self.joints[0].setLimits(-170, 170)
-        self.joints[1].setLimits(-190, 45)
-        self.joints[2].setLimits(-29, 256)
-        self.joints[3].setLimits(-190, 190)
-        self.joints[4].setLimits(-120, 120)
+        joints[0].velocity = 328.0 / 1000.0
+        joints[1].velocity = 300.0 / 1000.0
+        joints[2].velocity = 375.0 / 1000.0
+        joints[3].velocity = 375.0 / 1000.0
+        joints[4].velocity = 375.0 / 1000.0
+        joints[0].setLimits(-170, 170)
+        joints[1].setLimits(-190, 45)
+        joints[2].setLimits(-29, 256)
+        joints[3].setLimits(-190, 190)
+        joints[4].setLimits(-120, 120)
+        
+        return joints
         
\ No newline at end of file
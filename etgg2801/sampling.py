@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import threading
+
+class StackSampler(object):
+    """Captures where a thread (the main loop's) spends its time: a
+    background thread reads the thread's Python stack every interval ms
+    for a number of frames, and tags each sample with the main loop phase
+    (phase, set by GLWindow.mainLoop) and the frame it was taken in. The
+    samples are written as a speedscope profile or as collapsed stacks for
+    flamegraph.pl, with the phase as the root of every stack.
+
+    Nothing runs unless a capture is started (see GLWindow.startCapture);
+    during one, the interpreter switches threads more often so the sampler
+    gets to run, which slows Python code down a little.
+    """
+    PHASES = ("events", "stream", "update", "render", "capture", "swap", "wait")
+
+    def __init__(self, interval=1.0, maxDepth=128):
+        self.interval = interval
+        self.maxDepth = maxDepth
+        self.phase = "events"
+        self.threadId = None
+        self.thread = None
+        self.sampling = False
+        self.switchInterval = None
+
+        # (phase, frame, stack of code objects from the leaf, weight ms)
+        self.samples = []
+        self.numFrames = 0
+        self.frameLimit = None
+        self.frameTimes = []
+        self.frameStartTime = 0.0
+        self.startTime = 0.0
+        self.endTime = 0.0
+
+    def start(self, numFrames=None):
+        """Starts sampling the calling thread, for numFrames frames (counted
+        by endFrame) or until stop is called.
+        """
+        if self.sampling:
+            raise Exception("StackSampler already started!")
+
+        self.threadId = threading.get_ident()
+        self.samples = []
+        self.numFrames = 0
+        self.frameLimit = numFrames
+        self.frameTimes = []
+        self.startTime = self.frameStartTime = time.perf_counter()
+
+        # the sampler only runs when the sampled thread gives up the GIL
+        self.switchInterval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switchInterval, self.interval / 4000.0))
+
+        self.sampling = True
+        self.thread = threading.Thread(target=self.sampleLoop, name="sampler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if not self.sampling:
+            return
+
+        self.sampling = False
+        self.thread.join()
+        self.thread = None
+        sys.setswitchinterval(self.switchInterval)
+        self.endTime = time.perf_counter()
+
+    def endFrame(self):
+        """Counts a frame. Returns True once the frames asked for are captured
+        (the caller then stops the capture).
+        """
+        now = time.perf_counter()
+        self.frameTimes.append((now - self.frameStartTime) * 1000.0)
+        self.frameStartTime = now
+        self.numFrames += 1
+
+        return self.frameLimit is not None and self.numFrames >= self.frameLimit
+
+    def sampleLoop(self):
+        """Body of the sampling thread.
+        """
+        interval = self.interval / 1000.0
+        getFrames = sys._current_frames
+        lastTime = time.perf_counter()
+        while self.sampling:
+            time.sleep(interval)
+            frame = getFrames().get(self.threadId)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+
+            stack = []
+            while frame is not None and len(stack) < self.maxDepth:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            self.samples.append((self.phase, self.numFrames, tuple(stack),
+                                 (now - lastTime) * 1000.0))
+            lastTime = now
+
+    @staticmethod
+    def getFrameName(code):
+        return "%s (%s:%d)" % (getattr(code, "co_qualname", code.co_name),
+                               os.path.basename(code.co_filename), code.co_firstlineno)
+
+    def getCollapsed(self):
+        """Returns {"phase;outer;...;leaf": ms} over the capture.
+        """
+        collapsed = {}
+        names = {}
+        for phase, frame, stack, weight in self.samples:
+            for code in stack:
+                if code not in names:
+                    names[code] = StackSampler.getFrameName(code).replace(";", ":")
+            key = ";".join([phase] + [names[code] for code in reversed(stack)])
+            collapsed[key] = collapsed.get(key, 0.0) + weight
+
+        return collapsed
+
+    def writeCollapsed(self, file):
+        """Writes the samples as collapsed stacks (flamegraph.pl, speedscope,
+        and most flamegraph viewers read them), one line per stack with its
+        time in microseconds.
+        """
+        with open(file, "w") as fp:
+            for key, weight in sorted(self.getCollapsed().items()):
+                fp.write("%s %d\n" % (key, round(weight * 1000.0)))
+
+    def writeSpeedscope(self, file, name="mainLoop"):
+        """Writes the samples, in the order taken, as a speedscope profile
+        (https://www.speedscope.app) with the phases as root frames.
+        """
+        frames = []
+        indices = {}
+
+        def getIndex(key, entry):
+            if key not in indices:
+                indices[key] = len(frames)
+                frames.append(entry)
+            return indices[key]
+
+        samples = []
+        weights = []
+        for phase, frame, stack, weight in self.samples:
+            sample = [getIndex(phase, {"name": "[%s]" % phase})]
+            for code in reversed(stack):
+                sample.append(getIndex(code, {"name": getattr(code, "co_qualname", code.co_name),
+                    "file": code.co_filename, "line": code.co_firstlineno}))
+            samples.append(sample)
+            weights.append(weight)
+
+        data = {"$schema": "https://www.speedscope.app/file-format-schema.json",
+                "shared": {"frames": frames},
+                "profiles": [{"type": "sampled", "name": name, "unit": "milliseconds",
+                              "startValue": 0, "endValue": sum(weights),
+                              "samples": samples, "weights": weights}],
+                "name": name, "exporter": "etgg2801.StackSampler"}
+
+        with open(file, "w") as fp:
+            json.dump(data, fp)
+
+    def write(self, file):
+        """Writes a speedscope profile for .json files, collapsed stacks
+        otherwise.
+        """
+        if file.endswith(".json"):
+            self.writeSpeedscope(file)
+        else:
+            self.writeCollapsed(file)
+
+    def getPhaseTimes(self):
+        """Returns {phase: ms sampled in it}.
+        """
+        times = {}
+        for phase, frame, stack, weight in self.samples:
+            times[phase] = times.get(phase, 0.0) + weight
+
+        return times
+
+    def getFunctionTimes(self):
+        """Returns {function name: (self ms, total ms)}: time with the function
+        on top of the stack, and anywhere on it.
+        """
+        times = {}
+        for phase, frame, stack, weight in self.samples:
+            seen = set()
+            for depth, code in enumerate(stack):
+                entry = times.setdefault(code, [0.0, 0.0])
+                if depth == 0:
+                    entry[0] += weight
+                if code not in seen:
+                    entry[1] += weight
+                    seen.add(code)
+
+        return {StackSampler.getFrameName(code): tuple(entry) for code, entry in times.items()}
+
+    def printSummary(self, top=12):
+        """Prints the time per phase, the slowest frame, and the functions
+        with the most time on top of the stack.
+        """
+        total = max(sum(weight for phase, frame, stack, weight in self.samples), 1e-9)
+        print("Capture: %d frames, %d samples (%.2f ms apart)" % (self.numFrames,
+              len(self.samples), total / max(len(self.samples), 1)))
+        phases = self.getPhaseTimes()
+        print("  " + "  ".join("%s %.1f%%" % (phase, 100.0 * phases[phase] / total)
+                               for phase in StackSampler.PHASES if phase in phases))
+        if self.frameTimes:
+            slowest = max(range(len(self.frameTimes)), key=self.frameTimes.__getitem__)
+            print("  slowest frame: %d (%.2f ms)" % (slowest, self.frameTimes[slowest]))
+
+        functions = sorted(self.getFunctionTimes().items(), key=lambda f: -f[1][0])
+        print("  %8s %8s  %s" % ("self %", "total %", "function"))
+        for name, (selfTime, totalTime) in functions[:top]:
+            print("  %8.1f %8.1f  %s" % (100.0 * selfTime / total, 100.0 * totalTime / total, name))
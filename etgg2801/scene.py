@@ -1,28 +1,43 @@
 import sdl2
-import ctypes
 from OpenGL import GL
-from . import Vector4, Matrix4, GLWindow
+from . import Vector4, Matrix4, GLWindow, ShaderProgram, StaticBatch
 
 class Scene(object):
     def __init__(self):
         self.objects = []
         self.hudObjects = []
+        self.hud = None
         self.camera = Camera()
         self.camera.setPerspective()
         
-        window = GLWindow.getInstance()
-        self.center_x = window.size[0] // 2
-        self.center_y = window.size[1] // 2
+        # optional CollisionWorld checked every update
+        self.collisions = None
+        self.contacts = []
         
-        sdl2.SDL_WarpMouseInWindow(window.window,
-            ctypes.c_int(self.center_x), ctypes.c_int(self.center_y))
-        sdl2.SDL_ShowCursor(0)
+        # optional OcclusionCuller that skips hidden objects when rendering
+        self.occlusion = None
+        
+        # optional StaticBatch drawing the static objects (see
+        # enableStaticBatching), which are kept apart from the others
+        self.staticBatch = None
+        self.staticObjects = []
+        
+        # the mouse steers the camera
+        GLWindow.getInstance().input.setMouseCapture(True)
         
     def addObject(self, o):
-        self.objects.append(o)
+        if self.staticBatch and getattr(o, "static", False):
+            self.staticObjects.append(o)
+            self.staticBatch.addObject(o)
+        else:
+            self.objects.append(o)
     
     def removeObject(self, o):
-        self.objects.remove(o)
+        if o in self.staticObjects:
+            self.staticObjects.remove(o)
+            self.staticBatch.removeObject(o)
+        else:
+            self.objects.remove(o)
     
     def addHUDObject(self, o):
         self.hudObjects.append(o)
@@ -30,15 +45,52 @@ class Scene(object):
     def removeHUDObject(self, o):
         self.hudObjects.remove(o)
     
+    def setHUD(self, hud):
+        """Sets the HUDLayer drawn over everything else.
+        """
+        self.hud = hud
+    
     def setCamera(self, camera):
         self.camera = camera
     
+    def setOcclusionCuller(self, culler):
+        """Sets the OcclusionCuller that render asks which objects may be
+        visible, or None to draw every object.
+        """
+        self.occlusion = culler
+    
+    def enableStaticBatching(self, layerSize=512, program=None):
+        """Draws the static objects (see Model.setStatic), those added so far
+        and from now on, with a StaticBatch (see it for the arguments): in
+        world coordinates in shared buffers, with their textures in a texture
+        array, in one draw call before the other objects. They are no longer
+        updated, culled, or copied into snapshots. Returns the StaticBatch.
+        """
+        if self.staticBatch is None:
+            self.staticBatch = StaticBatch(layerSize, program)
+            for o in [o for o in self.objects if getattr(o, "static", False)]:
+                self.objects.remove(o)
+                self.addObject(o)
+        
+        return self.staticBatch
+    
     def cleanup(self):
-        for o in self.objects:
+        for o in self.objects + self.staticObjects:
             o.cleanup()
+        if self.staticBatch:
+            self.staticBatch.cleanup()
+        if self.hud:
+            self.hud.cleanup()
     
     def update(self, dtime):
-        keyState = sdl2.SDL_GetKeyboardState(None)
+        self.camera.storePreviousState()
+        for o in self.objects:
+            o.storePreviousState()
+        for o in self.hudObjects:
+            o.storePreviousState()
+        
+        # gathered from the window's events, possibly on another thread
+        keyState, dx, dy = GLWindow.getInstance().input.take()
         if keyState[sdl2.SDL_SCANCODE_D]:
             self.camera.moveRight(dtime)
         if keyState[sdl2.SDL_SCANCODE_A]:
@@ -52,62 +104,114 @@ class Scene(object):
         if keyState[sdl2.SDL_SCANCODE_DOWN]:
             self.camera.rotate(dtime, ax=1)
         
-        window = GLWindow.getInstance()
-        
-        x = ctypes.c_int()
-        y = ctypes.c_int()
-        mouseState = sdl2.SDL_GetMouseState(ctypes.byref(x), ctypes.byref(y))
-        
-        if x.value != 0 and y.value != 0:
+        if dx != 0:
+            self.camera.yaw(dtime, dx)
         
-            dx = self.center_x - x.value
-            dy = self.center_y - y.value
-            
-            if dx > 0:
-                self.camera.yaw(dtime, dx)
-            elif dx < 0:
-                self.camera.yaw(dtime, dx)
-            
-            if dy > 0:
-                self.camera.rotate(dtime, ax=dy)
-            elif dy < 0:
-                self.camera.rotate(dtime, ax=dy)
-            
-            sdl2.SDL_WarpMouseInWindow(window.window,
-                ctypes.c_int(self.center_x), ctypes.c_int(self.center_y))
+        if dy != 0:
+            self.camera.rotate(dtime, ax=dy)
         
         for o in self.objects:
             o.update(dtime)
         
         for o in self.hudObjects:
             o.update(dtime)
+        
+        if self.collisions:
+            self.contacts = self.collisions.check()
     
-    def render(self):
+    def createSnapshot(self):
+        return SceneSnapshot()
+    
+    def writeSnapshot(self, snapshot):
+        """Copies the camera and object transforms (current and before the
+        last update) into snapshot, for drawing while updates continue.
+        """
+        snapshot.camera = self.camera.getState()
+        snapshot.objects = tuple(self.objects)
+        snapshot.objectStates = [o.getState() for o in snapshot.objects]
+        snapshot.hudObjects = tuple(self.hudObjects)
+        snapshot.hudStates = [o.getState() for o in snapshot.hudObjects]
+        snapshot.contacts = list(self.contacts)
+    
+    def render(self, alpha=1.0, snapshot=None):
+        """Draws the scene with the ShaderProgram in use, with the camera and
+        objects blended between their state before the last update (alpha =
+        0) and now (alpha = 1). If a SceneSnapshot is given, the state is
+        taken from it instead.
+        """
+        if snapshot is None:
+            objects = zip(self.objects, [None] * len(self.objects))
+            hudObjects = zip(self.hudObjects, [None] * len(self.hudObjects))
+            cameraState = None
+        else:
+            objects = zip(snapshot.objects, snapshot.objectStates)
+            hudObjects = zip(snapshot.hudObjects, snapshot.hudStates)
+            cameraState = snapshot.camera
+        
+        # uniforms of the program in use
+        program = ShaderProgram.current
+        
         projMatrix = self.camera.getProjectionMatrix()
-        projection_loc = GLWindow.getInstance().renderDelegate.projection_loc
+        projection_loc = program.getUniformLocation("projection")
         GL.glUniformMatrix4fv(projection_loc, 1, False, projMatrix.getCType())
         
-        sampler_loc = GLWindow.getInstance().renderDelegate.sampler_loc
+        sampler_loc = program.getUniformLocation("sampler")
         GL.glUniform1i(sampler_loc, 0)
         
-        camMatrix = self.camera.getViewMatrix()
-        model_loc = GLWindow.getInstance().renderDelegate.model_loc
-        modelview_loc = GLWindow.getInstance().renderDelegate.modelview_loc
-        for o in self.objects:
-            GL.glUniformMatrix4fv(model_loc, 1, False, o.modelMatrix.getCType())
-            mvMatrix = camMatrix * o.modelMatrix
+        camMatrix = self.camera.getViewMatrix(alpha, cameraState)
+        if self.staticBatch:
+            self.staticBatch.render(camMatrix, projMatrix)
+        
+        model_loc = program.getUniformLocation("model")
+        modelview_loc = program.getUniformLocation("modelview")
+        objects = list(objects)
+        modelMatrices = [o.getModelMatrix(alpha, state) for o, state in objects]
+        visible = [True] * len(objects)
+        if self.occlusion:
+            visible = self.occlusion.cull([o for o, state in objects], modelMatrices,
+                                          camMatrix, projMatrix)
+        
+        for (o, state), modelMatrix, drawn in zip(objects, modelMatrices, visible):
+            if not drawn:
+                continue
+            GL.glUniformMatrix4fv(model_loc, 1, False, modelMatrix.getCType())
+            mvMatrix = camMatrix * modelMatrix
+            if o.getDequantizeMatrix() is not None:
+                mvMatrix = mvMatrix * o.getDequantizeMatrix()
             GL.glUniformMatrix4fv(modelview_loc, 1, False, mvMatrix.getCType())
             o.render()
         
         GL.glDisable(GL.GL_DEPTH_TEST)
         
-        for o in self.hudObjects:
-            GL.glUniformMatrix4fv(model_loc, 1, False, o.modelMatrix.getCType())
-            mvMatrix = camMatrix * o.modelMatrix
+        for o, state in hudObjects:
+            modelMatrix = o.getModelMatrix(alpha, state)
+            GL.glUniformMatrix4fv(model_loc, 1, False, modelMatrix.getCType())
+            mvMatrix = camMatrix * modelMatrix
+            if o.getDequantizeMatrix() is not None:
+                mvMatrix = mvMatrix * o.getDequantizeMatrix()
             GL.glUniformMatrix4fv(modelview_loc, 1, False, mvMatrix.getCType())
             o.render()
         
         GL.glEnable(GL.GL_DEPTH_TEST)
+        
+        if self.hud:
+            self.hud.render()
+
+class SceneSnapshot(object):
+    """The state of a Scene that is needed to draw it: the camera's and every
+    object's transforms after an update and before it.
+    """
+    def __init__(self):
+        self.camera = None
+        self.objects = ()
+        self.objectStates = []
+        self.hudObjects = ()
+        self.hudStates = []
+        self.contacts = []
+        
+        # set by SnapshotBuffer.publish and GLWindow
+        self.publishTime = 0
+        self.inputTime = 0
 
 class Camera(object):
     ORTHOGRAPHIC = 0
@@ -118,6 +222,7 @@ class Camera(object):
         position = Vector4((0, 0.3, 0, 1))
         self.viewMatrix = Matrix4()
         self.viewMatrix.setPosition(position)
+        self.previousViewMatrix = None
         
         self.translateSpeed = 5.0 / 5000.0
         self.rotateSpeed = 360.0 / 8000.0
@@ -155,8 +260,29 @@ class Camera(object):
         
         self.viewMatrix.setOrientation(left, up, lookat)
         
-    def getViewMatrix(self):
-        return self.viewMatrix.inverse()
+    def storePreviousState(self):
+        """Keeps a copy of the camera transformation before an update.
+        """
+        self.previousViewMatrix = Matrix4(self.viewMatrix.data)
+    
+    def getState(self):
+        """Returns copies of (viewMatrix, previousViewMatrix).
+        """
+        previous = self.previousViewMatrix
+        return (Matrix4(self.viewMatrix.data),
+                Matrix4(previous.data) if previous is not None else None)
+    
+    def getViewMatrix(self, alpha=1.0, state=None):
+        """Returns the view matrix, blended between the camera's state before
+        the last update (alpha = 0) and now (alpha = 1). state, from
+        getState, is used instead of the current state if given.
+        """
+        viewMatrix, previousViewMatrix = state or (self.viewMatrix, self.previousViewMatrix)
+        if alpha >= 1.0 or previousViewMatrix is None:
+            return viewMatrix.inverse()
+        
+        return Matrix4.interpolate(previousViewMatrix, viewMatrix,
+            alpha, rigid=True).inverse()
     
     def getProjectionMatrix(self):
         return self.projectionMatrix
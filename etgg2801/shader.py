@@ -0,0 +1,251 @@
+import os
+import struct
+import ctypes
+import hashlib
+from OpenGL import GL
+
+# program binary cache file: magic, binary format, then the binary
+BINARY_HEADER = struct.Struct('<4sI')
+BINARY_MAGIC = b'GLPB'
+
+def compileShader(shaderType, source):
+    """Compiles one shader stage, raising an Exception with the info log if
+    it does not compile.
+    """
+    shader = GL.glCreateShader(shaderType)
+    GL.glShaderSource(shader, source)
+    GL.glCompileShader(shader)
+
+    if GL.glGetShaderiv(shader, GL.GL_COMPILE_STATUS) != GL.GL_TRUE:
+        log = GL.glGetShaderInfoLog(shader)
+        GL.glDeleteShader(shader)
+        raise Exception("Error compiling shader: " + log.decode(errors="replace"))
+
+    return shader
+
+class ShaderProgram(object):
+    """A linked GL program and the locations of its active uniforms and
+    vertex attributes, found when it is created. The program last passed to
+    use is ShaderProgram.current, which is where the scene and the robots
+    look up the uniforms they set.
+    """
+    current = None
+
+    @staticmethod
+    def fromSource(vertexSource, fragmentSource, retrievable=False):
+        """Compiles and links a program, raising an Exception with the info
+        log if either fails. With retrievable, the driver is asked to keep
+        the binary for glGetProgramBinary.
+        """
+        shaders = [compileShader(GL.GL_VERTEX_SHADER, vertexSource),
+                   compileShader(GL.GL_FRAGMENT_SHADER, fragmentSource)]
+
+        program = GL.glCreateProgram()
+        for shader in shaders:
+            GL.glAttachShader(program, shader)
+        if retrievable:
+            GL.glProgramParameteri(program, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE)
+        GL.glLinkProgram(program)
+
+        # the program keeps what it needs once linked
+        for shader in shaders:
+            GL.glDetachShader(program, shader)
+            GL.glDeleteShader(shader)
+
+        if GL.glGetProgramiv(program, GL.GL_LINK_STATUS) != GL.GL_TRUE:
+            log = GL.glGetProgramInfoLog(program)
+            GL.glDeleteProgram(program)
+            raise Exception("Error linking shader program: " + log.decode(errors="replace"))
+
+        return ShaderProgram(program)
+
+    @staticmethod
+    def fromBinary(binaryFormat, binary):
+        """Creates a program from a binary returned by getBinary, or returns
+        None if the driver rejects it (e.g. after a driver update).
+        """
+        program = GL.glCreateProgram()
+        try:
+            GL.glProgramBinary(program, binaryFormat, binary, len(binary))
+            linked = GL.glGetProgramiv(program, GL.GL_LINK_STATUS) == GL.GL_TRUE
+        except GL.GLError:
+            linked = False
+
+        if not linked:
+            GL.glDeleteProgram(program)
+            return None
+
+        return ShaderProgram(program)
+
+    def __init__(self, program):
+        self.program = program
+        self.uniforms = {}
+        self.attributes = {}
+        self.findLocations()
+
+    def findLocations(self):
+        """Fills the uniform and attribute tables with every active name.
+        Arrays are listed under both 'name[0]' and 'name'; uniforms in blocks
+        have no location and are left out.
+        """
+        for i in range(int(GL.glGetProgramiv(self.program, GL.GL_ACTIVE_UNIFORMS))):
+            name = GL.glGetActiveUniform(self.program, i)[0].decode()
+            location = GL.glGetUniformLocation(self.program, name)
+            if location != -1:
+                self.addLocation(self.uniforms, name, location)
+
+        for i in range(int(GL.glGetProgramiv(self.program, GL.GL_ACTIVE_ATTRIBUTES))):
+            name = GL.glGetActiveAttrib(self.program, i)[0].decode()
+            location = GL.glGetAttribLocation(self.program, name)
+            if location != -1:
+                self.addLocation(self.attributes, name, location)
+
+    def addLocation(self, table, name, location):
+        table[name] = location
+        if name.endswith("[0]"):
+            table[name[:-3]] = location
+
+    def getUniformLocation(self, name):
+        """Returns the location of a uniform, or -1 (which GL ignores) if the
+        program has no such active uniform.
+        """
+        return self.uniforms.get(name, -1)
+
+    def getAttributeLocation(self, name):
+        return self.attributes.get(name, -1)
+
+    def getBinary(self):
+        """Returns (binaryFormat, binary) of the linked program.
+        """
+        length = int(GL.glGetProgramiv(self.program, GL.GL_PROGRAM_BINARY_LENGTH))
+        binary = (ctypes.c_ubyte * length)()
+        written = GL.GLsizei()
+        binaryFormat = GL.GLenum()
+        GL.glGetProgramBinary(self.program, length, ctypes.byref(written),
+            ctypes.byref(binaryFormat), binary)
+
+        return binaryFormat.value, bytes(binary[:written.value])
+
+    def use(self):
+        GL.glUseProgram(self.program)
+        ShaderProgram.current = self
+
+    def cleanup(self):
+        if ShaderProgram.current is self:
+            ShaderProgram.current = None
+        GL.glDeleteProgram(self.program)
+
+class ShaderManager(object):
+    """Builds shader programs by name, caching the linked binaries in
+    cacheDir (if given) so later launches skip compiling and linking. Cache
+    files are keyed by a hash of the sources and the GL vendor, renderer, and
+    version, and are rebuilt from source whenever the driver rejects them.
+    A cache that cannot be created or written to is not used (or not
+    updated); the programs are then simply built from source.
+    """
+    def __init__(self, cacheDir=None):
+        self.programs = {}
+        self.cacheDir = cacheDir
+        self.cacheHits = 0
+        self.cacheMisses = 0
+
+        self.driver = b"|".join(GL.glGetString(s) or b"" for s in
+            (GL.GL_VENDOR, GL.GL_RENDERER, GL.GL_VERSION))
+
+        if cacheDir and not self.isBinarySupported():
+            self.cacheDir = None
+        if self.cacheDir:
+            try:
+                os.makedirs(self.cacheDir, exist_ok=True)
+            except OSError:
+                self.cacheDir = None
+
+    def isBinarySupported(self):
+        if not bool(GL.glGetProgramBinary) or not bool(GL.glProgramParameteri):
+            return False
+
+        try:
+            return GL.glGetIntegerv(GL.GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+        except GL.GLError:
+            return False
+
+    def getKey(self, vertexSource, fragmentSource):
+        key = hashlib.sha256(self.driver)
+        for source in (vertexSource, fragmentSource):
+            if isinstance(source, str):
+                source = source.encode()
+            key.update(b"\0" + source)
+
+        return key.hexdigest()
+
+    def getProgram(self, name, vertexSource=None, fragmentSource=None):
+        """Returns the program called name, building it from the sources the
+        first time.
+        """
+        if name in self.programs:
+            return self.programs[name]
+        if vertexSource is None or fragmentSource is None:
+            raise Exception("Shader program '%s' has not been built!" % name)
+
+        program = None
+        if self.cacheDir:
+            file = os.path.join(self.cacheDir, self.getKey(vertexSource, fragmentSource) + ".bin")
+            program = self.loadBinary(file)
+
+        if program:
+            self.cacheHits += 1
+        else:
+            program = ShaderProgram.fromSource(vertexSource, fragmentSource,
+                retrievable=bool(self.cacheDir))
+            if self.cacheDir:
+                self.cacheMisses += 1
+                self.saveBinary(file, program)
+
+        self.programs[name] = program
+
+        return program
+
+    def loadBinary(self, file):
+        try:
+            with open(file, "rb") as fp:
+                data = fp.read()
+        except OSError:
+            return None
+
+        program = None
+        if len(data) > BINARY_HEADER.size:
+            magic, binaryFormat = BINARY_HEADER.unpack_from(data)
+            if magic == BINARY_MAGIC:
+                program = ShaderProgram.fromBinary(binaryFormat, data[BINARY_HEADER.size:])
+
+        if program is None:
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+
+        return program
+
+    def saveBinary(self, file, program):
+        binaryFormat, binary = program.getBinary()
+        if not binary:
+            return
+
+        # written whole, then renamed, so a crash never leaves half a binary
+        tmpFile = file + ".tmp"
+        try:
+            with open(tmpFile, "wb") as fp:
+                fp.write(BINARY_HEADER.pack(BINARY_MAGIC, binaryFormat))
+                fp.write(binary)
+            os.replace(tmpFile, file)
+        except OSError:
+            # read-only or full: the program still works, it is just not cached
+            try:
+                os.remove(tmpFile)
+            except OSError:
+                pass
+
+    def cleanup(self):
+        for program in self.programs.values():
+            program.cleanup()
+        self.programs = {}
@@ -0,0 +1,105 @@
+import time
+import numpy as np
+from . import KinematicChain, Scara, Viper
+
+class FleetSimulation(object):
+    """Headless simulation of many robots sharing one joint configuration.
+    Joint values are kept in an (N, J) array and stepped with the same rules
+    as Joint.increaseValue/decreaseValue: each joint moves towards one limit
+    at its velocity and turns around once the limit is reached. No window,
+    model, or GL context is needed.
+    """
+
+    @staticmethod
+    def fromJoints(joints, count):
+        """Creates a fleet of count robots built from a list of joints, e.g.
+        Viper.getJoints(). Every robot starts from the joints' values.
+        """
+        return FleetSimulation(KinematicChain.fromJoints(joints), count)
+
+    @staticmethod
+    def fromRobots(robots):
+        """Creates a fleet from existing robots of the same type, copying their
+        joint values, directions, and base poses.
+        """
+        fleet = FleetSimulation(KinematicChain.fromRobot(robots[0]), len(robots))
+        for i, r in enumerate(robots):
+            fleet.values[i] = [j.value for j in r.joints]
+            fleet.directions[i] = [1 if j.dfunc == j.increaseValue else -1 for j in r.joints]
+            fleet.positions[i] = r.position.getXYZ()
+            fleet.orientations[i] = r.orientation.getXYZ()
+
+        return fleet
+
+    def __init__(self, chain, count):
+        self.chain = chain
+        self.count = count
+
+        self.values = np.empty((count, chain.getNumJoints()))
+        self.values[:] = chain.values
+        self.velocities = np.empty((count, chain.getNumJoints()))
+        self.velocities[:] = chain.velocities
+
+        # +1 while a joint is increasing, -1 while decreasing
+        self.directions = np.ones((count, chain.getNumJoints()), dtype=np.int8)
+
+        self.positions = np.zeros((count, 3))
+        self.orientations = np.zeros((count, 3))
+        self.numSteps = 0
+
+    def update(self, dtime):
+        """Advances every joint of every robot by dtime (see Robot.update).
+        """
+        valueMin = self.chain.valueMin
+        valueMax = self.chain.valueMax
+        increasing = self.directions > 0
+        delta = self.velocities * dtime
+
+        values = np.where(increasing, np.minimum(valueMax, self.values + delta),
+            np.maximum(valueMin, self.values - delta))
+
+        self.directions[increasing & (values == valueMax)] = -1
+        self.directions[~increasing & (values == valueMin)] = 1
+        self.values = values
+        self.numSteps += 1
+
+    def run(self, steps, dtime=10):
+        """Runs a number of fixed steps of dtime (ms) and returns the steps per
+        second achieved.
+        """
+        startTime = time.perf_counter()
+        for i in range(steps):
+            self.update(dtime)
+
+        return steps / (time.perf_counter() - startTime)
+
+    def getLinkTransforms(self):
+        """Returns the link-to-world transformations of every robot, shape
+        (N, J + 1, 4, 4).
+        """
+        return self.chain.forwardKinematics(self.values, self.positions,
+            self.orientations)
+
+    def applyTo(self, robots):
+        """Copies the simulated joint values and directions back into robots
+        (e.g. to render a few members of the fleet).
+        """
+        for i, r in enumerate(robots):
+            for j, value, direction in zip(r.joints, self.values[i], self.directions[i]):
+                j.value = float(value)
+                j.dfunc = j.increaseValue if direction > 0 else j.decreaseValue
+
+def benchmark(count=10000, steps=1000):
+    """Steps fleets of Scara and Viper robots and prints the steps and robot
+    steps per second.
+    """
+    for name, robotType in (("Scara", Scara), ("Viper", Viper)):
+        fleet = FleetSimulation.fromJoints(robotType.getJoints(), count)
+        stepsPerSecond = fleet.run(steps)
+
+        print(name, "x", count)
+        print("  steps/s:       %.1f" % stepsPerSecond)
+        print("  robot steps/s: %.0f" % (stepsPerSecond * count))
+
+if __name__ == "__main__":
+    benchmark()
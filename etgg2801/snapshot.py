@@ -0,0 +1,151 @@
+import threading
+import sdl2
+
+class SnapshotBuffer(object):
+    """Hands copies of the simulation state (snapshots) from the update
+    thread to the render thread without locking. Each slot is filled by the
+    writer while the reader cannot be using it, then published by replacing
+    a single reference, which is atomic in Python; the reader always takes
+    the newest published slot. With 3 slots (triple buffering) the writer
+    never waits; with 2 the writer skips publishing while the reader holds
+    the other slot.
+    """
+    def __init__(self, createSlot, count=3):
+        """createSlot is called count times to allocate the slots.
+        """
+        if count < 2:
+            raise Exception("SnapshotBuffer needs at least 2 slots!")
+
+        self.slots = [createSlot() for i in range(count)]
+        self.front = None
+        self.reading = None
+        self.numPublished = 0
+
+    def getBackSlot(self):
+        """Returns a slot for the writer to fill, or None if every slot is
+        published or being read (only possible with 2 slots).
+        """
+        front = self.front
+        reading = self.reading
+        for slot in self.slots:
+            if slot is not front and slot is not reading:
+                return slot
+
+        return None
+
+    def publish(self, slot):
+        """Makes a filled slot the newest snapshot, stamped with the time it
+        was published (SDL performance counter).
+        """
+        slot.publishTime = sdl2.SDL_GetPerformanceCounter()
+        self.numPublished += 1
+        self.front = slot
+
+    def acquire(self):
+        """Returns the newest snapshot (None until one is published). It stays
+        untouched by the writer until acquire is called again.
+        """
+        while True:
+            front = self.front
+            self.reading = front
+
+            # the writer may have published (and started refilling the slot
+            # just read) before it could see the slot was being read
+            if self.front is front:
+                return front
+
+class InputState(object):
+    """Keyboard and relative mouse state for the updates, gathered from the
+    SDL events the window polls (its handlers run on the thread that owns
+    the window, the only one SDL input can be read on) and taken once per
+    update step by whichever thread runs the updates. Mouse motion is
+    accumulated until it is taken, so none is lost when updates and frames
+    run at different rates, and a key pressed and released between two
+    takes still shows as held in the next one.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.lock = threading.Lock()
+
+        # keys held now, and keys pressed since the last take (by scancode)
+        self.held = bytearray(sdl2.SDL_NUM_SCANCODES)
+        self.pressed = set()
+        self.dx = 0
+        self.dy = 0
+
+        # performance counter of the latest sample, of the oldest event not
+        # taken yet, and of the input (that event, or the sample) last taken
+        self.sampleTime = 0
+        self.eventTime = 0
+        self.takenTime = 0
+
+        self.captureMouse = False
+        self.toCounter = sdl2.SDL_GetPerformanceFrequency() / 1000.0
+
+        window.addEventHandler(sdl2.SDL_KEYDOWN, self.onKeyDown)
+        window.addEventHandler(sdl2.SDL_KEYUP, self.onKeyUp)
+        window.addEventHandler(sdl2.SDL_MOUSEMOTION, self.onMouseMotion)
+
+    def setMouseCapture(self, capture):
+        """Hides the cursor and reports the mouse's motion in relative mouse
+        mode (straight from the device, without moving the cursor).
+        """
+        self.captureMouse = capture
+        if self.window.window:
+            sdl2.SDL_SetRelativeMouseMode(sdl2.SDL_TRUE if capture else sdl2.SDL_FALSE)
+
+    def getEventTime(self, event):
+        """Returns when event happened, as a performance counter value (SDL
+        stamps events in milliseconds).
+        """
+        age = sdl2.SDL_GetTicks() - event.common.timestamp
+        return sdl2.SDL_GetPerformanceCounter() - int(age * self.toCounter)
+
+    def onKeyDown(self, event):
+        if event.key.repeat:
+            return
+
+        code = event.key.keysym.scancode
+        with self.lock:
+            self.held[code] = 1
+            self.pressed.add(code)
+            self.eventTime = self.eventTime or self.getEventTime(event)
+
+    def onKeyUp(self, event):
+        with self.lock:
+            self.held[event.key.keysym.scancode] = 0
+            self.eventTime = self.eventTime or self.getEventTime(event)
+
+    def onMouseMotion(self, event):
+        if not self.captureMouse:
+            return
+
+        with self.lock:
+            self.dx -= event.motion.xrel
+            self.dy -= event.motion.yrel
+            self.eventTime = self.eventTime or self.getEventTime(event)
+
+    def sample(self):
+        """Marks the end of a frame's events.
+        """
+        self.sampleTime = sdl2.SDL_GetPerformanceCounter()
+
+    def take(self):
+        """Returns (keys, dx, dy): the keys held (indexed by SDL scancode,
+        including those pressed and released since the last take) and the
+        mouse motion since the last take.
+        """
+        with self.lock:
+            keys = self.held
+            if self.pressed:
+                keys = bytearray(keys)
+                for code in self.pressed:
+                    keys[code] = 1
+            keys, dx, dy = bytes(keys), self.dx, self.dy
+            self.pressed = set()
+            self.dx = 0
+            self.dy = 0
+            self.takenTime = self.eventTime or self.sampleTime
+            self.eventTime = 0
+
+        return keys, dx, dy
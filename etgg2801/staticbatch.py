@@ -0,0 +1,455 @@
+import ctypes
+import threading
+import numpy as np
+from OpenGL import GL
+from . import ShaderProgram, Image, buildMipmaps, optimizeMesh
+
+static_vsrc = b'''
+#version 400
+
+layout (location = 0) in vec3 VertexPosition;
+layout (location = 1) in vec2 UV;
+layout (location = 2) in vec3 VertexNormal;
+layout (location = 3) in float Layer;
+layout (location = 4) in vec4 Color;
+
+out vec3 normal;
+out vec2 texCoord;
+flat out float layer;
+out vec4 color;
+uniform mat4 modelview;
+uniform mat4 projection;
+
+void main()
+{
+    normal = VertexNormal;
+    texCoord = UV;
+    layer = Layer;
+    color = Color;
+    gl_Position = projection * modelview * vec4(VertexPosition, 1.0);
+}
+'''
+
+static_fsrc = b'''
+#version 400
+
+in vec3 normal;
+in vec2 texCoord;
+flat in float layer;
+in vec4 color;
+out vec4 FragColor;
+
+uniform sampler2DArray sampler;
+
+void main() {
+    vec4 c = texture(sampler, vec3(texCoord, layer)) * color;
+    FragColor = clamp(c, 0.0, 1.0);
+}
+'''
+
+def readTextureLayer(texture, size):
+    """Returns a texture's pixels as a (size, size, 4) uint8 RGBA array,
+    from the first mipmap level no larger than size (so a larger texture is
+    already filtered down), scaled up to size x size with bilinear
+    filtering, as the texture itself would be sampled. None gives white.
+    """
+    if texture is None:
+        return np.full((size, size, 4), 255, dtype=np.uint8)
+
+    GL.glBindTexture(GL.GL_TEXTURE_2D, texture)
+    level = 0
+    while True:
+        width = GL.glGetTexLevelParameteriv(GL.GL_TEXTURE_2D, level, GL.GL_TEXTURE_WIDTH)
+        height = GL.glGetTexLevelParameteriv(GL.GL_TEXTURE_2D, level, GL.GL_TEXTURE_HEIGHT)
+        if max(width, height) <= size or max(width, height) == 1:
+            break
+        level += 1
+
+    GL.glPixelStorei(GL.GL_PACK_ALIGNMENT, 1)
+    data = GL.glGetTexImage(GL.GL_TEXTURE_2D, level, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE)
+    GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+    if isinstance(data, bytes):
+        data = np.frombuffer(data, dtype=np.uint8)
+    pixels = np.asarray(data, dtype=np.uint8).reshape(height, width, 4)
+
+    # texel centers of the layer in the level's texels, clamped to the edges
+    def getWeights(length):
+        position = np.clip((np.arange(size) + 0.5) * length / size - 0.5, 0, length - 1)
+        low = np.floor(position).astype(np.intp)
+        high = np.minimum(low + 1, length - 1)
+        return low, high, (position - low)[:, None]
+
+    top, bottom, y = getWeights(height)
+    left, right, x = getWeights(width)
+    pixels = pixels.astype(np.float32)
+    rows = pixels[top] * (1 - y[:, :, None]) + pixels[bottom] * y[:, :, None]
+    scaled = rows[:, left] * (1 - x) + rows[:, right] * x
+
+    return np.rint(scaled).astype(np.uint8)
+
+class StaticBatch(object):
+    """Draws static models (see Model.setStatic) in one draw call: each is
+    transformed by its model matrix once, when added, and merged into
+    shared vertex and index buffers, and their textures are copied into
+    the layers of a GL_TEXTURE_2D_ARRAY, with each vertex carrying its
+    layer and its material's color. Scene.enableStaticBatching sets one up.
+
+    Adding a model appends its vertices to the buffers (the first instance
+    of a mesh is indexed and optimized, see optimizeMesh, and reused by the
+    others); removing one only rewrites the index buffer, until the unused
+    vertices outnumber the used ones and the buffers are packed again.
+    Changes may come from any thread. The mesh of an added model is built
+    and transformed by addObject, on the calling thread, which also reads
+    its textures into layers (with their mipmaps) when it is the GL thread;
+    the next render then only uploads what changed.
+    """
+    # position, UV, normal, texture array layer (and padding), color
+    VERTEX = np.dtype([("position", np.float32, 3), ("uv", np.float32, 2),
+                       ("normal", np.float32, 3), ("layer", np.uint16, 2),
+                       ("color", np.uint8, 4)])
+
+    def __init__(self, layerSize=512, program=None):
+        """layerSize is the width and height of the texture array's layers:
+        smaller textures are scaled up to it, larger ones use the mipmap
+        level that fits. Every layer is sampled at this size, so keep it no
+        larger than the textures need: with llvmpipe, 2048 instead of 512
+        costs more per frame than the draw calls saved. program defaults to
+        one built from static_vsrc and static_fsrc.
+        """
+        self.layerSize = layerSize
+        self.ownsProgram = program is None
+        self.program = program or ShaderProgram.fromSource(static_vsrc, static_fsrc)
+
+        # (add, model) waiting for the next render
+        self.lock = threading.Lock()
+        self.pending = []
+
+        # model: [vertices, indices, first vertex in the buffer, textures]
+        self.entries = {}
+        # source model: (arrays, indices, textures) in model coordinates
+        self.meshes = {}
+
+        # texture (None for white): [layer, users]; layers are reused once free
+        self.layers = {}
+        # texture: the pixels of its layer's mipmap levels, kept to refill the
+        # array when it grows; only used on the GL thread (the creating one)
+        self.texturePixels = {}
+        self.freeLayers = []
+        self.layerCapacity = 0
+        self.textureArray = None
+        self.threadId = threading.get_ident()
+
+        self.vertexArrayObject = GL.glGenVertexArrays(1)
+        self.vertexBuffer = GL.glGenBuffers(1)
+        self.indexBuffer = GL.glGenBuffers(1)
+        GL.glBindVertexArray(self.vertexArrayObject)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vertexBuffer)
+        stride = StaticBatch.VERTEX.itemsize
+        fields = StaticBatch.VERTEX.fields
+        attributes = ((3, GL.GL_FLOAT, False, "position"), (2, GL.GL_FLOAT, False, "uv"),
+                      (3, GL.GL_FLOAT, False, "normal"), (1, GL.GL_UNSIGNED_SHORT, False, "layer"),
+                      (4, GL.GL_UNSIGNED_BYTE, True, "color"))
+        for location, (size, dataType, normalized, name) in enumerate(attributes):
+            GL.glVertexAttribPointer(location, size, dataType, normalized, stride,
+                ctypes.c_void_p(fields[name][1]))
+            GL.glEnableVertexAttribArray(location)
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.indexBuffer)
+        GL.glBindVertexArray(0)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, 0)
+
+        self.vertexCapacity = 0
+        self.vertexEnd = 0
+        self.numLiveVertices = 0
+        self.numIndices = 0
+        self.indicesDirty = False
+
+        self.numDrawCalls = 0
+        self.numPacks = 0
+        self.bytesUploaded = 0
+
+    def addObject(self, model):
+        """Adds a static model, building its vertices (see prepareObject) before
+        returning. It is drawn from the next render on.
+        """
+        prepared = self.prepareObject(model)
+        with self.lock:
+            self.pending.append((True, model, prepared))
+
+    def removeObject(self, model):
+        with self.lock:
+            self.pending.append((False, model, None))
+
+    def prepareObject(self, model):
+        """Returns the vertices, indices and textures of a model, from
+        buildVertices. On the GL thread, the layers of its textures are read
+        as well, so applying the change later is only uploads.
+        """
+        vertices, indices, textures = self.buildVertices(model)
+        if threading.get_ident() == self.threadId:
+            for texture in textures:
+                self.getLayerLevels(texture)
+
+        return vertices, indices, textures
+
+    def getMesh(self, model):
+        """Returns (arrays, indices, textures) of a model's mesh: indexed
+        position, UV, normal, texture (an index into textures), and color
+        arrays, in model coordinates. Built once per source model, shared by
+        its instances.
+        """
+        source = model.instanceOf or model
+        mesh = self.meshes.get(source)
+        if mesh is not None:
+            return mesh
+
+        positions = np.array(source.getVertexList(), dtype=np.float32).reshape(-1, 3)
+        uvs = np.array(source.getUVList(), dtype=np.float32).reshape(-1, 2)
+        if len(source.getNormalList()) != positions.size:
+            source.generateNormals()
+        normals = np.array(source.getNormalList(), dtype=np.float32).reshape(-1, 3)
+
+        textures = []
+        textureIndices = np.zeros(len(positions), dtype=np.uint16)
+        colors = np.full((len(positions), 4), 255, dtype=np.uint8)
+        first = 0
+        for p in source.parts:
+            for material, start, count in p.getMaterialRanges():
+                # None is a white layer; Model.getTexture would make a GL
+                # texture for it, and this may not run on the GL thread
+                if material is None:
+                    texture = source.textureObject
+                else:
+                    texture = material.textureObject
+                if texture not in textures:
+                    textures.append(texture)
+                textureIndices[first + start:first + start + count] = textures.index(texture)
+                if material is not None:
+                    colors[first + start:first + start + count] = np.rint(
+                        np.clip(material.getColor(), 0.0, 1.0) * 255.0)
+            first += p.getNumIndices()
+        source.releaseGeometry()
+
+        arrays, indices, report = optimizeMesh([positions, uvs, normals, textureIndices, colors],
+                                               [(0, len(positions))])
+        mesh = (arrays, indices.astype(np.uint32), textures)
+        self.meshes[source] = mesh
+
+        return mesh
+
+    def getLayerLevels(self, texture):
+        """Returns the mipmap levels of a texture's layer (see
+        readTextureLayer), reading and filtering them the first time.
+        """
+        levels = self.texturePixels.get(texture)
+        if levels is None:
+            pixels = readTextureLayer(texture, self.layerSize)
+            image = Image(self.layerSize, self.layerSize, "RGBA", pixels.tobytes())
+            levels = [np.frombuffer(level.pixels, dtype=np.uint8) for level in buildMipmaps(image)]
+            self.texturePixels[texture] = levels
+
+        return levels
+
+    def acquireLayer(self, texture):
+        entry = self.layers.get(texture)
+        if entry is None:
+            layer = self.freeLayers.pop() if self.freeLayers else len(self.layers)
+            if layer >= self.layerCapacity:
+                self.growTextureArray(max(4, 2 * self.layerCapacity))
+            entry = self.layers[texture] = [layer, 0]
+            self.uploadLayer(layer, self.getLayerLevels(texture))
+        entry[1] += 1
+
+        return entry[0]
+
+    def releaseLayer(self, texture):
+        entry = self.layers[texture]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self.layers[texture]
+            del self.texturePixels[texture]
+            self.freeLayers.append(entry[0])
+
+    def growTextureArray(self, capacity):
+        """Replaces the texture array with one of capacity layers, copying the
+        layers in use.
+        """
+        if self.textureArray is not None:
+            GL.glDeleteTextures(1, [self.textureArray])
+
+        size = self.layerSize
+        levels = int(np.log2(size)) + 1
+        self.textureArray = GL.glGenTextures(1)
+        self.layerCapacity = capacity
+        GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, self.textureArray)
+        for level in range(levels):
+            GL.glTexImage3D(GL.GL_TEXTURE_2D_ARRAY, level, GL.GL_RGBA8, max(1, size >> level),
+                max(1, size >> level), capacity, 0, GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, None)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MAG_FILTER, GL.GL_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR_MIPMAP_LINEAR)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D_ARRAY, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, 0)
+
+        for texture, (layer, users) in self.layers.items():
+            self.uploadLayer(layer, self.texturePixels[texture])
+
+    def uploadLayer(self, layer, levels):
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, self.textureArray)
+        for level, pixels in enumerate(levels):
+            size = max(1, self.layerSize >> level)
+            GL.glTexSubImage3D(GL.GL_TEXTURE_2D_ARRAY, level, 0, 0, layer, size, size, 1,
+                GL.GL_RGBA, GL.GL_UNSIGNED_BYTE, pixels)
+            self.bytesUploaded += pixels.nbytes
+        GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, 0)
+
+    def buildVertices(self, model):
+        """Returns (vertices, indices, textures) of a model in world
+        coordinates, its indices starting from 0. Until applyChanges assigns
+        the layers, each vertex's layer is its texture's index in textures.
+        """
+        arrays, indices, textures = self.getMesh(model)
+        positions, uvs, normals, textureIndices, colors = arrays
+
+        matrix = np.array(model.modelMatrix.data, dtype=np.float64)
+        rotation = matrix[:3, :3]
+        # normals by the inverse transpose, which keeps them perpendicular to
+        # the surface under non-uniform scaling
+        transformed = np.array(normals @ np.linalg.inv(rotation), dtype=np.float32)
+        transformed /= np.maximum(np.linalg.norm(transformed, axis=1), 1e-30)[:, None]
+
+        vertices = np.zeros(len(positions), dtype=StaticBatch.VERTEX)
+        vertices["position"] = positions @ rotation.T + matrix[:3, 3]
+        vertices["uv"] = uvs
+        vertices["normal"] = transformed
+        vertices["layer"][:, 0] = textureIndices
+        vertices["color"] = colors
+
+        return vertices, indices, textures
+
+    def applyChanges(self):
+        """Applies the objects added and removed since the last render.
+        """
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+
+        appended = []
+        for add, model, prepared in pending:
+            if add and model not in self.entries:
+                vertices, indices, textures = prepared
+                layers = np.array([self.acquireLayer(t) for t in textures] or [0], dtype=np.uint16)
+                vertices["layer"][:, 0] = layers[vertices["layer"][:, 0]]
+                self.entries[model] = [vertices, indices, self.vertexEnd, textures]
+                appended.append(model)
+                self.vertexEnd += len(vertices)
+                self.numLiveVertices += len(vertices)
+                self.indicesDirty = True
+            elif not add and model in self.entries:
+                vertices, indices, first, textures = self.entries.pop(model)
+                for texture in textures:
+                    self.releaseLayer(texture)
+                if model in appended:
+                    appended.remove(model)
+                self.numLiveVertices -= len(vertices)
+                self.indicesDirty = True
+
+        # layers read for models removed before they were drawn
+        for texture in [t for t in self.texturePixels if t not in self.layers]:
+            del self.texturePixels[texture]
+
+        # the appended vertices fit after the others, or everything is packed
+        wasted = self.vertexEnd - self.numLiveVertices
+        if self.vertexEnd > self.vertexCapacity or wasted > self.numLiveVertices:
+            self.packVertices()
+        else:
+            stride = StaticBatch.VERTEX.itemsize
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vertexBuffer)
+            for model in appended:
+                vertices, indices, first, textures = self.entries[model]
+                GL.glBufferSubData(GL.GL_ARRAY_BUFFER, first * stride, vertices.nbytes, vertices)
+                self.bytesUploaded += vertices.nbytes
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+
+        if self.indicesDirty:
+            indices = [entry[1] + entry[2] for entry in self.entries.values()]
+            indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.uint32)
+
+            # bound as an array buffer, so the vertex array's binding is untouched
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.indexBuffer)
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, indices, GL.GL_STATIC_DRAW)
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+            self.bytesUploaded += indices.nbytes
+            self.numIndices = len(indices)
+            self.indicesDirty = False
+
+    def packVertices(self):
+        """Moves every object's vertices next to each other, in a buffer with
+        room to grow, and uploads them all.
+        """
+        first = 0
+        for entry in self.entries.values():
+            entry[2] = first
+            first += len(entry[0])
+        self.vertexEnd = self.numLiveVertices = first
+        self.vertexCapacity = max(1024, 2 * first)
+
+        vertices = np.zeros(self.vertexCapacity, dtype=StaticBatch.VERTEX)
+        for entry in self.entries.values():
+            vertices[entry[2]:entry[2] + len(entry[0])] = entry[0]
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.vertexBuffer)
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, vertices, GL.GL_STATIC_DRAW)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        self.bytesUploaded += first * StaticBatch.VERTEX.itemsize
+        self.numPacks += 1
+        self.indicesDirty = True
+
+    def render(self, viewMatrix, projMatrix):
+        """Draws every static object with the batch's program, then makes the
+        program in use before current again.
+        """
+        if self.pending:
+            self.applyChanges()
+
+        self.numDrawCalls = 0
+        if not self.numIndices:
+            return
+
+        previous = ShaderProgram.current
+        self.program.use()
+        GL.glUniformMatrix4fv(self.program.getUniformLocation("projection"), 1, False,
+            projMatrix.getCType())
+        GL.glUniformMatrix4fv(self.program.getUniformLocation("modelview"), 1, False,
+            viewMatrix.getCType())
+        GL.glUniform1i(self.program.getUniformLocation("sampler"), 0)
+
+        GL.glBindVertexArray(self.vertexArrayObject)
+        GL.glActiveTexture(GL.GL_TEXTURE0)
+        GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, self.textureArray)
+        GL.glDrawElements(GL.GL_TRIANGLES, self.numIndices, GL.GL_UNSIGNED_INT, None)
+        GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, 0)
+        GL.glBindVertexArray(0)
+        self.numDrawCalls = 1
+
+        if previous is not None:
+            previous.use()
+
+    def getStats(self):
+        """Returns the objects, vertices, indices, and texture layers in the
+        batch, the draw calls of the last render, how often the vertices
+        were packed, and the bytes uploaded so far.
+        """
+        return {"objects": len(self.entries), "vertices": self.numLiveVertices,
+                "indices": self.numIndices, "layers": len(self.layers),
+                "drawCalls": self.numDrawCalls, "packs": self.numPacks,
+                "bytesUploaded": self.bytesUploaded}
+
+    def cleanup(self):
+        GL.glDeleteBuffers(2, [self.vertexBuffer, self.indexBuffer])
+        GL.glDeleteVertexArrays(1, [self.vertexArrayObject])
+        if self.textureArray is not None:
+            GL.glDeleteTextures(1, [self.textureArray])
+        self.textureArray = None
+        if self.ownsProgram:
+            self.program.cleanup()
@@ -0,0 +1,286 @@
+import time
+import threading
+from . import OBJReader, parseOBJ, decodeImage, buildMipmaps
+
+class ModelHandle(object):
+    """Stands in for a model being loaded by an AssetStreamer. model is set
+    once the files have been read, and can be drawn once the handle is
+    resident.
+    """
+    QUEUED = 0
+    DECODING = 1
+    UPLOADING = 2
+    RESIDENT = 3
+    CANCELLED = 4
+    FAILED = 5
+
+    def __init__(self, streamer, file, textureFile, priority, sequence):
+        self.streamer = streamer
+        self.file = file
+        self.textureFile = textureFile
+        self.priority = priority
+        self.sequence = sequence
+        self.state = ModelHandle.QUEUED
+
+        self.model = None
+        self.mipmaps = None
+        self.steps = None
+        self.error = None
+
+        # applied when the model becomes resident
+        self.position = None
+        self.scene = None
+        self.onResident = None
+
+    def getOrder(self):
+        return (self.priority, self.sequence)
+
+    def isResident(self):
+        return self.state == ModelHandle.RESIDENT
+
+    def isDone(self):
+        return self.state in (ModelHandle.RESIDENT, ModelHandle.CANCELLED,
+                              ModelHandle.FAILED)
+
+    def setPriority(self, priority):
+        """Changes the priority of a model still being decoded or uploaded;
+        smaller values load first.
+        """
+        self.priority = priority
+
+    def cancel(self):
+        self.streamer.cancel(self)
+
+class AssetStreamer(object):
+    """Loads models while the main loop runs. The files are read, decoded
+    and mipmapped on worker threads; the GL uploads are queued and run on the
+    GL thread by uploadFrame (called by GLWindow every frame when set as its
+    streamer), which aims to spend at most maxUploadMS and maxUploadBytes per
+    frame: each step is cut to the bytes the last measured upload rate says
+    still fit, and no step is started that the last one suggests would not.
+    Allocating a large buffer or texture is a single call that can take
+    longer than that (about 13 ms for a 2048x2048 texture with llvmpipe),
+    so it is done first thing in a frame, and that frame does nothing else.
+    Models become resident (and are added to the scene) once every byte is
+    uploaded.
+    """
+    def __init__(self, scene=None, workers=2, maxUploadMS=2.0,
+                 maxUploadBytes=4 * 2**20, chunkBytes=256 * 1024,
+                 minChunkBytes=16 * 1024):
+        """Uploads are split into steps of at most chunkBytes; a step is not
+        started if less than minChunkBytes fit in what is left of the frame.
+        """
+        self.scene = scene
+        self.maxUploadMS = maxUploadMS
+        self.maxUploadBytes = maxUploadBytes
+        self.chunkBytes = chunkBytes
+        self.minChunkBytes = minChunkBytes
+
+        # cost of the last step, and of its bytes if it uploaded any
+        self.lastStepTime = 0.0
+        self.msPerByte = None
+
+        self.condition = threading.Condition()
+        self.pending = []
+        self.uploading = []
+        self.sequence = 0
+        self.decoding = 0
+        self.running = True
+
+        self.lastFrameBytes = 0
+        self.lastFrameTime = 0.0
+        self.maxFrameTime = 0.0
+        self.totalBytes = 0
+
+        self.workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self.workerLoop, name="streamer_%d" % i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def loadModel(self, file, textureFile=None, priority=0, position=None,
+                  addToScene=True, onResident=None):
+        """Queues an .obj file (and its diffuse texture) for loading and
+        returns its ModelHandle right away. Smaller priorities load first.
+        Once resident, the model is moved to position, added to the
+        streamer's scene if addToScene, and onResident(handle) is called.
+        """
+        with self.condition:
+            handle = ModelHandle(self, file, textureFile, priority, self.sequence)
+            handle.position = position
+            handle.scene = self.scene if addToScene else None
+            handle.onResident = onResident
+            self.sequence += 1
+
+            self.pending.append(handle)
+            self.condition.notify()
+
+        return handle
+
+    def cancel(self, handle):
+        """Stops loading a model. GL objects already created for it are
+        deleted by the next uploadFrame.
+        """
+        with self.condition:
+            if handle.isDone():
+                return
+
+            handle.state = ModelHandle.CANCELLED
+            if handle in self.pending:
+                self.pending.remove(handle)
+
+    def workerLoop(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running:
+                    return
+
+                handle = min(self.pending, key=ModelHandle.getOrder)
+                self.pending.remove(handle)
+                handle.state = ModelHandle.DECODING
+                self.decoding += 1
+
+            try:
+                model = OBJReader.buildModel(parseOBJ(handle.file), handle.file)
+                model.prepareVertexData(withMipmaps=True)
+
+                mipmaps = None
+                if handle.textureFile:
+                    mipmaps = buildMipmaps(decodeImage(handle.textureFile))
+            except Exception as e:
+                with self.condition:
+                    handle.error = e
+                    handle.state = ModelHandle.FAILED
+                    self.decoding -= 1
+                continue
+
+            with self.condition:
+                self.decoding -= 1
+                if handle.state == ModelHandle.CANCELLED:
+                    continue
+
+                handle.model = model
+                handle.mipmaps = mipmaps
+                handle.state = ModelHandle.UPLOADING
+                self.uploading.append(handle)
+
+    def getUploadSteps(self, handle):
+        """Generator over the upload steps of a model, passing on the step
+        sizes sent to it (see Model.uploadSteps).
+        """
+        yield from handle.model.uploadSteps(self.chunkBytes)
+
+        if handle.mipmaps:
+            yield from handle.model.textureUploadSteps(handle.mipmaps, self.chunkBytes)
+
+    def uploadFrame(self):
+        """Runs queued upload steps, most urgent model first, until this
+        frame's time or byte budget is spent; at least one step runs, so
+        uploads always progress. Must be called on the GL thread. Returns the
+        number of bytes uploaded.
+        """
+        startTime = time.perf_counter()
+        uploaded = 0
+        elapsed = 0.0
+        numSteps = 0
+
+        self.removeCancelled()
+        while uploaded < self.maxUploadBytes:
+            remaining = self.maxUploadMS - elapsed
+            size = min(self.chunkBytes, self.maxUploadBytes - uploaded)
+            if self.msPerByte:
+                size = min(size, int(remaining / self.msPerByte))
+            if numSteps and (self.lastStepTime > remaining or size < self.minChunkBytes):
+                break
+            size = max(size, self.minChunkBytes)
+
+            with self.condition:
+                # models cancelled meanwhile are cleaned up next frame
+                uploading = [h for h in self.uploading if h.state == ModelHandle.UPLOADING]
+                if not uploading:
+                    break
+                handle = min(uploading, key=ModelHandle.getOrder)
+
+            stepStart = time.perf_counter()
+            try:
+                if handle.steps is None:
+                    handle.steps = self.getUploadSteps(handle)
+                    result = next(handle.steps)
+                else:
+                    result = handle.steps.send(size)
+            except StopIteration:
+                self.finish(handle)
+                result = 0
+
+            # None comes before a large allocation, which starts a frame
+            if result is None:
+                if numSteps:
+                    break
+                continue
+
+            stepTime = (time.perf_counter() - stepStart) * 1000.0
+            numSteps += 1
+            uploaded += result
+            self.lastStepTime = stepTime
+            if result:
+                self.msPerByte = stepTime / result
+
+            elapsed = (time.perf_counter() - startTime) * 1000.0
+
+        self.lastFrameBytes = uploaded
+        self.lastFrameTime = elapsed
+        self.maxFrameTime = max(self.maxFrameTime, elapsed)
+        self.totalBytes += uploaded
+
+        return uploaded
+
+    def removeCancelled(self):
+        with self.condition:
+            cancelled = [h for h in self.uploading if h.state == ModelHandle.CANCELLED]
+            for handle in cancelled:
+                self.uploading.remove(handle)
+
+        for handle in cancelled:
+            if handle.steps is not None:
+                handle.steps.close()
+            handle.model.cleanup()
+            handle.model = None
+            handle.mipmaps = None
+
+    def finish(self, handle):
+        with self.condition:
+            self.uploading.remove(handle)
+            handle.state = ModelHandle.RESIDENT
+        handle.steps = None
+        handle.mipmaps = None
+
+        if handle.position is not None:
+            handle.model.setPosition(handle.position)
+        if handle.scene is not None:
+            handle.scene.addObject(handle.model)
+        if handle.onResident:
+            handle.onResident(handle)
+
+    def isIdle(self):
+        """Returns True when nothing is queued, decoding, or uploading.
+        """
+        with self.condition:
+            return not self.pending and not self.uploading and self.decoding == 0
+
+    def close(self):
+        """Stops the workers and deletes the GL objects of unfinished models.
+        Must be called on the GL thread.
+        """
+        with self.condition:
+            self.running = False
+            for handle in self.pending + self.uploading:
+                handle.state = ModelHandle.CANCELLED
+            self.pending = []
+            self.condition.notify_all()
+
+        for worker in self.workers:
+            worker.join()
+        self.removeCancelled()
@@ -1,9 +1,37 @@
+import time
+startTime = time.perf_counter()
+
+import os
 import ctypes
+
+# ETGG2801_OFFSCREEN=egl (or osmesa) renders without a window, for
+# ETGG2801_FRAMES frames; the PyOpenGL platform has to match
+offscreen = os.environ.get("ETGG2801_OFFSCREEN")
+if offscreen:
+    os.environ["PYOPENGL_PLATFORM"] = offscreen
+
+# etgg2801 comes first so ETGG2801_PRODUCTION can configure PyOpenGL
+from etgg2801 import *
 import sdl2
 from math import *
 import random
 from OpenGL import GL
-from etgg2801 import *
+
+# the assets are parsed and decoded on worker threads (or, with
+# ETGG2801_PRELOAD_PROCESSES=1, the model in worker processes) while the
+# window is created; ETGG2801_TIMELINE=1 (or a .json trace file) reports it
+preloader = AssetPreloader(processes=bool(os.environ.get("ETGG2801_PRELOAD_PROCESSES")),
+    startTime=startTime)
+preloader.record("imports", startTime, time.perf_counter())
+
+# ETGG2801_STREAM=1 streams the boat in while the loop runs instead
+stream = bool(os.environ.get("ETGG2801_STREAM"))
+if not stream:
+    preloader.addImage("boat_diffuse", "boat_diffuse.png")
+    preloader.addModel("boat", "boat.obj")
+preloader.addImage("wood", "wood.png")
+preloader.addImage("reticle", "reticle.png")
+preloader.addImage("rockman", "rockman.png")
 
 texture_phong_vsrc = b'''
 #version 400
@@ -37,9 +65,10 @@ in vec4 eyeVertex;
 out vec4 FragColor;
 
 uniform sampler2D sampler;
+uniform vec4 diffuseColor;
 
 void main() {
-    vec4 c = texture(sampler, texCoord).rgba;
+    vec4 c = texture(sampler, texCoord).rgba * diffuseColor;
     FragColor = clamp(c, 0.0, 1.0);
 }
 '''
@@ -50,12 +79,6 @@ class MyDelegate(GLWindowRenderDelegate):
         
         self.initShaders()
         
-        # location of model matrix in shader program
-        self.modelview_loc = GL.glGetUniformLocation(self.shaderProgram, b"modelview")
-        self.model_loc = GL.glGetUniformLocation(self.shaderProgram, b"model")
-        self.projection_loc = GL.glGetUniformLocation(self.shaderProgram, b"projection")
-        self.sampler_loc = GL.glGetUniformLocation(self.shaderProgram, b"sampler")
-        
         # set background color to black
         GL.glClearColor(0.0, 0.0, 0.0, 1.0)
         
@@ -73,58 +96,99 @@ class MyDelegate(GLWindowRenderDelegate):
         self.scene = Scene()
         self.scene.camera.setAspect(window.size[0], window.size[1])
         
-    def initShaders(self):
-        
-        # build vertex shader object
-        self.vertexShader = GL.glCreateShader(GL.GL_VERTEX_SHADER)
-        GL.glShaderSource(self.vertexShader, texture_phong_vsrc)
-        GL.glCompileShader(self.vertexShader)
-        result = GL.glGetShaderiv(self.vertexShader, GL.GL_COMPILE_STATUS)
-        if result != 1:
-            print(GL.glGetShaderInfoLog(self.vertexShader))
-            raise Exception("Error compiling vertex shader")
+        # ETGG2801_FLEET=N adds a headless simulation of N robots to every
+        # update, standing in for heavy game logic
+        self.fleet = None
+        fleetSize = int(os.environ.get("ETGG2801_FLEET", 0))
+        if fleetSize:
+            self.fleet = FleetSimulation.fromJoints(Viper.getJoints(), fleetSize)
         
-        # build fragment shader object
-        self.fragmentShader = GL.glCreateShader(GL.GL_FRAGMENT_SHADER)
-        GL.glShaderSource(self.fragmentShader, texture_phong_fsrc)
-        GL.glCompileShader(self.fragmentShader)
-        result = GL.glGetShaderiv(self.fragmentShader, GL.GL_COMPILE_STATUS)
-        if result != 1:
-            print(GL.glGetShaderInfoLog(self.fragmentShader))
-            raise Exception("Error compiling fragment shader")
-        
-        # build shader program and attach shader objects
-        self.shaderProgram = GL.glCreateProgram()
-        GL.glAttachShader(self.shaderProgram, self.vertexShader)
-        GL.glAttachShader(self.shaderProgram, self.fragmentShader)
-        GL.glLinkProgram(self.shaderProgram)
+    def initShaders(self):
+        # linked programs are cached in ETGG2801_SHADER_CACHE (by default
+        # ~/.cache/etgg2801/shaders), so only the first launch compiles them
+        cacheDir = os.environ.get("ETGG2801_SHADER_CACHE",
+            os.path.join(os.path.expanduser("~"), ".cache", "etgg2801", "shaders"))
+        self.shaders = ShaderManager(cacheDir or None)
+        self.shaderProgram = self.shaders.getProgram("texture_phong",
+            texture_phong_vsrc, texture_phong_fsrc)
         
     def cleanup(self):
         self.scene.cleanup()
-        GL.glDeleteShader(self.vertexShader)
-        GL.glDeleteShader(self.fragmentShader)
-        GL.glDeleteProgram(self.shaderProgram)
+        self.shaders.cleanup()
     
     def update(self, dtime):
         self.scene.update(dtime)
+        if self.fleet:
+            self.fleet.update(dtime)
+            self.fleet.getLinkTransforms()
+    
+    def render(self, alpha=1.0):
+        self.renderSnapshot(None, alpha)
+    
+    def createSnapshot(self):
+        return self.scene.createSnapshot()
+    
+    def writeSnapshot(self, snapshot):
+        self.scene.writeSnapshot(snapshot)
     
-    def render(self):
+    def renderSnapshot(self, snapshot, alpha=1.0):
         GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
         
-        GL.glUseProgram(self.shaderProgram)
+        self.shaderProgram.use()
         
-        self.scene.render()
+        self.scene.render(alpha, snapshot)
         
         GL.glUseProgram(0)
 
-window = GLWindow((1000, 400))
-window.setRenderDelegate(MyDelegate())
+with preloader.track("create window"):
+    window = GLWindow((1000, 400), offscreen=offscreen)
+window.interpolation = True
 
-dm = OBJReader.readFile('boat.obj')
-dm.addDiffuseTexture('boat_diffuse.png')
-dm.loadToVRAM()
+# ETGG2801_THREADED=1 runs the updates on their own thread
+window.threaded = bool(os.environ.get("ETGG2801_THREADED"))
 
-dm.setPosition(Vector4((0, 0, -1, 1)))
+# ETGG2801_RECORD_INPUT=file records the input of every update step, and
+# ETGG2801_REPLAY_INPUT=file replays it (offscreen, for as many frames)
+recordFile = os.environ.get("ETGG2801_RECORD_INPUT")
+replayFile = os.environ.get("ETGG2801_REPLAY_INPUT")
+if recordFile:
+    window.input = InputRecorder(window.input, recordFile, window.timeStep)
+elif replayFile:
+    window.input = InputPlayer(replayFile)
+with preloader.track("compile shaders"):
+    window.setRenderDelegate(MyDelegate())
+
+preloader.wait()
+
+uploadStart = time.perf_counter()
+if stream:
+    window.streamer = AssetStreamer(window.renderDelegate.scene)
+    window.streamer.loadModel('boat.obj', 'boat_diffuse.png',
+        position=Vector4((0, 0, -1, 1)))
+else:
+    dm = OBJReader.buildModel(preloader.get("boat"), "boat.obj")
+    dm.addDiffuseTexture(preloader.get("boat_diffuse"))
+    
+    # ETGG2801_QUANTIZE=1 uploads the boat in the compact vertex formats
+    dm.setQuantized(bool(os.environ.get("ETGG2801_QUANTIZE")))
+    
+    # ETGG2801_OPTIMIZE_MESH=1 uploads it indexed, in vertex cache order
+    dm.setOptimized(bool(os.environ.get("ETGG2801_OPTIMIZE_MESH")))
+    
+    # ETGG2801_RESIDENCY=keep, compact or drop: what happens to the boat's
+    # vertex lists once uploaded
+    residency = os.environ.get("ETGG2801_RESIDENCY", "keep").upper()
+    dm.setResidency(getattr(Model, residency))
+    dm.loadToVRAM()
+    if dm.getQuantizationReport():
+        report = dm.getQuantizationReport()
+        print("Boat vertices: %d bytes, %d as floats" % (report["bytes"], report["floatBytes"]))
+    if dm.getOptimizationReport():
+        report = dm.getOptimizationReport()
+        print("Boat vertex cache: ACMR %.3f -> %.3f  ATVR %.3f -> %.3f  (%d of %d vertices)" %
+              (report["acmrBefore"], report["acmr"], report["atvrBefore"], report["atvr"],
+               report["uniqueVertices"], report["vertices"]))
+    dm.setPosition(Vector4((0, 0, -1, 1)))
 
 plane = ModelPart()
 plane.addVertices([-1, 0,   1,
@@ -136,26 +200,86 @@ plane.addIndices([0, 1, 2, 3, 0, 2])
 plane.addUVIndices([0, 1, 2, 3, 0, 2])
 planeModel = Model()
 planeModel.addPart(plane)
-planeModel.addDiffuseTexture('wood.png')
+planeModel.addDiffuseTexture(preloader.get("wood"))
 planeModel.loadToVRAM()
 planeModel.setPosition(Vector4((0, 0, -1, 1)))
 
-plane2 = ModelPart()
-plane2.addVertices([-0.2,  0.2, -0.2,
-                    -0.2, -0.2, -0.2,
-                     0.2, -0.2, -0.2,
-                     0.2,  0.2, -0.2])
-
-plane2.addUVS([0,0, 0,1, 1,1, 1,0])
-plane2.addIndices([0, 1, 2, 3, 0, 2])
-plane2.addUVIndices([0, 1, 2, 3, 0, 2])
-planeModel2 = HUDModel()
-planeModel2.addPart(plane2)
-planeModel2.addDiffuseTexture('reticle.png')
-planeModel2.loadToVRAM()
-
-window.renderDelegate.scene.addObject(dm)
+# the HUD images share one atlas texture and are drawn in one batch
+atlas = TextureAtlas(size=512)
+atlas.addImage("reticle", preloader.get("reticle"))
+atlas.addImage("rockman", preloader.get("rockman"))
+hud = HUDLayer(window.size, atlas, shaders=window.renderDelegate.shaders)
+hud.addSprite("reticle", width=116, height=116, anchor=(0.5, 0.5), pivot=(0.5, 0.5))
+hud.addSprite("rockman", x=8, y=-8, width=64, height=64, anchor=(0.0, 1.0), pivot=(0.0, 1.0))
+preloader.record("upload to GL", uploadStart, time.perf_counter())
+
+# ETGG2801_STATIC=1 draws the plane and the boat (neither moves) merged into
+# one static batch
+if os.environ.get("ETGG2801_STATIC"):
+    window.renderDelegate.scene.enableStaticBatching()
+    planeModel.setStatic()
+    if not stream:
+        dm.setStatic()
+
+if not stream:
+    window.renderDelegate.scene.addObject(dm)
 window.renderDelegate.scene.addObject(planeModel)
-window.renderDelegate.scene.addHUDObject(planeModel2)
+window.renderDelegate.scene.setHUD(hud)
+
+# ETGG2801_MEMORY=1 reports what the models take in Python and in GL
+if os.environ.get("ETGG2801_MEMORY"):
+    for name, model in (("boat", None if stream else dm), ("plane", planeModel)):
+        if model:
+            usage = model.getMemoryUsage()
+            print("%-6s cpu %9d  gpu %9d  textures %s" % (name, usage["cpu"],
+                usage["gpu"], usage["textures"]))
+    totals = Model.getTotalMemoryUsage()
+    print("models cpu %9d  gpu %9d  process %s" % (totals["cpu"], totals["gpu"],
+        totals["process"]))
+
+timelineFile = os.environ.get("ETGG2801_TIMELINE")
+if timelineFile:
+    preloader.printTimeline()
+    if timelineFile.endswith(".json"):
+        preloader.writeTrace(timelineFile)
+
+# ETGG2801_CAPTURE=file.json (speedscope) or file.txt (collapsed stacks)
+# samples the main loop's stack for ETGG2801_CAPTURE_FRAMES frames; F9
+# captures window.captureFrames frames at any time
+captureFile = os.environ.get("ETGG2801_CAPTURE")
+if captureFile:
+    window.startCapture(int(os.environ.get("ETGG2801_CAPTURE_FRAMES", 60)), captureFile)
+
+# ETGG2801_RECORD_FRAMES=directory saves every frame as a PNG file, and
+# ETGG2801_RECORD_PIPE=command writes them raw (RGBA, top row first) to the
+# command's standard input, e.g. "ffmpeg -f rawvideo -pix_fmt rgba -s
+# 1000x400 -r 60 -i - out.mp4"; F12 takes a screenshot at any time
+framesDir = os.environ.get("ETGG2801_RECORD_FRAMES")
+framesPipe = os.environ.get("ETGG2801_RECORD_PIPE")
+if framesDir or framesPipe:
+    window.startFrameCapture(framesDir, framesPipe)
+
+if offscreen:
+    numFrames = int(os.environ.get("ETGG2801_FRAMES", 300))
+    if replayFile:
+        numFrames = window.input.numTicks
+    profiler = window.enableProfiler(glAccounting=bool(os.environ.get("ETGG2801_GLCALLS")))
+    
+    # ETGG2801_REALTIME=1 follows the clock instead of one update per frame
+    # (the threaded mode always does), to compare the two modes
+    realtime = window.threaded or os.environ.get("ETGG2801_REALTIME")
+    fps = window.mainLoop(numFrames=numFrames, stepsPerFrame=None if realtime else 1)
+    print("Frames:", numFrames, "FPS:", fps)
+    profiler.printSummary()
+    
+    # ETGG2801_PROFILE=file.csv (or .json) saves every frame's phase times
+    profileFile = os.environ.get("ETGG2801_PROFILE")
+    if profileFile and profileFile.endswith(".json"):
+        profiler.writeJSON(profileFile)
+    elif profileFile:
+        profiler.writeCSV(profileFile)
+else:
+    window.mainLoop()
 
-window.mainLoop()
\ No newline at end of file
+if recordFile:
+    window.input.close()
\ No newline at end of file
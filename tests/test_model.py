@@ -0,0 +1,100 @@
+import os
+os.environ.setdefault("PYOPENGL_PLATFORM", "egl")
+
+import pytest
+import numpy as np
+from etgg2801 import (GLWindow, ShaderProgram, OBJReader, TextureCache,
+    decodeImage, buildMipmaps)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+vsrc = """#version 330
+layout(location = 0) in vec3 position;
+void main() { gl_Position = vec4(position, 1.0); }
+"""
+
+fsrc = """#version 330
+uniform vec4 diffuseColor;
+out vec4 color;
+void main() { color = diffuseColor; }
+"""
+
+MTL = """newmtl rock
+Kd 0.5 0.5 0.5
+map_Kd %s
+
+newmtl wood2
+Kd 0.8 0.6 0.4
+map_Kd %s
+""" % (os.path.join(ROOT, "wood.png"), os.path.join(ROOT, "reticle.png"))
+
+# object B moves from textured materials to one missing from the library,
+# so its untextured batch is drawn after textured ones
+OBJ = """mtllib mixed.mtl
+o A
+v 0 0 0
+v 1 0 0
+v 0 1 0
+vt 0 0
+vt 1 0
+vt 0 1
+usemtl rock
+f 1/1 2/2 3/3
+o B
+usemtl rock
+f 1/1 2/2 3/3
+usemtl wood2
+f 1/1 2/2 3/3
+usemtl missing
+f 1/1 2/2 3/3
+"""
+
+@pytest.fixture(scope="module")
+def program():
+    try:
+        GLWindow((64, 64), offscreen=os.environ["PYOPENGL_PLATFORM"])
+    except Exception as e:
+        pytest.skip("no offscreen GL context: %s" % e)
+
+    program = ShaderProgram.fromSource(vsrc, fsrc)
+    program.use()
+    yield program
+    program.cleanup()
+
+def test_untextured_batches_after_textured(tmp_path, program):
+    (tmp_path / "mixed.mtl").write_text(MTL)
+    (tmp_path / "mixed.obj").write_text(OBJ)
+
+    model = OBJReader.readFile(str(tmp_path / "mixed.obj"))
+    model.loadToVRAM()
+    assert model.textureObject is None
+
+    model.renderAllParts()
+    model.renderPartByName("A")
+    model.renderPartByName("B")
+    model.cleanup()
+
+def test_chunked_material_textures(tmp_path, program):
+    from OpenGL import GL
+    (tmp_path / "mixed.mtl").write_text(MTL)
+    (tmp_path / "mixed.obj").write_text(OBJ)
+
+    model = OBJReader.readFile(str(tmp_path / "mixed.obj"))
+    model.prepareVertexData(withMipmaps=True)
+    steps = list(model.uploadSteps(chunkBytes=64 * 1024))
+    assert max(s for s in steps if s is not None) <= 64 * 1024
+
+    # level 1 comes from buildMipmaps, not glGenerateMipmap
+    cache = TextureCache.getInstance()
+    file = os.path.join(ROOT, "wood.png")
+    assert cache.contains(file)
+    level = buildMipmaps(decodeImage(file))[1]
+    GL.glBindTexture(GL.GL_TEXTURE_2D, cache.acquire(file))
+    pixels = GL.glGetTexImage(GL.GL_TEXTURE_2D, 1, GL.GL_RGB, GL.GL_UNSIGNED_BYTE)
+    GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+    cache.release(file)
+    assert np.array_equal(np.frombuffer(pixels, np.uint8), np.frombuffer(level.pixels, np.uint8))
+
+    model.renderAllParts()
+    model.cleanup()
+    assert not cache.contains(file)
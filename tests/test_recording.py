@@ -0,0 +1,32 @@
+import pytest
+from etgg2801 import Scara, TrajectoryRecorder, TrajectoryPlayer
+
+def test_roundtrip(tmp_path):
+    robot = Scara()
+    file = str(tmp_path / "scara.jtrk")
+    recorder = TrajectoryRecorder(robot, file, timeStep=10, chunkFrames=4)
+    for i in range(10):
+        for j in robot.joints:
+            j.value = float(i)
+        recorder.addFrame([j.value for j in robot.joints])
+    recorder.close()
+
+    player = TrajectoryPlayer(file)
+    assert player.numFrames == 10
+    assert list(player.getFrame(5)) == [5.0] * len(robot.joints)
+    assert list(player.getValues(25.0)) == [2.5] * len(robot.joints)
+    player.close()
+
+def test_empty_log(tmp_path):
+    robot = Scara()
+    file = str(tmp_path / "empty.jtrk")
+    TrajectoryRecorder(robot, file).close()
+
+    player = TrajectoryPlayer(file)
+    assert player.numFrames == 0
+    assert player.getDuration() == 0
+    with pytest.raises(Exception, match="no frames"):
+        player.getFrame(0)
+    with pytest.raises(Exception, match="no frames"):
+        player.getValues(0)
+    player.close()